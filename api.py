@@ -1,22 +1,99 @@
-from flask import Flask, request
+from flask import Flask, Response, request, stream_with_context
 import werkzeug
 import os
 import json
-import subprocess
-from graph import TikzGrapher
+import logging
+from graph import DOC_END, DOC_START, TikzGrapher, pages_doc
 from utils.style import LineStyle, NodeStyle
-from utils.parse import read_adj_mat_txt, svg_to_html, parse_style
-import subprocess
+from utils.parse import read_adj_mat_txt, read_edge_list_txt, svg_to_html, parse_style, decode_upload
+from utils.adjacency import EdgeLabels
+from utils.cache import LayoutCache, SvgCache
+from utils.render import RenderError, TexWorkerPool
+from utils.jobs import JobManager
+from utils.layout import LAYOUT_METHODS, dump_layout, layout_many, load_layout
+from utils import metrics
 import base64
 import io
 
 app = Flask(__name__)
+log = logging.getLogger(__name__)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
 
 str_to_bool = lambda s: True if s == "True" else False
 cap_size = lambda s: min(float(s), 2)
 labelmap = lambda s: None if s == "None" else "numbered"
 outer_sep_map = lambda s: None if s == "None" else float(s)
 seed_map = lambda s: None if s == "" else int(s)
+components_map = lambda s: {"True": True, "False": False}.get(str(s))
+
+# process pool size, and the largest time budget (seconds) and number of
+# trials a request can ask for, for the min-crossing search
+LAYOUT_WORKERS = int(os.environ.get("LAYOUT_WORKERS", os.cpu_count() or 1))
+LAYOUT_TIME_BUDGET = float(os.environ.get("LAYOUT_TIME_BUDGET", 10))
+LAYOUT_MAX_TRIALS = int(os.environ.get("LAYOUT_MAX_TRIALS", 200))
+
+# the "quality" of the min-crossing search trades crossings for latency: the
+# number of trials, the trials without improvement after which it stops, and
+# the fraction of LAYOUT_TIME_BUDGET it may use
+SEARCH_QUALITY = {
+    "fast": {"max_trials": 10, "patience": 3, "budget": 0.2},
+    "balanced": {"max_trials": 50, "patience": 10, "budget": 0.5},
+    "best": {"max_trials": LAYOUT_MAX_TRIALS, "patience": None, "budget": 1},
+}
+
+# the most graphs a /tikz_batch request may render
+BATCH_MAX_GRAPHS = int(os.environ.get("BATCH_MAX_GRAPHS", 100))
+
+# layouts are shared between requests that only differ in style
+layout_cache = LayoutCache(
+    maxsize=int(os.environ.get("LAYOUT_CACHE_SIZE", 256)),
+    cache_dir=os.environ.get("LAYOUT_CACHE_DIR") or None,
+)
+
+# compiled documents, and the warm pdflatex workers that compile them
+svg_cache = SvgCache(
+    maxsize=int(os.environ.get("SVG_CACHE_SIZE", 256)),
+    cache_dir=os.environ.get("SVG_CACHE_DIR") or None,
+)
+tex_pool = TexWorkerPool(
+    size=int(os.environ.get("TEX_WORKERS", 2)),
+    timeout=float(os.environ.get("TEX_TIMEOUT", 30)),
+)
+
+# background renders for the /jobs endpoints
+jobs = JobManager(workers=int(os.environ.get("JOB_WORKERS", 2)))
+
+# add a Server-Timing header with the stage timings to every response
+SERVER_TIMING = str_to_bool(os.environ.get("SERVER_TIMING", "False"))
+
+# metrics for /metrics, besides the stage timings (see utils.metrics)
+REQUESTS_IN_FLIGHT = metrics.registry.gauge(
+    "tikz_requests_in_flight", "Requests being handled.", labels=("endpoint",)
+)
+LAYOUT_TRIALS = metrics.registry.histogram(
+    "tikz_layout_trials",
+    "Seed trials run by each min-crossing layout search.",
+    buckets=(1, 2, 5, 10, 20, 50, 100),
+)
+LAYOUT_CROSSINGS = metrics.registry.histogram(
+    "tikz_layout_crossings",
+    "Edge crossings of the layout chosen by each min-crossing search.",
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 1000),
+)
+CACHES = {"layout": layout_cache, "svg": svg_cache}
+for _field, _kind in (("hits", "counter"), ("misses", "counter"), ("hit_rate", "gauge")):
+    getattr(metrics.registry, _kind)(
+        f"tikz_cache_{_field}" + ("_total" if _kind == "counter" else ""),
+        f"Cache {_field.replace('_', ' ')}.",
+        labels=("cache",),
+        callback=lambda field=_field: {(name,): c.stats()[field] for name, c in CACHES.items()},
+    )
+metrics.registry.gauge(
+    "tikz_jobs_in_flight", "Background jobs queued or running.", callback=lambda: jobs.in_flight()
+)
+metrics.registry.gauge(
+    "tikz_compiles_in_flight", "Documents queued or compiling.", callback=lambda: tex_pool.in_flight()
+)
 
 LINE_DEFAULTS = {
     "color": ("black", str),
@@ -39,8 +116,14 @@ LAYOUT_DEFAULTS = {
     "loops_are_nodes": (False, str_to_bool),
     "labels": (None, labelmap),
     "scale": (3, float),
+    "method": ("spring", str),
+    "components": (None, components_map),
 }
 
+# how /tikz_svg makes the svg: compiling with LaTeX (exact) or drawing it
+# directly (a fast preview, see utils.preview)
+RENDERERS = {"latex", "native"}
+
 
 def serialize_body(body):
     rdict = {"nodestyle": {}, "linestyle": {}}
@@ -52,104 +135,463 @@ def serialize_body(body):
     return rdict
 
 
-def get_tikz_from_body(body, full_doc=False):
-    """Get the tikz graph string from the payload."""
+def json_body():
+    """JSON payload of the request, which may be sent gzipped
+    (Content-Encoding: gzip).
+    """
+    data = request.get_data()
+    if request.headers.get("Content-Encoding", "").lower() == "gzip":
+        data = decode_upload(data)
+    return json.loads(data.decode("utf-8"))
+
+
+def form_body():
+    """Form payload of the request. The matrix may be uploaded as a file
+    (adj_mat_file, optionally gzipped) instead of pasted in adj_mat_txt.
+    """
+    body = dict(request.form)
+    upload = request.files.get("adj_mat_file")
+    if upload is not None and upload.filename:
+        body["adj_mat_txt"] = upload.read()
+    return body
+
+
+def search_params(quality=None, time_budget=None, max_trials=None):
+    """Keyword arguments of SpringLayout for the min-crossing search, from
+    the quality preset and any explicit time budget or trial count (capped
+    at LAYOUT_TIME_BUDGET and LAYOUT_MAX_TRIALS).
+    """
+    quality = quality or "balanced"
+    if quality not in SEARCH_QUALITY:
+        raise werkzeug.exceptions.BadRequest(f"Unknown quality {quality}.")
+    preset = SEARCH_QUALITY[quality]
+    try:
+        time_budget = preset["budget"] * LAYOUT_TIME_BUDGET if time_budget in (None, "") else float(time_budget)
+        max_trials = preset["max_trials"] if max_trials in (None, "") else int(max_trials)
+    except ValueError as e:
+        raise werkzeug.exceptions.BadRequest(f"Invalid search budget ({e}).")
+    return {
+        "time_budget": min(max(time_budget, 0), LAYOUT_TIME_BUDGET),
+        "max_trials": min(max(max_trials, 1), LAYOUT_MAX_TRIALS),
+        "patience": preset["patience"],
+    }
+
+
+def parse_body(body, progress=None):
+    """Read the payload into a TikzGrapher, the adjacency matrix and the
+    layout keyword arguments. If given, progress is called with progress
+    events from the layout search.
+    """
     # read adjacency matrix text field
     fmt = body.pop("adj_mat_fmt")
     adj_mat_txt = body.pop("adj_mat_txt")
+    previous = body.pop("previous_layout", None)
+    edge_labels = body.pop("edge_labels", None)
+    tikz, body, weight_labels = parse_options(body, progress=progress)
+
+    # layout of an earlier version of the graph, to update incrementally
+    if previous:
+        try:
+            if isinstance(previous, str):
+                previous = json.loads(previous)
+            body["previous"] = load_layout(previous)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            raise werkzeug.exceptions.BadRequest(f"Unable to read previous_layout ({e}).")
+
+    adj_mat, body["edge_labels"] = read_graph(
+        adj_mat_txt, fmt, tikz.linestyle.directed, edge_labels, weight_labels
+    )
+    return tikz, adj_mat, body
+
+
+def parse_options(body, progress=None):
+    """Read the style and layout fields of the payload (everything but the
+    graph itself) into a TikzGrapher, the layout keyword arguments and
+    whether to label edges with their weights.
+    """
     body = serialize_body(body)
-    print(body, flush=True)
+    log.debug("Request body: %s", body)
 
-    # if minimizing crossings
-    if not body.pop("min_cross", False):
-        body["seed"] = body["seed"] or 1
+    min_cross = body.pop("min_cross", False)
+    weight_labels = str_to_bool(str(body.pop("weight_labels", False)))
+    search_fields = (body.pop("quality", None), body.pop("time_budget", None), body.pop("max_trials", None))
 
     # read line and node style kwargs as well as set body defaults
     linekwargs = parse_style(body.pop("linestyle", {}), LINE_DEFAULTS)
     nodekwargs = parse_style(body.pop("nodestyle", {}), NODE_DEFAULTS)
     body = parse_style(body, LAYOUT_DEFAULTS)
+    if body["method"] not in LAYOUT_METHODS:
+        raise werkzeug.exceptions.BadRequest(f"Unknown layout method {body['method']}.")
+
+    # if minimizing crossings, the seed (if any) seeds the search instead; the
+    # search fields are only read (and checked) then
+    if min_cross and body["method"] == "spring":
+        body["base_seed"] = body["seed"]
+        body["seed"] = None
+        body["workers"] = LAYOUT_WORKERS
+        body.update(search_params(*search_fields))
+    else:
+        body["seed"] = body["seed"] or 1
+    body["cache"] = layout_cache
+    body["progress"] = search_progress(progress)
+
+    linestyle = LineStyle(**linekwargs)
+    nodestyle = NodeStyle(**nodekwargs)
+    tikz = TikzGrapher(nodestyle, linestyle)
+    return tikz, body, weight_labels
 
-    # get adjacency matrix
+
+def read_graph(adj_mat_txt, fmt, directed, edge_labels=None, weight_labels=False):
+    """Read the adjacency matrix and its edge labels (the edge_labels field,
+    or with weight_labels the weights in the matrix, or None).
+    """
+    # the weights are only turned into labels (one string per edge) if used
+    with_labels = weight_labels and not edge_labels
     try:
-        adj_mat = read_adj_mat_txt(
-            adj_mat_txt, fmt=fmt, directed=linekwargs["directed"]
-        )
+        with metrics.stage("parse"):
+            parsed = read_adj_mat_txt(adj_mat_txt, fmt=fmt, directed=directed, with_labels=with_labels)
     except Exception as e:
         err = f"Formatting error (unable to read matrix). Please make sure you selected the correct matrix format. ({e})"
         raise werkzeug.exceptions.BadRequest(err)
+    if with_labels:
+        return parsed
+    if edge_labels:
+        return parsed, read_edge_labels(edge_labels, len(parsed))
+    return parsed, None
 
-    # get tikz string
-    linestyle = LineStyle(**linekwargs)
-    nodestyle = NodeStyle(**nodekwargs)
-    tikz = TikzGrapher(nodestyle, linestyle)
 
+def read_edge_labels(labels, num_nodes):
+    """EdgeLabels from the edge_labels field: a list of [i, j, label] (as
+    JSON in a form), or an edge list with a label after each "i j".
+    """
     try:
-        if full_doc:
-            rval = tikz.to_doc(adj_mat, **body)
-        else:
-            rval = tikz.to_tikz(adj_mat, **body)
+        if isinstance(labels, str):
+            try:
+                labels = json.loads(labels)
+            except ValueError:
+                _, parsed = read_edge_list_txt(labels, with_labels=True)
+                return parsed
+        return EdgeLabels.from_edges([(i, j, label) for i, j, label in labels], num_nodes)
+    except (ValueError, TypeError, AssertionError) as e:
+        raise werkzeug.exceptions.BadRequest(f"Unable to read edge_labels ({e}).")
+
+
+def search_progress(forward=None):
+    """Progress callback for the layout that records the outcome of the
+    min-crossing search in the metrics and passes every event on to forward.
+    """
+
+    def progress(event, **data):
+        if event == "search":
+            LAYOUT_TRIALS.observe(data["trials"])
+            LAYOUT_CROSSINGS.observe(data["crossings"])
+        if forward is not None:
+            forward(event, **data)
+
+    return progress
+
+
+def get_layout(tikz, adj_mat, body):
+    """Compute the layout for the layout keyword arguments in body."""
+    layout_kwargs = {k: v for k, v in body.items() if k not in ("labels", "edge_labels")}
+    try:
+        with metrics.stage("layout"):
+            return tikz.get_layout(adj_mat, **layout_kwargs)
     except Exception as e:
         err = f"Layout algorithm failed: {e}"
         raise werkzeug.exceptions.InternalServerError(err)
 
-    print(rval, flush=True)
-    return rval
 
+def render_body(body, with_svg=True, progress=None):
+    """Get the tikz string and (with_svg) the svg bytes of the graph from the
+    payload (see parse_body). The "renderer" field picks how the svg is
+    made: "latex" (the default) compiles the document, "native" draws a
+    preview directly (see utils.preview) without LaTeX.
+    """
+    renderer = body.pop("renderer", None) or "latex"
+    if renderer not in RENDERERS:
+        raise werkzeug.exceptions.BadRequest(f"Unknown renderer {renderer}.")
+    tikz, adj_mat, body = parse_body(body, progress=progress)
+    layout = get_layout(tikz, adj_mat, body)
+
+    with metrics.stage("tikz"):
+        tikz_str, tikz_doc = tikz.to_doc(
+            adj_mat, labels=body["labels"], edge_labels=body["edge_labels"], layout=layout
+        )
+    log.debug("Output: %s", tikz_doc)
+    if not with_svg:
+        return tikz_str, None
+
+    if progress is not None:
+        progress("stage", stage="compile")
+    if renderer == "native":
+        with metrics.stage("preview"):
+            svg = tikz.to_svg(
+                adj_mat, labels=body["labels"], edge_labels=body["edge_labels"], layout=layout
+            ).encode("utf-8")
+    else:
+        svg = compile_svg(tikz_doc)
+    return tikz_str, svg
+
+
+def compile_svg(tikz_doc):
+    """Compile a full LaTeX document to svg bytes, using the svg cache."""
+    key = svg_cache.key(tikz_doc)
+    svg = svg_cache.get(key)
+    if svg is None:
+        try:
+            with metrics.stage("compile"):
+                svg = tex_pool.render(tikz_doc)
+        except RenderError as e:
+            log.warning("Compilation failed: %s", e)
+            log.debug("Failed document: %s", tikz_doc)
+            raise werkzeug.exceptions.InternalServerError(f"Compilation failed: {e}")
+        svg_cache.put(key, svg)
+    return svg
+
+
+def compile_svgs(tikz_strs):
+    """Compile many tikzpictures to svg bytes each, using the svg cache: the
+    ones not cached are put on the pages of one document (see
+    graph.pages_doc) and compiled in a single pdflatex run.
+    """
+    keys = [svg_cache.key(DOC_START + tikz_str + DOC_END) for tikz_str in tikz_strs]
+    svgs = [svg_cache.get(key) for key in keys]
+
+    # identical graphs are compiled once
+    missing = {}
+    for idx, svg in enumerate(svgs):
+        if svg is None:
+            missing.setdefault(keys[idx], idx)
+    if missing:
+        doc = pages_doc(tikz_strs[idx] for idx in missing.values())
+        try:
+            with metrics.stage("compile"):
+                pages = tex_pool.render_pages(doc, len(missing))
+        except RenderError as e:
+            log.warning("Compilation failed: %s", e)
+            log.debug("Failed document: %s", doc)
+            raise werkzeug.exceptions.InternalServerError(f"Compilation failed: {e}")
+        for key, svg in zip(missing, pages):
+            svg_cache.put(key, svg)
+        compiled = dict(zip(missing, pages))
+        svgs = [svg if svg is not None else compiled[key] for key, svg in zip(keys, svgs)]
+    return svgs
+
+
+@app.before_request
+def before_request():
+    REQUESTS_IN_FLIGHT.inc(endpoint=request.endpoint or "")
+    if SERVER_TIMING:
+        metrics.start_timings()
 
-def delete_files(basename):
-    os.remove(basename + ".tex")
-    os.remove(basename + ".aux")
-    os.remove(basename + ".svg")
-    os.remove(basename + ".pdf")
-    os.remove(basename + ".log")
+
+@app.teardown_request
+def teardown_request(exc):
+    REQUESTS_IN_FLIGHT.dec(endpoint=request.endpoint or "")
 
 
 @app.after_request
 def after_request(response):
+    if SERVER_TIMING:
+        timings = metrics.pop_timings()
+        if timings:
+            response.headers.add("Server-Timing", metrics.server_timing(timings))
     response.headers.add("Access-Control-Allow-Origin", "*")
     response.headers.add("Access-Control-Allow-Headers", "Content-Type,Authorization")
     response.headers.add("Access-Control-Allow-Methods", "GET,PUT,POST,DELETE,OPTIONS")
     return response
 
 
+@app.route("/stats", methods=["GET"])
+def stats():
+    """Return the cache counters."""
+    return {"layout_cache": layout_cache.stats(), "svg_cache": svg_cache.stats()}
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Stage timings, cache and in-flight counts in the Prometheus format."""
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/tikz", methods=["POST"])
 def tikz():
-    """Return the tikz string from a data request."""
+    """Return the tikz string from a data request. With "return_layout",
+    return json with the tikz and the layout, which can be sent back as
+    "previous_layout" with an edited graph to update it incrementally.
+    """
 
-    body = json.loads(request.data.decode("utf-8"))
-    rval, _ = get_tikz_from_body(body)
+    body = json_body()
+    return_layout = str_to_bool(str(body.pop("return_layout", False)))
+    tikz, adj_mat, body = parse_body(body)
 
-    return rval
+    layout = get_layout(tikz, adj_mat, body)
+    if return_layout:
+        with metrics.stage("tikz"):
+            tikz_str = tikz.to_tikz(
+                adj_mat, labels=body["labels"], edge_labels=body["edge_labels"], layout=layout
+            )
+        return {"tikz": tikz_str, "layout": dump_layout(layout, adj_mat)}
+
+    # the tikz is streamed as it is written
+    chunks = tikz.iter_tikz(
+        adj_mat, labels=body["labels"], edge_labels=body["edge_labels"], layout=layout
+    )
+    return Response(stream_with_context(metrics.timed_iter(chunks, "tikz")), mimetype="text/plain")
 
 
 @app.route("/tikz_svg", methods=["POST"])
 def tikz_svg():
-    """Return a pdf of the graph from a form request."""
-    body = dict(request.form)
-    tikz_str, tikz_doc = get_tikz_from_body(body, full_doc=True)
+    """Return an svg preview and the tikz of the graph from a form request.
+    The svg is compiled with LaTeX, or drawn directly with "renderer" set to
+    "native".
+    """
+    body = form_body()
+    tikz_str, svg = render_body(body)
+    svg_encoded = base64.b64encode(svg).decode("utf-8")
+    return svg_to_html(svg_encoded, tikz=tikz_str)
+
+
+@app.route("/tikz_batch", methods=["POST"])
+def tikz_batch():
+    """Render many graphs with one shared style from a json request:
 
-    filename = str(abs(hash(tikz_doc)))
-    with open(filename + ".tex", "w") as fp:
-        fp.write(tikz_doc)
+        {"graphs": [{"adj_mat_txt": ..., "adj_mat_fmt": ..., "edge_labels": ...}, ...],
+         "adj_mat_fmt": "csv", "output": "tikz", <style and layout fields>}
 
-    # compile latex and convert to svg
-    # TODO: catch exit codes
-    proc = subprocess.Popen(["pdflatex", filename + ".tex", ">", "/dev/null"])
-    out = proc.communicate()[0]
-    proc = subprocess.Popen(["pdf2svg", filename + ".pdf", filename + ".svg"])
-    out = proc.communicate()[0]
+    Each graph may give its own format and edge labels; every other field
+    (as for /tikz) applies to all of them. The layouts are computed in
+    parallel. "output" picks what is returned besides the list of tikz
+    snippets: nothing ("tikz"), one document with a page per graph
+    ("doc"), or the svg of each graph, base64 encoded ("svg"), compiled in a
+    single pdflatex run (or drawn directly, with "renderer" "native").
+    """
+    body = json_body()
+    graphs = body.pop("graphs", None)
+    if not isinstance(graphs, list) or not graphs:
+        raise werkzeug.exceptions.BadRequest("graphs must be a non-empty list.")
+    if len(graphs) > BATCH_MAX_GRAPHS:
+        raise werkzeug.exceptions.BadRequest(f"At most {BATCH_MAX_GRAPHS} graphs per batch.")
+    output = body.pop("output", None) or "tikz"
+    if output not in ("tikz", "doc", "svg"):
+        raise werkzeug.exceptions.BadRequest(f"Unknown output {output}.")
+    renderer = body.pop("renderer", None) or "latex"
+    if renderer not in RENDERERS:
+        raise werkzeug.exceptions.BadRequest(f"Unknown renderer {renderer}.")
+    fmt = body.pop("adj_mat_fmt", "csv")
+    body.pop("previous_layout", None)
 
-    # put a try except here
+    # the style is parsed once for the whole batch
+    tikz, body, weight_labels = parse_options(body)
+    adj_mats, edge_labels = [], []
+    for idx, graph in enumerate(graphs):
+        try:
+            adj_mat, labels = read_graph(
+                graph["adj_mat_txt"],
+                graph.get("adj_mat_fmt", fmt),
+                tikz.linestyle.directed,
+                graph.get("edge_labels"),
+                weight_labels,
+            )
+        except (KeyError, TypeError):
+            raise werkzeug.exceptions.BadRequest(f"Graph {idx} has no adj_mat_txt.")
+        except werkzeug.exceptions.BadRequest as e:
+            raise werkzeug.exceptions.BadRequest(f"Graph {idx}: {e.description}")
+        adj_mats.append(adj_mat)
+        edge_labels.append(labels)
+
+    layout_kwargs = {k: v for k, v in body.items() if k not in ("labels", "workers")}
     try:
-        svg = open(filename + ".svg", "rb").read()
-        svg_encoded = base64.b64encode(svg).decode("utf-8")
-    except:
-        print("pdflatex failed on the following document:", flush=True)
-        print(tikz_doc, flush=True)
+        with metrics.stage("layout"):
+            layouts = layout_many(adj_mats, workers=LAYOUT_WORKERS, **layout_kwargs)
+    except Exception as e:
+        err = f"Layout algorithm failed: {e}"
         raise werkzeug.exceptions.InternalServerError(err)
 
-    delete_files(filename)
-    return svg_to_html(svg_encoded, tikz=tikz_str)
+    with metrics.stage("tikz"):
+        tikz_strs = [
+            tikz.to_tikz(adj_mat, labels=body["labels"], edge_labels=labels, layout=layout)
+            for adj_mat, labels, layout in zip(adj_mats, edge_labels, layouts)
+        ]
+    rdict = {"tikz": tikz_strs}
+    if output == "doc":
+        rdict["doc"] = pages_doc(tikz_strs)
+    elif output == "svg" and renderer == "native":
+        with metrics.stage("preview"):
+            rdict["svg"] = [
+                base64.b64encode(
+                    tikz.to_svg(adj_mat, labels=body["labels"], edge_labels=labels, layout=layout).encode("utf-8")
+                ).decode("utf-8")
+                for adj_mat, labels, layout in zip(adj_mats, edge_labels, layouts)
+            ]
+    elif output == "svg":
+        rdict["svg"] = [base64.b64encode(svg).decode("utf-8") for svg in compile_svgs(tikz_strs)]
+    return rdict
+
+
+def render_job(job, body, with_svg=True):
+    """Job version of /tikz_svg, reporting progress on the way."""
+    job.emit("stage", stage="layout")
+    tikz_str, svg = render_body(body, with_svg=with_svg, progress=job.emit)
+    rdict = {"tikz": tikz_str}
+    if with_svg:
+        rdict["svg"] = base64.b64encode(svg).decode("utf-8")
+    return rdict
+
+
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        raise werkzeug.exceptions.NotFound(f"No job with id {job_id}.")
+    return job
+
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    """Start rendering in the background and return the job id. Takes the
+    same fields as /tikz (json) or /tikz_svg (form), plus an optional
+    "svg" field ("False" to skip compilation).
+    """
+    if request.is_json:
+        body = json_body()
+    else:
+        body = form_body()
+    with_svg = str_to_bool(str(body.pop("svg", "True")))
+    job = jobs.submit(render_job, body, with_svg=with_svg)
+    return {"id": job.id, "status": job.status}, 202
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    """Poll the status and latest progress of a job."""
+    return get_job(job_id).summary()
+
+
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    """Stream the progress events of a job as server-sent events."""
+    job = get_job(job_id)
+
+    def stream():
+        for event in job.iter_events(timeout=15):
+            if event is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+
+    return Response(stream(), mimetype="text/event-stream")
+
+
+@app.route("/jobs/<job_id>/result", methods=["GET"])
+def job_result(job_id):
+    """Fetch the tikz (and base64 svg) of a finished job."""
+    job = get_job(job_id)
+    if job.status == "failed":
+        return {"id": job.id, "status": job.status, "error": job.error}, 500
+    if job.status != "done":
+        return job.summary(), 202
+    return dict(id=job.id, status=job.status, **job.result)
 
 
 if __name__ == "__main__":
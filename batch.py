@@ -0,0 +1,245 @@
+""" Render a directory (or glob) of adjacency matrices to tikz in one go.
+
+    python batch.py examples/ -o out/ --config style.json --svg --workers 8
+
+Every matrix is rendered with the same style and layout settings, read from a
+json config file such as
+
+    {
+        "format": "csv",
+        "labels": "numbered",
+        "weight_labels": true,
+        "nodestyle": {"shape": "circle", "fill_color": "white", "scale": 0.7},
+        "linestyle": {"directed": true, "arrow_mark_location": 1},
+        "layout": {"method": "spring", "seed": 1, "align_angle": 90},
+        "cache_dir": "layout_cache/"
+    }
+
+(all keys optional; weight_labels labels the edges with the entries of
+weighted matrices, or the labels in edge lists). The files are shared out over a pool of worker processes,
+each of which imports numpy and networkx once and then renders many files.
+For each input x.csv the document is written to <output>/x.tex, and, on
+request, compiled to x.pdf and x.svg. Inputs whose outputs are already newer
+than both the input and the config are skipped, so an interrupted run can be
+resumed by running it again.
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# matrix format of each file extension, unless the config sets "format"
+EXTENSION_FORMATS = {
+    ".csv": "csv",
+    ".m": "mathematica",
+    ".py": "python",
+    ".txt": "edgelist",
+    ".edges": "edgelist",
+}
+
+# the worker's grapher and settings, made once per process by _init_worker
+_worker = {}
+
+
+def read_config(path):
+    """Read the json config (see the module docstring), or the defaults if
+    path is None.
+    """
+    config = {}
+    if path is not None:
+        with open(path, "r") as fp:
+            config = json.load(fp)
+    unknown = set(config) - {"format", "labels", "weight_labels", "nodestyle", "linestyle", "layout", "cache_dir"}
+    if unknown:
+        raise ValueError(f"Unknown config keys: {', '.join(sorted(unknown))}.")
+    return config
+
+
+def find_inputs(sources):
+    """The matrix files named by a list of files, directories and globs."""
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            matches = [
+                os.path.join(source, name)
+                for name in os.listdir(source)
+                if _stem(name)[1] in EXTENSION_FORMATS
+            ]
+        else:
+            matches = glob.glob(source)
+        paths.extend(sorted(p for p in matches if os.path.isfile(p)))
+    return list(dict.fromkeys(paths))
+
+
+def _stem(path):
+    """File name without directory, .gz and extension; and the extension."""
+    name = os.path.basename(path)
+    if name.endswith(".gz"):
+        name = name[:-3]
+    return os.path.splitext(name)
+
+
+def output_paths(path, output_dir, extensions):
+    """Output file of each extension for the input path."""
+    stem = _stem(path)[0]
+    return {ext: os.path.join(output_dir, stem + ext) for ext in extensions}
+
+
+def up_to_date(path, outputs, since=0):
+    """Whether all outputs exist and are newer than the input and since."""
+    newest = max(os.path.getmtime(path), since)
+    return all(os.path.exists(out) and os.path.getmtime(out) >= newest for out in outputs)
+
+
+def _init_worker(config):
+    """Build the grapher and layout settings of a worker process."""
+    from graph import TikzGrapher
+    from utils.cache import LayoutCache
+    from utils.style import LineStyle, NodeStyle
+
+    layout = dict(config.get("layout", {}))
+    if config.get("cache_dir"):
+        layout["cache"] = LayoutCache(cache_dir=config["cache_dir"])
+    _worker["tikz"] = TikzGrapher(
+        NodeStyle(**config.get("nodestyle", {})), LineStyle(**config.get("linestyle", {}))
+    )
+    _worker["layout"] = layout
+    _worker["labels"] = config.get("labels")
+    _worker["weight_labels"] = bool(config.get("weight_labels"))
+    _worker["format"] = config.get("format")
+
+
+def render_file(path, outputs, timeout=30):
+    """Render one matrix file to the outputs (a dict from extension to path)
+    in a worker process. Returns the number of nodes and the time taken.
+    """
+    from utils.parse import read_adj_mat_txt
+
+    start = time.perf_counter()
+    fmt = _worker["format"] or EXTENSION_FORMATS.get(_stem(path)[1], "csv")
+    with open(path, "rb") as fp:
+        adj_mat, edge_labels = read_adj_mat_txt(
+            fp.read(), fmt=fmt, directed=_worker["tikz"].linestyle.directed, with_labels=True
+        )
+    if not _worker["weight_labels"]:
+        edge_labels = None
+    _, doc = _worker["tikz"].to_doc(
+        adj_mat, labels=_worker["labels"], edge_labels=edge_labels, **_worker["layout"]
+    )
+
+    # write to a temporary name first, so a killed run leaves no partial
+    # output that looks up to date
+    _write(outputs[".tex"], doc.encode("utf-8"))
+    if ".pdf" in outputs or ".svg" in outputs:
+        _compile(doc, outputs, timeout)
+    return len(adj_mat), time.perf_counter() - start
+
+
+def _write(path, data):
+    tmp = path + ".part"
+    with open(tmp, "wb") as fp:
+        fp.write(data)
+    os.replace(tmp, path)
+
+
+def _compile(doc, outputs, timeout):
+    """Compile doc with pdflatex (and pdf2svg) into the pdf and svg outputs."""
+    from utils.render import JOBNAME, TexProcess, pdf_to_svg
+
+    tex = TexProcess(preamble=None)
+    try:
+        pdf = tex.compile(doc, timeout)
+        if ".svg" in outputs:
+            svg = os.path.join(tex.workdir, JOBNAME + ".svg")
+            pdf_to_svg(pdf, svg, timeout)
+            shutil.copyfile(svg, outputs[".svg"] + ".part")
+            os.replace(outputs[".svg"] + ".part", outputs[".svg"])
+        if ".pdf" in outputs:
+            shutil.copyfile(pdf, outputs[".pdf"] + ".part")
+            os.replace(outputs[".pdf"] + ".part", outputs[".pdf"])
+    finally:
+        tex.close()
+
+
+def run(paths, output_dir, config, config_mtime=0, extensions=(".tex",), workers=None,
+        resume=True, timeout=30, out=sys.stderr):
+    """Render every input path into output_dir on a pool of workers, and
+    print progress and a throughput summary to out. Returns the number of
+    files that failed.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = {path: output_paths(path, output_dir, extensions) for path in paths}
+    skipped = 0
+    if resume:
+        todo = {p: o for p, o in jobs.items() if not up_to_date(p, o.values(), config_mtime)}
+        skipped = len(jobs) - len(todo)
+        jobs = todo
+
+    start = time.perf_counter()
+    rendered = nodes = 0
+    busy = 0.0
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(config,)) as pool:
+        futures = {pool.submit(render_file, p, o, timeout): p for p, o in jobs.items()}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                num_nodes, elapsed = future.result()
+            except Exception as e:
+                failed.append(path)
+                print(f"FAILED {path}: {e}", file=out, flush=True)
+                continue
+            rendered += 1
+            nodes += num_nodes
+            busy += elapsed
+            print(f"[{rendered + len(failed)}/{len(jobs)}] {path} ({num_nodes} nodes, {elapsed:.2f}s)", file=out, flush=True)
+
+    wall = time.perf_counter() - start
+    print(
+        f"\n{rendered} rendered, {skipped} up to date, {len(failed)} failed in {wall:.2f}s"
+        f" ({rendered / max(wall, 1e-9):.1f} files/s, {nodes / max(wall, 1e-9):.0f} nodes/s,"
+        f" {busy / max(rendered, 1):.3f}s per file per worker)",
+        file=out,
+        flush=True,
+    )
+    return len(failed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render many adjacency matrices to tikz.")
+    parser.add_argument("inputs", nargs="+", help="matrix files, directories or globs")
+    parser.add_argument("-o", "--output", default=".", help="output directory")
+    parser.add_argument("-c", "--config", help="json style/layout config (see the module docstring)")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument("--svg", action="store_true", help="also compile to svg")
+    parser.add_argument("--pdf", action="store_true", help="also compile to pdf")
+    parser.add_argument("--force", action="store_true", help="render even if the outputs are up to date")
+    parser.add_argument("--timeout", type=float, default=30, help="pdflatex/pdf2svg timeout (seconds)")
+    args = parser.parse_args(argv)
+
+    config = read_config(args.config)
+    config_mtime = os.path.getmtime(args.config) if args.config else 0
+    paths = find_inputs(args.inputs)
+    if not paths:
+        parser.error("no matrix files found")
+    extensions = [".tex"] + [ext for ext, on in ((".pdf", args.pdf), (".svg", args.svg)) if on]
+
+    failed = run(
+        paths,
+        args.output,
+        config,
+        config_mtime=config_mtime,
+        extensions=extensions,
+        workers=args.workers,
+        resume=not args.force,
+        timeout=args.timeout,
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,17 @@
 import numpy as np
 import csv
-from utils.layout import SpringLayout
+import itertools
+from utils.adjacency import as_adjacency, as_edge_labels, classify_edges, neighbor_counts
+from utils.layout import LAYOUT_METHODS
+from utils.preview import render_svg
 from utils.style import LineStyle, NodeStyle
 
+DOC_START = "\\documentclass[tikz]{standalone}\n\\begin{document}"
+DOC_END = "\\end{document}\n"
+
+# size (in characters) of the chunks produced by TikzGrapher.iter_tikz
+CHUNK_SIZE = 64 * 1024
+
 
 class TikzGrapher:
     """Main class to deal with rendering the whole TikZ graph."""
@@ -11,36 +20,93 @@ class TikzGrapher:
         self.nodestyle = nodestyle
         self.linestyle = linestyle
 
-    def to_tikz(self, adj_matrix, labels=None, **layout_kwargs):
-        """Render graph to a tikz string."""
+    def to_tikz(self, adj_matrix, labels=None, edge_labels=None, **layout_kwargs):
+        """Render graph to a tikz string. labels are the node labels (None,
+        "numbered" or one per node) and edge_labels the edge labels, as
+        EdgeLabels, a dict {(i, j): label} or (i, j, label) triples.
+        """
+        return "".join(self.iter_tikz(adj_matrix, labels=labels, edge_labels=edge_labels, **layout_kwargs))
+
+    def to_doc(self, adj_matrix, labels=None, edge_labels=None, **layout_kwargs):
+        tikz = self.to_tikz(adj_matrix, labels=labels, edge_labels=edge_labels, **layout_kwargs)
+        return tikz, DOC_START + tikz + DOC_END
+
+    def to_svg(self, adj_matrix, labels=None, edge_labels=None, layout=None, **layout_kwargs):
+        """Draw the graph directly as an SVG string, without LaTeX, for a
+        quick preview (see utils.preview). The layout is computed as in
+        iter_tikz unless one is given.
+        """
+        adj_matrix = as_adjacency(adj_matrix)
+        edge_labels = as_edge_labels(edge_labels, len(adj_matrix))
+        if layout is None:
+            layout = self.get_layout(adj_matrix, **layout_kwargs)
+        return render_svg(
+            layout, adj_matrix, self.nodestyle, self.linestyle, labels=labels, edge_labels=edge_labels
+        )
+
+    def get_layout(self, adj_matrix, method="spring", previous=None, **layout_kwargs):
+        """Compute the layout of the graph. method names the layout class
+        (see utils.layout.LAYOUT_METHODS). If previous (a layout of an
+        earlier version of the graph) is given, it is updated incrementally
+        instead (see Layout.relayout).
+        """
+        layout_tool = LAYOUT_METHODS[method](**layout_kwargs)
+        if previous is not None:
+            return layout_tool.relayout(adj_matrix, previous)
+        return layout_tool.get_layout(adj_matrix)
+
+    def iter_tikz(
+        self, adj_matrix, labels=None, edge_labels=None, chunk_size=CHUNK_SIZE, layout=None, **layout_kwargs
+    ):
+        """Render graph to tikz as an iterator of string chunks of roughly
+        chunk_size characters. The layout is computed (see get_layout)
+        before this returns, unless one is given, so layout errors are
+        raised here rather than while iterating.
+        """
+        adj_matrix = as_adjacency(adj_matrix)
+        edge_labels = as_edge_labels(edge_labels, len(adj_matrix))
 
         # compute the layout of the nodes
-        layout_tool = SpringLayout(**layout_kwargs)
-        layout = layout_tool.get_layout(adj_matrix)
+        if layout is None:
+            layout = self.get_layout(adj_matrix, **layout_kwargs)
+        return _buffered(self._iter_lines(layout, adj_matrix, labels, edge_labels), chunk_size)
+
+    def iter_doc(self, adj_matrix, labels=None, edge_labels=None, chunk_size=CHUNK_SIZE, **layout_kwargs):
+        """Render graph to a full LaTeX document as an iterator of chunks."""
+        chunks = self.iter_tikz(
+            adj_matrix, labels=labels, edge_labels=edge_labels, chunk_size=chunk_size, **layout_kwargs
+        )
+        return itertools.chain([DOC_START], chunks, [DOC_END])
+
+    def write_tikz(self, fp, adj_matrix, labels=None, edge_labels=None, **layout_kwargs):
+        """Write the tikz for a graph to a file object as it is generated."""
+        for chunk in self.iter_tikz(adj_matrix, labels=labels, edge_labels=edge_labels, **layout_kwargs):
+            fp.write(chunk)
+
+    def _iter_lines(self, layout, adj_matrix, labels, edge_labels=None):
         node_layout = layout["nodes"]
         edge_layout = layout["loops"]
 
         # any required macros or headers
-        header = self.nodestyle.header() + self.linestyle.header()
+        yield self.nodestyle.header() + self.linestyle.header()
 
-        tikzstr = "\\begin{tikzpicture}\n"
+        yield "\\begin{tikzpicture}\n"
 
         # draw edges of graph
-        tikzstr += self.node_block(node_layout, adj_matrix, labels)
+        yield from self.iter_node_block(node_layout, adj_matrix, labels)
 
         # draw lines of graph
-        tikzstr += self.line_block(edge_layout, adj_matrix)
+        yield from self.iter_line_block(edge_layout, adj_matrix, edge_labels)
 
-        tikzstr += "\n\\end{tikzpicture}\n"
-        return header + tikzstr
-
-    def to_doc(self, adj_matrix, labels=None, **layout_kwargs):
-        docstart = "\\documentclass[tikz]{standalone}\n\\begin{document}"
-        docend = "\\end{document}\n"
-        tikz = self.to_tikz(adj_matrix, labels=labels, **layout_kwargs)
-        return tikz, docstart + tikz + docend
+        yield "\n\\end{tikzpicture}\n"
 
     def node_block(self, node_layout, adj_matrix, labels):
+        return "".join(self.iter_node_block(node_layout, adj_matrix, labels))
+
+    def line_block(self, edge_layout, adj_matrix, labels=None):
+        return "".join(self.iter_line_block(edge_layout, adj_matrix, labels))
+
+    def iter_node_block(self, node_layout, adj_matrix, labels):
         # get labels
         if labels is None:
             labels = [""] * len(adj_matrix)
@@ -48,60 +114,82 @@ class TikzGrapher:
             labels = range(len(adj_matrix))
 
         # draw nodes of graph
-        nodestr = ""
+        yield self.nodestyle.scope_begin()
         for node, label in zip(range(len(adj_matrix)), labels):
-            nodestr += self.nodestyle.render_node(node, node_layout[node], label)
-        nodestr = self.nodestyle.scope(nodestr)
-        return nodestr
+            yield self.nodestyle.render_node(node, node_layout[node], label)
+        yield self.nodestyle.scope_end()
 
-    def line_block(self, edge_layout, adj_matrix, labels=None):
-        linestr = ""
+    def iter_line_block(self, edge_layout, adj_matrix, labels=None):
+        # unidirectional edges, and bidirectional edges (or self-loops)
+        asym_idx, sym_idx = classify_edges(adj_matrix)
 
+        # labels of the edges in both lists (and of the reverse edges), looked
+        # up all at once (escaped for LaTeX); edges without a label get ""
+        labels = as_edge_labels(labels, len(adj_matrix))
         if labels is None:
-            label_map = {
-                (i, j): ""
-                for i in range(len(adj_matrix))
-                for j in range(len(adj_matrix))
-            }
-
-        symmetrized = adj_matrix + adj_matrix.T
-        asym_idx = np.where(adj_matrix - adj_matrix.T > 0)  # unidirectional edges
-        sym_idx = np.nonzero(
-            np.triu(adj_matrix * adj_matrix.T)
-        )  # bidirectional edges (or self-loops)
+            asym_labels = itertools.repeat("")
+            sym_labels = reverse_labels = itertools.repeat("")
+        else:
+            asym_labels = labels.lookup(*asym_idx, tex=True)
+            sym_labels = labels.lookup(*sym_idx, tex=True)
+            reverse_labels = labels.lookup(sym_idx[1], sym_idx[0], tex=True)
+
+        yield self.linestyle.scope_begin()
 
         # draw unidirectional edges
-        for edge_out, edge_in in zip(*asym_idx):
-            label = label_map[(edge_out, edge_in)]
-            linestr += self.linestyle.render_line(edge_out, edge_in, label=label)
+        for edge_out, edge_in, label in zip(*asym_idx, asym_labels):
+            yield self.linestyle.render_line(edge_out, edge_in, label=label)
 
         # draw bidirectional edges
-        for edge_out, edge_in in zip(*sym_idx):
-            label = label_map[(edge_out, edge_in)]
+        num_neighbors = neighbor_counts(adj_matrix)
+        for edge_out, edge_in, label, reverse_label in zip(*sym_idx, sym_labels, reverse_labels):
             if edge_out != edge_in:
                 if self.linestyle.directed:
-                    linestr += self.linestyle.render_line(
+                    yield self.linestyle.render_line(
                         edge_out, edge_in, bend="left", label=label
                     )
-                    linestr += self.linestyle.render_line(
-                        edge_in, edge_out, bend="left", label=label
+                    yield self.linestyle.render_line(
+                        edge_in, edge_out, bend="left", label=reverse_label
                     )
                 else:
-                    linestr += self.linestyle.render_line(
-                        edge_out, edge_in, label=label
+                    # one line for both directions, labelled from either
+                    yield self.linestyle.render_line(
+                        edge_out, edge_in, label=label or reverse_label
                     )
             else:
                 # draw self-loops
-                num_neighbors = len(np.nonzero(symmetrized[edge_out, :])[0])
-                linestr += self.linestyle.render_selfloop(
+                yield self.linestyle.render_selfloop(
                     edge_out,
                     edge_layout[edge_out],
-                    num_neighbors=num_neighbors,
+                    num_neighbors=num_neighbors[edge_out],
                     label=label,
                 )
 
-        linestr = self.linestyle.scope(linestr)
-        return linestr
+        yield self.linestyle.scope_end()
+
+
+def pages_doc(tikz_strs):
+    """A standalone document with the tikzpictures tikz_strs (as made by
+    TikzGrapher.to_tikz) on pages of their own, in order, so that many
+    graphs can be compiled in one run. Each page is the same as the
+    document of that graph alone.
+    """
+    return DOC_START + "".join(tikz_strs) + DOC_END
+
+
+def _buffered(lines, chunk_size):
+    """Join an iterator of short strings into chunks of about chunk_size."""
+    buf = []
+    size = 0
+    for line in lines:
+        buf.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield "".join(buf)
+            buf = []
+            size = 0
+    if buf:
+        yield "".join(buf)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,264 @@
+""" Benchmark each stage of rendering a graph, on generated graph families.
+
+    python scripts/benchmark.py -o bench.json
+    python scripts/benchmark.py --sizes 100 1000 --families grid dense --compare bench.json
+
+For every family and size, the stages are run in order and each is timed
+(best of --repeat runs) and memory profiled (peak traced allocation, in a
+separate run so tracing does not slow the timings):
+
+    parse      read_adj_mat_txt on the csv text of the matrix
+    layout     TikzGrapher.get_layout (spring, seed 1)
+    search     the min-crossing layout search (SpringLayout with base_seed),
+               only up to --search-max-nodes nodes
+    crossings  count_crossings on the layout, only up to
+               --crossings-max-edges edges (the count is quadratic in the
+               edges of dense graphs)
+    tikz       TikzGrapher.to_tikz with the layout
+    compile    pdflatex and pdf2svg on the document, skipped when they are
+               not installed
+
+The results are printed and written as json. With --compare, the times are
+also shown relative to an earlier results file.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from graph import TikzGrapher  # noqa: E402
+from utils.adjacency import edge_arrays  # noqa: E402
+from utils.crossings import count_crossings  # noqa: E402
+from utils.layout import SpringLayout  # noqa: E402
+from utils.parse import read_adj_mat_txt  # noqa: E402
+from utils.render import JOBNAME, TexProcess, pdf_to_svg  # noqa: E402
+from utils.style import LineStyle, NodeStyle  # noqa: E402
+
+STAGES = ["parse", "layout", "search", "crossings", "tikz", "compile"]
+
+
+def random_sparse(n, rng):
+    """Directed graph with about 3 out-edges per node."""
+    mat = np.zeros((n, n), dtype=np.uint8)
+    mat[rng.randint(0, n, 3 * n), rng.randint(0, n, 3 * n)] = 1
+    return mat
+
+
+def dense(n, rng):
+    """Directed graph with every edge present with probability 1/2."""
+    return (rng.rand(n, n) < 0.5).astype(np.uint8)
+
+
+def grid(n, rng):
+    """Undirected square grid of about n nodes."""
+    side = max(int(round(np.sqrt(n))), 2)
+    idx = np.arange(side * side).reshape(side, side)
+    mat = np.zeros((side * side, side * side), dtype=np.uint8)
+    for a, b in ((idx[:, :-1], idx[:, 1:]), (idx[:-1], idx[1:])):
+        mat[a.ravel(), b.ravel()] = mat[b.ravel(), a.ravel()] = 1
+    return mat
+
+
+def star_loops(n, rng):
+    """A hub joined both ways to n - 1 leaves, each with a self-loop."""
+    mat = np.zeros((n, n), dtype=np.uint8)
+    mat[0, 1:] = mat[1:, 0] = 1
+    mat[np.arange(1, n), np.arange(1, n)] = 1
+    return mat
+
+
+def bidirectional(n, rng):
+    """Sparse graph whose edges are mostly present in both directions."""
+    mat = random_sparse(n, rng)
+    both = rng.rand(n, n) < 0.8
+    mat |= (mat.T & both).astype(np.uint8)
+    return mat
+
+
+def forest(n, rng):
+    """Undirected forest of random trees of 2 to 20 nodes."""
+    mat = np.zeros((n, n), dtype=np.uint8)
+    start = 0
+    while start < n:
+        size = min(int(rng.randint(2, 21)), n - start)
+        # each node after the first hangs off an earlier one
+        child = np.arange(start + 1, start + size)
+        parent = start + (rng.rand(size - 1) * (child - start)).astype(np.int64)
+        mat[parent, child] = mat[child, parent] = 1
+        start += size
+    return mat
+
+
+FAMILIES = {
+    "random_sparse": random_sparse,
+    "dense": dense,
+    "grid": grid,
+    "star_loops": star_loops,
+    "bidirectional": bidirectional,
+    "forest": forest,
+}
+
+
+def to_csv(mat):
+    return "\n".join(",".join(map(str, row)) for row in mat.tolist())
+
+
+def measure(fn, repeat):
+    """Best time over repeat runs of fn, the peak memory traced during one
+    more run, and its result.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak, result
+
+
+def compile_doc(doc, timeout=120):
+    """Compile a document to svg (or only to pdf without pdf2svg)."""
+    tex = TexProcess(preamble=None)
+    try:
+        pdf = tex.compile(doc, timeout)
+        if shutil.which("pdf2svg"):
+            pdf_to_svg(pdf, os.path.join(tex.workdir, JOBNAME + ".svg"), timeout)
+    finally:
+        tex.close()
+
+
+def run_case(family, size, stages, repeat, search_max_nodes, crossings_max_edges, seed=0):
+    """Benchmark the stages on one generated graph. Returns a list of result
+    dicts, one per stage that was run.
+    """
+    mat = FAMILIES[family](size, np.random.RandomState(seed))
+    txt = to_csv(mat)
+    tikz = TikzGrapher(NodeStyle(), LineStyle())
+    rows, cols = np.nonzero(mat)
+    info = {"family": family, "size": size, "nodes": len(mat), "edges": int(len(rows))}
+
+    results = []
+
+    def record(stage, fn):
+        seconds, peak, result = measure(fn, repeat)
+        results.append(dict(info, stage=stage, seconds=seconds, peak_bytes=peak))
+        return result
+
+    # later stages need the results of the earlier ones, so those always run
+    adj = record("parse", lambda: read_adj_mat_txt(txt, fmt="csv"))
+    if "parse" not in stages:
+        results.pop()
+    layout = record("layout", lambda: tikz.get_layout(adj, seed=1))
+    if "layout" not in stages:
+        results.pop()
+    if "search" in stages and len(mat) <= search_max_nodes:
+        record("search", lambda: SpringLayout(base_seed=0).get_layout(adj))
+    if "crossings" in stages and info["edges"] <= crossings_max_edges:
+        edges = np.stack(edge_arrays(adj), axis=1)
+        pos = np.array([layout["nodes"][k] for k in range(len(mat))])
+        record("crossings", lambda: count_crossings(edges, pos))
+    if "tikz" in stages or "compile" in stages:
+        tikz_str = record("tikz", lambda: tikz.to_tikz(adj, layout=layout))
+        if "tikz" not in stages:
+            results.pop()
+    if "compile" in stages and shutil.which("pdflatex"):
+        doc = "\\documentclass[tikz]{standalone}\n\\begin{document}" + tikz_str + "\\end{document}\n"
+        record("compile", lambda: compile_doc(doc))
+    return results
+
+
+def metadata():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    import networkx
+
+    return {
+        "commit": commit,
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "networkx": networkx.__version__,
+        "platform": platform.platform(),
+        "pdflatex": bool(shutil.which("pdflatex")),
+    }
+
+
+def report(results, baseline=None):
+    """Print a table of the results, with the time relative to the matching
+    entry of baseline (a list of results) if given.
+    """
+    old = {}
+    if baseline is not None:
+        old = {(r["family"], r["size"], r["stage"]): r["seconds"] for r in baseline}
+    print(f"{'family':<14} {'size':>6} {'edges':>8} {'stage':<10} {'seconds':>10} {'peak MB':>9}"
+          + ("  vs baseline" if old else ""))
+    for r in results:
+        line = (
+            f"{r['family']:<14} {r['size']:>6} {r['edges']:>8} {r['stage']:<10}"
+            f" {r['seconds']:>10.4f} {r['peak_bytes'] / 2**20:>9.2f}"
+        )
+        key = (r["family"], r["size"], r["stage"])
+        if key in old:
+            line += f"  {r['seconds'] / max(old[key], 1e-12):.2f}x"
+        print(line, flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the rendering stages.")
+    parser.add_argument("--families", nargs="+", default=list(FAMILIES), choices=list(FAMILIES))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[50, 200, 1000])
+    parser.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per stage (the best is kept)")
+    parser.add_argument("--search-max-nodes", type=int, default=200, help="largest graph for the search stage")
+    parser.add_argument("--crossings-max-edges", type=int, default=10000, help="largest graph for the crossings stage")
+    parser.add_argument("-o", "--output", help="json file to write the results to")
+    parser.add_argument("--compare", help="earlier json results to compare with")
+    args = parser.parse_args(argv)
+
+    if "compile" in args.stages and not shutil.which("pdflatex"):
+        print("pdflatex not found; skipping the compile stage.", file=sys.stderr)
+
+    results = []
+    for family in args.families:
+        for size in args.sizes:
+            print(f"{family} {size}", file=sys.stderr, flush=True)
+            results.extend(run_case(
+                family, size, args.stages, args.repeat, args.search_max_nodes, args.crossings_max_edges
+            ))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as fp:
+            baseline = json.load(fp)["results"]
+    print()
+    report(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump({"meta": metadata(), "results": results}, fp, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+""" Measure the cold-start cost of the project.
+
+    python scripts/startup_time.py
+    python scripts/startup_time.py --runs 10 --server -o startup.json
+
+Each measurement runs in a fresh interpreter, --runs times, and the median is
+reported:
+
+    import <module>   importing graph, utils.parse, api and batch
+    first render      importing graph and rendering a small graph to tikz
+                      (which imports networkx on the way)
+    server ready      (--server) from starting server.py to its first
+                      response, including the warm-up
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+MODULES = ["graph", "utils.parse", "api", "batch"]
+
+FIRST_RENDER = """
+from graph import TikzGrapher
+from utils.style import LineStyle, NodeStyle
+TikzGrapher(NodeStyle(), LineStyle()).to_tikz([[0, 1, 1], [1, 0, 1], [0, 0, 1]], seed=1)
+"""
+
+
+def time_code(code):
+    """Seconds taken by code in a fresh interpreter (started in the repo)."""
+    script = f"import time\nstart = time.perf_counter()\n{code}\nprint(time.perf_counter() - start)\n"
+    out = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def time_server(port, timeout=120):
+    """Seconds from starting server.py until it answers /stats."""
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "server.py", "--port", str(port), "--workers", "1"],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/stats", timeout=1)
+                return time.perf_counter() - start
+            except OSError:
+                if proc.poll() is not None:
+                    raise RuntimeError("server.py exited during startup")
+                time.sleep(0.05)
+        raise RuntimeError(f"server.py did not answer within {timeout}s")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure import and startup times.")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per measurement")
+    parser.add_argument("--server", action="store_true", help="also time server.py until its first response")
+    parser.add_argument("--port", type=int, default=5099, help="port for --server")
+    parser.add_argument("-o", "--output", help="json file to write the results to")
+    args = parser.parse_args(argv)
+
+    cases = [(f"import {m}", lambda m=m: time_code(f"import {m}")) for m in MODULES]
+    cases.append(("first render", lambda: time_code(FIRST_RENDER)))
+    if args.server:
+        cases.append(("server ready", lambda: time_server(args.port)))
+
+    results = {}
+    for name, measure in cases:
+        times = [measure() for _ in range(args.runs)]
+        results[name] = {"median": statistics.median(times), "min": min(times), "max": max(times)}
+        print(f"{name:<20} {results[name]['median'] * 1000:9.1f} ms  (min {min(times) * 1000:.1f}, max {max(times) * 1000:.1f})", flush=True)
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(results, fp, indent=1)
+
+
+if __name__ == "__main__":
+    main()
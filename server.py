@@ -0,0 +1,153 @@
+""" Pre-fork server for the API.
+
+    python server.py --port 5000 --workers 4
+
+The parent process imports the app, warms up the layout engine (numpy,
+networkx and a few small layouts of each kind) and TeX (one compile, which
+pulls pdflatex, the standalone class and TikZ into the page cache), opens the
+listening socket, and only then forks the request workers. Each worker
+therefore starts with everything already imported and initialized, shared
+copy-on-write with the parent, and can serve its first request at full speed.
+Workers that die are replaced.
+
+Threads do not survive a fork, so the warm-up leaves the thread and process
+pools of the app (TeX workers, layout pools, jobs) unstarted; each worker
+starts its own on first use. Caches, jobs and /metrics are likewise per
+worker.
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+log = logging.getLogger(__name__)
+
+WARMUP_MATRIX = [
+    [0, 1, 1, 0],
+    [1, 0, 1, 1],
+    [0, 0, 1, 1],
+    [1, 0, 0, 0],
+]
+
+
+def warm_up(compile=True):
+    """Import the app and run each step of a render once. Returns the app
+    and the time taken.
+    """
+    start = time.perf_counter()
+    import numpy as np
+    from api import app
+    from graph import TikzGrapher
+    from utils.layout import LAYOUT_METHODS, SpringLayout
+    from utils.style import LineStyle, NodeStyle
+
+    adj = np.array(WARMUP_MATRIX)
+    tikz = TikzGrapher(NodeStyle(), LineStyle())
+    for method in LAYOUT_METHODS:
+        tikz.to_doc(adj, method=method, seed=1)
+    # the batched min-crossing search (on the calling process, no pool), and
+    # the recognised families that skip it
+    SpringLayout(base_seed=0, max_trials=2, batched=True, fast_paths=False).get_layout(adj)
+    SpringLayout(base_seed=0).get_layout(adj)
+    tikz.to_svg(adj, seed=1)
+
+    if compile:
+        from utils.render import RenderError, TexProcess
+
+        _, doc = tikz.to_doc(adj, seed=1)
+        try:
+            tex = TexProcess(preamble=None)
+        except OSError:
+            log.warning("pdflatex not found; skipping the TeX warm-up.")
+        else:
+            try:
+                tex.compile(doc, timeout=60)
+            except RenderError as e:
+                log.warning("TeX warm-up failed: %s", e)
+            finally:
+                tex.close()
+    return app, time.perf_counter() - start
+
+
+def listen(host, port, backlog=128):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock):
+    """Serve requests on the shared socket until terminated."""
+    from werkzeug.serving import make_server
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    host, port = sock.getsockname()[:2]
+    server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+    server.serve_forever()
+
+
+def fork_worker(app, sock):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run_worker(app, sock)
+        finally:
+            os._exit(0)
+    return pid
+
+
+def serve(host="0.0.0.0", port=5000, workers=2, compile=True):
+    """Warm up, then fork workers and keep them running until SIGTERM or
+    SIGINT, which is passed on to the workers.
+    """
+    app, elapsed = warm_up(compile=compile)
+    log.info("Warmed up in %.2fs", elapsed)
+    sock = listen(host, port)
+    children = {fork_worker(app, sock) for _ in range(workers)}
+    log.info("Serving on %s:%d with %d workers", host, port, workers)
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            log.warning("Worker %d exited (status %d); starting another", pid, status)
+            children.add(fork_worker(app, sock))
+    sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-fork server for the tikz graph API.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 5000)))
+    parser.add_argument("-w", "--workers", type=int, default=int(os.environ.get("SERVER_WORKERS", 2)))
+    parser.add_argument("--no-tex-warmup", action="store_true", help="skip the TeX warm-up compile")
+    args = parser.parse_args(argv)
+    serve(args.host, args.port, args.workers, compile=not args.no_tex_warmup)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
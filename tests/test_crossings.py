@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from utils.crossings import count_crossings, count_crossings_batch
+
+
+def _ccw(A, B, C):
+    return (C[1] - A[1]) * (B[0] - A[0]) > (B[1] - A[1]) * (C[0] - A[0])
+
+
+def _intersect(A, B, C, D):
+    return _ccw(A, C, D) != _ccw(B, C, D) and _ccw(A, B, C) != _ccw(A, B, D)
+
+
+def brute_force_crossings(edges, pos):
+    """The pairwise count SpringLayout used before utils.crossings."""
+    count = 0
+    for i in range(len(edges)):
+        for j in range(i):
+            p1, p2 = pos[edges[i][0]], pos[edges[i][1]]
+            q1, q2 = pos[edges[j][0]], pos[edges[j][1]]
+            if len(np.unique(np.array([p1, p2, q1, q2]), axis=0)) < 4:
+                continue
+            if _intersect(p1, p2, q1, q2):
+                count += 1
+    return count
+
+
+def random_case(seed, grid):
+    rng = np.random.RandomState(seed)
+    n = rng.randint(3, 25)
+    edges = rng.randint(0, n, size=(rng.randint(1, 80), 2))
+    if grid:
+        # integer points on a small grid: many collinear edges, shared points
+        pos = rng.randint(0, 4, size=(n, 2)).astype(float)
+    else:
+        pos = rng.rand(n, 2)
+    return edges, pos
+
+
+@pytest.mark.parametrize("grid", [False, True])
+@pytest.mark.parametrize("seed", range(20))
+def test_count_crossings_matches_brute_force(seed, grid):
+    edges, pos = random_case(seed, grid)
+    expected = brute_force_crossings(edges, pos)
+
+    assert count_crossings(edges, pos, method="batched") == expected
+    assert count_crossings(edges, pos, method="sweep") == expected
+    assert count_crossings(edges, pos, method="sweep", max_chunk_pairs=7) == expected
+    assert count_crossings(edges, pos, method="batched", max_chunk_pairs=7) == expected
+    assert count_crossings_batch(edges, pos[None]).tolist() == [expected]
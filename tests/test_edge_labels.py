@@ -0,0 +1,39 @@
+import numpy as np
+
+from graph import TikzGrapher
+from utils.adjacency import EdgeLabels, tex_escape
+from utils.parse import tikz_to_html
+from utils.style import LineStyle, NodeStyle
+
+
+def test_tex_escape():
+    assert tex_escape("a_b") == r"a\_b"
+    assert tex_escape(r"\input{/etc/passwd}") == r"\textbackslash{}input\{/etc/passwd\}"
+    assert tex_escape("$&#^%~") == r"\$\&\#\^{}\%\textasciitilde{}"
+
+
+def test_edge_labels_render_literally():
+    adj_mat = np.array([[0, 1, 0], [0, 0, 1], [0, 0, 0]])
+    labels = [(0, 1, "a_b"), (1, 2, r"\input{/etc/passwd}")]
+    tikz = TikzGrapher(NodeStyle(), LineStyle()).to_tikz(adj_mat, edge_labels=labels, seed=1)
+
+    assert r"{ a\_b }" in tikz
+    assert r"{ \textbackslash{}input\{/etc/passwd\} }" in tikz
+    assert r"\input" not in tikz
+    assert "a_b" not in tikz
+
+
+def test_edge_labels_plain_text_kept():
+    labels = EdgeLabels.from_edges([(0, 1, "a_b")], 2)
+    assert labels.get(0, 1) == "a_b"
+    assert list(labels.items()) == [(0, 1, "a_b")]
+
+
+def test_edge_labels_escaped_in_html():
+    adj_mat = np.array([[0, 1], [0, 0]])
+    labels = [(0, 1, '<script>alert("x")</script> & more')]
+    tikz = TikzGrapher(NodeStyle(), LineStyle()).to_tikz(adj_mat, edge_labels=labels, seed=1)
+    page = tikz_to_html(tikz)
+
+    assert "<script" not in page
+    assert "&lt;script&gt;alert(&quot;x&quot;)&lt;/script&gt; \\&amp; more" in page
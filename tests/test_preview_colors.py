@@ -0,0 +1,21 @@
+import numpy as np
+
+from graph import TikzGrapher
+from utils.preview import svg_color
+from utils.style import LineStyle, NodeStyle
+
+
+def test_svg_color():
+    assert svg_color("red") == "#ff0000"
+    assert svg_color("red!30!blue") == "#4c00b2"
+    assert svg_color("navy") == "navy"
+    assert svg_color("#a1b2c3") == "#a1b2c3"
+    assert svg_color('red" onload="alert(1)') == "#000000"
+    assert svg_color("red!x") == "#000000"
+
+
+def test_colors_cannot_break_out_of_attributes():
+    bad = '"/><script>alert(1)</script><path d="'
+    tikz = TikzGrapher(NodeStyle(fill_color=bad, line_color=bad), LineStyle(color=bad))
+    svg = tikz.to_svg(np.array([[0, 1], [1, 0]]), seed=1)
+    assert "<script" not in svg
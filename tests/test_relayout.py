@@ -0,0 +1,21 @@
+import numpy as np
+
+from utils.layout import ForceLayout, dump_layout
+
+
+def test_changing_a_loop_moves_no_node():
+    adj = np.zeros((6, 6), dtype=int)
+    for i in range(5):
+        adj[i, i + 1] = 1
+    tool = ForceLayout(seed=1)
+    previous = dump_layout(tool.get_layout(adj), adj)
+
+    looped = adj.copy()
+    looped[2, 2] = 1
+    added = tool.relayout(looped, previous)
+    for node, xy in previous["nodes"].items():
+        np.testing.assert_allclose(added["nodes"][node], xy)
+
+    removed = tool.relayout(adj, dump_layout(added, looped))
+    for node, xy in previous["nodes"].items():
+        np.testing.assert_allclose(removed["nodes"][node], xy)
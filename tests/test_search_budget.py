@@ -0,0 +1,32 @@
+import time
+
+import networkx as nx
+
+from utils.layout import SearchController, SpringLayout
+
+
+def test_trials_left():
+    assert SearchController().trials_left(0.1) is None
+    assert SearchController(time_budget=1).trials_left(0.1) in (9, 10)
+
+    search = SearchController(time_budget=0.1)
+    assert search.trials_left(1) == 0
+    assert search.done() and search.reason == "time"
+
+
+def test_batched_search_keeps_to_time_budget():
+    # a single batch of this graph is dozens of trials, several seconds
+    adj = nx.to_numpy_array(nx.gnm_random_graph(300, 600, seed=1)).astype(int)
+    events = []
+    layout = SpringLayout(
+        base_seed=0, time_budget=1, max_trials=200, batched=True, fast_paths=False, components=False
+    )
+    layout.progress = lambda event, **info: events.append((event, info))
+
+    start = time.monotonic()
+    layout.get_layout(adj)
+    elapsed = time.monotonic() - start
+
+    assert elapsed < 1.5
+    event, info = events[-1]
+    assert event == "search" and info["stopped"] == "time"
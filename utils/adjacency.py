@@ -0,0 +1,432 @@
+""" Adjacency matrix representations and the operations the pipeline needs
+on them.
+
+Inside the pipeline an adjacency matrix is either a BitAdjacency (dense, one
+bit per entry) or a SparseAdjacency (sorted edge list). Dense numpy arrays and
+scipy.sparse matrices are converted to these by as_adjacency, which the helpers
+below call first, so they accept any of the four. On sparse matrices their
+cost is proportional to the number of edges rather than the number of nodes
+squared.
+"""
+import numpy as np
+
+# number of matrix entries unpacked at a time by BitAdjacency
+BLOCK_ENTRIES = 2**24
+
+# number of set bits in each byte value
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+
+class BitAdjacency:
+    """Binary adjacency matrix stored densely with one bit per entry: row i is
+    bits[i], packed 8 columns to a byte with np.packbits.
+    """
+
+    def __init__(self, num_nodes, bits):
+        bits = np.asarray(bits, dtype=np.uint8)
+        assert bits.shape == (num_nodes, (num_nodes + 7) // 8), "Packed rows have the wrong shape."
+        self.num_nodes = int(num_nodes)
+        self.bits = bits
+
+    @classmethod
+    def from_dense(cls, mat):
+        """Build from a dense array (any nonzero entry is an edge)."""
+        mat = np.asarray(mat)
+        assert mat.ndim == 2 and mat.shape[0] == mat.shape[1], "Adjacency matrix must be square."
+        return cls(mat.shape[0], np.packbits(mat != 0, axis=1))
+
+    @property
+    def shape(self):
+        return (self.num_nodes, self.num_nodes)
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def __len__(self):
+        return self.num_nodes
+
+    def _block_rows(self):
+        """Number of rows to unpack at a time (a multiple of 8)."""
+        return max(8, BLOCK_ENTRIES // max(self.num_nodes, 1) // 8 * 8)
+
+    def unpack(self, start=0, stop=None):
+        """Rows start:stop as a bool array."""
+        block = np.unpackbits(self.bits[start:stop], axis=1, count=self.num_nodes)
+        return block.view(bool)
+
+    def transpose_bits(self, start=0, stop=None):
+        """Rows start:stop of the transpose, packed like bits."""
+        stop = self.num_nodes if stop is None else stop
+        first = start // 8
+        cols = np.unpackbits(self.bits[:, first : (stop + 7) // 8], axis=1)
+        cols = cols[:, start - 8 * first : stop - 8 * first]
+        return np.packbits(cols.T, axis=1)
+
+    def iter_blocks(self):
+        """Yield (start, rows, transposed rows) in blocks of packed rows."""
+        step = self._block_rows()
+        for start in range(0, self.num_nodes, step):
+            stop = min(start + step, self.num_nodes)
+            yield start, self.bits[start:stop], self.transpose_bits(start, stop)
+
+    def nonzero(self):
+        step = self._block_rows()
+        return _nonzero(
+            (start, self.unpack(start, start + step))
+            for start in range(0, self.num_nodes, step)
+        )
+
+    def diagonal(self):
+        idx = np.arange(self.num_nodes)
+        return (self.bits[idx, idx // 8] >> (7 - idx % 8)) & 1
+
+    def toarray(self):
+        return self.unpack().astype(np.int_)
+
+
+class SparseAdjacency:
+    """Binary adjacency matrix stored as a sorted list of (row, col) edges."""
+
+    def __init__(self, num_nodes, rows, cols):
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        assert rows.shape == cols.shape, "Edge endpoint arrays must have the same length."
+        if len(rows):
+            assert rows.min() >= 0 and cols.min() >= 0, "Node indices must be non-negative."
+            assert max(rows.max(), cols.max()) < num_nodes, "Node index out of range."
+
+        # sort and drop duplicate edges
+        keys = np.unique(rows * num_nodes + cols)
+        self.num_nodes = int(num_nodes)
+        self.rows = keys // num_nodes
+        self.cols = keys % num_nodes
+
+    @classmethod
+    def from_edges(cls, edges, num_nodes=None):
+        """Build from an iterable of (row, col) pairs. The number of nodes
+        defaults to one more than the largest index.
+        """
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        if num_nodes is None:
+            num_nodes = int(edges.max()) + 1 if len(edges) else 0
+        return cls(num_nodes, edges[:, 0], edges[:, 1])
+
+    @classmethod
+    def from_scipy(cls, mat):
+        """Build from a scipy.sparse matrix (any nonzero entry is an edge)."""
+        coo = mat.tocoo()
+        nonzero = coo.data != 0
+        assert coo.shape[0] == coo.shape[1], "Adjacency matrix must be square."
+        return cls(coo.shape[0], coo.row[nonzero], coo.col[nonzero])
+
+    @property
+    def shape(self):
+        return (self.num_nodes, self.num_nodes)
+
+    def __len__(self):
+        return self.num_nodes
+
+    def nonzero(self):
+        return self.rows, self.cols
+
+    def keys(self):
+        """Sorted row-major indices (row * num_nodes + col) of the edges."""
+        return self.rows * self.num_nodes + self.cols
+
+    def toarray(self):
+        mat = np.zeros(self.shape, dtype=np.int_)
+        mat[self.rows, self.cols] = 1
+        return mat
+
+
+def format_label(value):
+    """Text of an edge label: numbers without a trailing .0, anything else
+    as str.
+    """
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        return str(int(value))
+    if isinstance(value, (bool, np.bool_)):
+        return str(int(value))
+    return str(value)
+
+
+# LaTeX special characters (and line breaks, which would end the paragraph of
+# a node) and their literal replacements
+_TEX_ESCAPES = str.maketrans({
+    "\\": r"\textbackslash{}",
+    "{": r"\{",
+    "}": r"\}",
+    "$": r"\$",
+    "&": r"\&",
+    "#": r"\#",
+    "^": r"\^{}",
+    "_": r"\_",
+    "%": r"\%",
+    "~": r"\textasciitilde{}",
+    "\n": " ",
+    "\r": " ",
+})
+
+
+def tex_escape(text):
+    """text with the LaTeX special characters escaped, so that it is typeset
+    literally inside a TikZ node.
+    """
+    return text.translate(_TEX_ESCAPES)
+
+
+class EdgeLabels:
+    """Labels (or weights) of edges, stored as the sorted row-major keys
+    (row * num_nodes + col) of the labelled edges and their label strings, so
+    the memory used is proportional to the number of labelled edges. The
+    labels are kept as plain text (values) and escaped for LaTeX (tex_values).
+    """
+
+    def __init__(self, num_nodes, rows, cols, values):
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        assert rows.shape == cols.shape == (len(values),), "Need one label per edge."
+        if len(rows):
+            assert rows.min() >= 0 and cols.min() >= 0, "Node indices must be non-negative."
+            assert max(rows.max(), cols.max()) < num_nodes, "Node index out of range."
+
+        # sort, keeping the last label given for an edge
+        keys = rows * num_nodes + cols
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        last = np.append(keys[1:] != keys[:-1], True)
+        self.num_nodes = int(num_nodes)
+        self.keys = keys[last]
+        self.values = np.array([format_label(v) for v in values], dtype=object)[order][last]
+        self.tex_values = np.array([tex_escape(v) for v in self.values], dtype=object)
+
+    @classmethod
+    def from_edges(cls, labels, num_nodes):
+        """Build from a dict {(row, col): label} or an iterable of
+        (row, col, label) triples.
+        """
+        if isinstance(labels, dict):
+            labels = [(i, j, v) for (i, j), v in labels.items()]
+        labels = list(labels)
+        rows = [int(i) for i, _, _ in labels]
+        cols = [int(j) for _, j, _ in labels]
+        return cls(num_nodes, rows, cols, [v for _, _, v in labels])
+
+    @classmethod
+    def from_matrix(cls, mat):
+        """Label the edges of a weighted (dense or scipy.sparse) matrix with
+        their entries.
+        """
+        if hasattr(mat, "tocoo"):
+            coo = mat.tocoo()
+            nonzero = coo.data != 0
+            return cls(coo.shape[0], coo.row[nonzero], coo.col[nonzero], coo.data[nonzero].tolist())
+        mat = np.asarray(mat)
+        rows, cols = np.nonzero(mat)
+        return cls(mat.shape[0], rows, cols, mat[rows, cols].tolist())
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, rows, cols, default="", tex=False):
+        """Labels of the edges (rows[k], cols[k]), with default for the edges
+        that have none, as a list. With tex, the labels are escaped for LaTeX.
+        """
+        keys = np.asarray(rows, dtype=np.int64) * self.num_nodes + np.asarray(cols, dtype=np.int64)
+        idx = np.minimum(np.searchsorted(self.keys, keys), max(len(self.keys) - 1, 0))
+        found = self.keys[idx] == keys if len(self.keys) else np.zeros(len(keys), dtype=bool)
+        values = np.full(len(keys), default, dtype=object)
+        values[found] = (self.tex_values if tex else self.values)[idx[found]]
+        return values.tolist()
+
+    def get(self, row, col, default=""):
+        return self.lookup([row], [col], default)[0]
+
+    def items(self):
+        """(row, col, label) triples, in row-major order."""
+        return zip((self.keys // self.num_nodes).tolist(), (self.keys % self.num_nodes).tolist(), self.values.tolist())
+
+
+def as_edge_labels(labels, num_nodes):
+    """EdgeLabels from EdgeLabels, a dict {(row, col): label} or an iterable
+    of (row, col, label) triples; None stays None.
+    """
+    if labels is None or isinstance(labels, EdgeLabels):
+        return labels
+    return EdgeLabels.from_edges(labels, num_nodes)
+
+
+def _unpacked(packed, n):
+    return np.unpackbits(packed, axis=1, count=n).view(bool)
+
+
+def _nonzero(blocks):
+    """Row-major (rows, cols) of the nonzero entries of a matrix given as
+    (first row, bool array of rows) blocks.
+    """
+    rows, cols = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+    for start, block in blocks:
+        r, c = np.nonzero(block)
+        rows.append(r + start)
+        cols.append(c)
+    return np.concatenate(rows), np.concatenate(cols)
+
+
+def is_sparse(adj_mat):
+    return isinstance(adj_mat, SparseAdjacency) or hasattr(adj_mat, "tocoo")
+
+
+def as_adjacency(adj_mat):
+    """Convert scipy.sparse matrices to SparseAdjacency and dense arrays to
+    BitAdjacency; leave those two alone.
+    """
+    if isinstance(adj_mat, (SparseAdjacency, BitAdjacency)):
+        return adj_mat
+    if hasattr(adj_mat, "tocoo"):
+        return SparseAdjacency.from_scipy(adj_mat)
+    return BitAdjacency.from_dense(adj_mat)
+
+
+def num_nodes(adj_mat):
+    return adj_mat.shape[0]
+
+
+def edge_arrays(adj_mat):
+    """Row and column indices of the (directed) edges, in row-major order."""
+    return as_adjacency(adj_mat).nonzero()
+
+
+def edge_keys(adj_mat):
+    """Sorted row-major indices (row * N + col) of the edges."""
+    rows, cols = edge_arrays(adj_mat)
+    return rows.astype(np.int64) * num_nodes(adj_mat) + cols
+
+
+def loop_nodes(adj_mat):
+    """Indices of the nodes with a self-loop."""
+    adj_mat = as_adjacency(adj_mat)
+    if isinstance(adj_mat, BitAdjacency):
+        return np.flatnonzero(adj_mat.diagonal())
+    rows, cols = adj_mat.nonzero()
+    return rows[rows == cols]
+
+
+def to_graph(adj_mat):
+    """Undirected networkx graph with nodes 0..N-1 and an edge wherever
+    either direction is present.
+    """
+    import networkx as nx
+
+    adj_mat = as_adjacency(adj_mat)
+    rows, cols = adj_mat.nonzero()
+    H = nx.Graph()
+    H.add_nodes_from(range(adj_mat.num_nodes))
+    H.add_edges_from(zip(rows.tolist(), cols.tolist()))
+    return H
+
+
+def classify_edges(adj_mat):
+    """Split the edges into unidirectional edges (i -> j without j -> i) and
+    bidirectional pairs or self-loops (listed once, with i <= j). Both are
+    returned as (rows, cols) in row-major order.
+    """
+    adj_mat = as_adjacency(adj_mat)
+    n = adj_mat.num_nodes
+    if isinstance(adj_mat, BitAdjacency):
+        # A & ~A.T and triu(A & A.T), on packed blocks of rows
+        blocks = list(adj_mat.iter_blocks())
+        asym_idx = _nonzero((start, _unpacked(block & ~block_t, n)) for start, block, block_t in blocks)
+        sym_idx = _nonzero(
+            (start, np.triu(_unpacked(block & block_t, n), k=start))
+            for start, block, block_t in blocks
+        )
+        return asym_idx, sym_idx
+
+    rows, cols = adj_mat.rows, adj_mat.cols
+    keys = adj_mat.keys()
+    reverse = np.isin(cols * n + rows, keys)
+    asym = ~reverse
+    sym = reverse & (rows <= cols)
+    return (rows[asym], cols[asym]), (rows[sym], cols[sym])
+
+
+def neighbor_counts(adj_mat):
+    """Number of distinct nodes adjacent to each node in either direction
+    (a self-loop counts its own node).
+    """
+    adj_mat = as_adjacency(adj_mat)
+    n = adj_mat.num_nodes
+    if isinstance(adj_mat, BitAdjacency):
+        # popcount of the rows of A | A.T
+        counts = [np.zeros(0, dtype=np.int64)]
+        for _, block, block_t in adj_mat.iter_blocks():
+            counts.append(_POPCOUNT[block | block_t].sum(axis=1))
+        return np.concatenate(counts)
+
+    rows, cols = adj_mat.rows, adj_mat.cols
+    lo = np.minimum(rows, cols)
+    hi = np.maximum(rows, cols)
+    pairs = np.unique(lo * n + hi)
+    lo, hi = pairs // n, pairs % n
+    counts = np.bincount(lo, minlength=n)
+    counts += np.bincount(hi[hi != lo], minlength=n)
+    return counts
+
+
+def connected_components(adj_mat):
+    """Component of each node (ignoring edge direction), numbered from 0 in
+    order of their smallest node, by hooking and pointer jumping: O(E) per
+    round and O(log N) rounds in practice.
+    """
+    n = num_nodes(adj_mat)
+    rows, cols = edge_arrays(adj_mat)
+    parent = np.arange(n, dtype=np.int64)
+    while True:
+        lu, lv = parent[rows], parent[cols]
+        differ = lu != lv
+        if not differ.any():
+            break
+        # hook the larger root onto the smaller, then flatten the trees
+        np.minimum.at(parent, np.maximum(lu, lv)[differ], np.minimum(lu, lv)[differ])
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+    # the roots are the smallest node of each component
+    return np.unique(parent, return_inverse=True)[1].reshape(-1)
+
+
+def split_components(adj_mat, components=None):
+    """The connected components as (nodes, SparseAdjacency of the induced
+    subgraph with the nodes renumbered 0..len(nodes)-1) pairs, nodes sorted.
+    """
+    if components is None:
+        components = connected_components(adj_mat)
+    rows, cols = edge_arrays(adj_mat)
+    count = int(components.max()) + 1 if len(components) else 0
+
+    # nodes grouped by component, and each node's index within its component
+    order = np.argsort(components, kind="stable")
+    node_ptr = np.searchsorted(components[order], np.arange(count + 1))
+    local = np.empty(len(components), dtype=np.int64)
+    local[order] = np.arange(len(order)) - node_ptr[components[order]]
+
+    # edges grouped by component
+    edge_comp = components[rows]
+    edge_order = np.argsort(edge_comp, kind="stable")
+    edge_ptr = np.searchsorted(edge_comp[edge_order], np.arange(count + 1))
+    rows, cols = local[rows[edge_order]], local[cols[edge_order]]
+
+    return [
+        (
+            order[node_ptr[c] : node_ptr[c + 1]],
+            SparseAdjacency(
+                node_ptr[c + 1] - node_ptr[c],
+                rows[edge_ptr[c] : edge_ptr[c + 1]],
+                cols[edge_ptr[c] : edge_ptr[c + 1]],
+            ),
+        )
+        for c in range(count)
+    ]
@@ -0,0 +1,170 @@
+""" Content-addressed caches.
+
+Layouts are keyed on a hash of the (binarized) adjacency matrix together with
+the parameters that affect the geometry, so requests that only change colours,
+arrow tips, etc. can skip the layout step entirely. Compiled SVGs are keyed on
+a hash of the full LaTeX document.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from utils.adjacency import edge_keys
+from utils.layout import dump_layout, load_layout
+
+
+def hash_matrix(adj_mat, params=None):
+    """Canonical hash of a binarized adjacency matrix and a dictionary of
+    (json serializable) parameters. Dense and sparse representations of the
+    same graph hash the same.
+    """
+    h = hashlib.sha256()
+    h.update(np.array(adj_mat.shape, dtype=np.int64).tobytes())
+    h.update(edge_keys(adj_mat).astype(np.int64).tobytes())
+    h.update(json.dumps(params or {}, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+def hash_document(doc):
+    """Hash of a LaTeX document."""
+    return hashlib.sha256(doc.encode("utf-8")).hexdigest()
+
+
+class Cache:
+    """Two-tier cache: an in-memory LRU of at most maxsize entries in front
+    of an optional directory of files that survives restarts. Child classes
+    define how entries are written to and read from disk.
+    """
+
+    suffix = ""
+
+    def __init__(self, maxsize=256, cache_dir=None):
+        self.maxsize = maxsize
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, key):
+        """Return the cached entry for key, or None."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+
+        value = self._read(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.disk_hits += 1
+                self._remember(key, value)
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._remember(key, value)
+        self._write(key, value)
+
+    def get_or_compute(self, key, compute):
+        """Return the cached entry for key, computing and storing it on a miss."""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._memory),
+                "maxsize": self.maxsize,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + self.suffix)
+
+    def _read(self, key):
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._path(key), "rb") as fp:
+                return self._decode(fp.read())
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, key, value):
+        if self.cache_dir is None:
+            return
+        # write to a temporary file and rename, so readers never see half a file
+        tmp = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as fp:
+                fp.write(self._encode(value))
+            os.replace(tmp, self._path(key))
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _encode(self, value):
+        """Serialize an entry to bytes."""
+        raise NotImplementedError
+
+    def _decode(self, data):
+        """Deserialize an entry from bytes."""
+        raise NotImplementedError
+
+
+class LayoutCache(Cache):
+    """Cache of layout dictionaries, as returned by Layout.get_layout."""
+
+    suffix = ".json"
+
+    def key(self, adj_mat, params):
+        return hash_matrix(adj_mat, params)
+
+    def _encode(self, layout):
+        return json.dumps(dump_layout(layout)).encode("utf-8")
+
+    def _decode(self, data):
+        return load_layout(json.loads(data))
+
+
+class SvgCache(Cache):
+    """Cache of compiled SVGs (bytes), keyed on the LaTeX document."""
+
+    suffix = ".svg"
+
+    def key(self, doc):
+        return hash_document(doc)
+
+    def _encode(self, svg):
+        return svg
+
+    def _decode(self, data):
+        return data
@@ -0,0 +1,181 @@
+""" Edge crossing counters for straight-line layouts.
+
+Two engines are provided. The batched engine runs the orientation test over
+all pairs of edges at once (in bounded chunks), which is fastest for small and
+dense graphs. The sweep engine sorts the edges along the x axis and only tests
+pairs whose bounding boxes overlap, which is fastest for sparse graphs with many
+edges. Both count exactly the pairs that ``SpringLayout._num_crossings`` used to
+count: a pair is skipped whenever two of its four endpoints coincide (a shared
+node or a self-loop), and the crossing test is the strict ``ccw`` test.
+"""
+import numpy as np
+
+# maximum number of edge pairs held in memory at once
+MAX_CHUNK_PAIRS = 2**20
+
+# above this many edges, the sweep engine is used by default
+SWEEP_THRESHOLD = 100
+
+
+def layout_arrays(H, layout):
+    """Convert a networkx graph and a layout dictionary to an (E, 2) array of
+    edge endpoints and an array of positions indexed by node.
+    """
+    edges = np.array(list(H.edges), dtype=np.int64).reshape(-1, 2)
+    keys = np.fromiter(layout.keys(), dtype=np.int64, count=len(layout))
+    pos = np.zeros((keys.max() + 1 if len(keys) else 0, 2))
+    pos[keys] = np.array(list(layout.values()), dtype=np.float64).reshape(-1, 2)
+    return edges, pos
+
+
+def count_crossings(edges, pos, method="auto", max_chunk_pairs=MAX_CHUNK_PAIRS):
+    """Return the number of crossing pairs of edges.
+
+    edges is an (E, 2) integer array of node indices and pos an (N, 2) array
+    of node positions. method is one of "batched", "sweep" or "auto".
+    """
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    pos = np.asarray(pos, dtype=np.float64)
+    if method == "auto":
+        method = "sweep" if len(edges) > SWEEP_THRESHOLD else "batched"
+
+    if method == "batched":
+        return _count_batched(edges, pos, max_chunk_pairs)
+    elif method == "sweep":
+        return _count_sweep(edges, pos, max_chunk_pairs)
+    raise ValueError(f"Unrecognized crossing count method {method}.")
+
+
+def _ccw(A, B, C):
+    """Vectorized version of the ``ccw`` orientation test."""
+    return (C[..., 1] - A[..., 1]) * (B[..., 0] - A[..., 0]) > (
+        B[..., 1] - A[..., 1]
+    ) * (C[..., 0] - A[..., 0])
+
+
+def _same(P, Q):
+    return (P[..., 0] == Q[..., 0]) & (P[..., 1] == Q[..., 1])
+
+
+def _crossing(p1, p2, q1, q2):
+    """Whether the segments p1-p2 and q1-q2 cross (elementwise), False for
+    pairs whose endpoints are not four distinct points.
+    """
+    degenerate = (
+        _same(p1, p2)
+        | _same(p1, q1)
+        | _same(p1, q2)
+        | _same(p2, q1)
+        | _same(p2, q2)
+        | _same(q1, q2)
+    )
+    crossing = (_ccw(p1, q1, q2) != _ccw(p2, q1, q2)) & (
+        _ccw(p1, p2, q1) != _ccw(p1, p2, q2)
+    )
+    return crossing & ~degenerate
+
+
+def _count_pairs(p1, p2, q1, q2):
+    """Count crossings between the segments p1-p2 and q1-q2 (elementwise)."""
+    return int(np.count_nonzero(_crossing(p1, p2, q1, q2)))
+
+
+def count_crossings_batch(edges, pos, max_chunk_pairs=MAX_CHUNK_PAIRS):
+    """Return the number of crossing pairs of edges in each of K layouts of
+    the same graph, as an array of K counts. pos is a (K, N, 2) array. Every
+    pair of edges is tested, for all the layouts at once.
+    """
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    pos = np.asarray(pos, dtype=np.float64)
+    num_edges = len(edges)
+    counts = np.zeros(len(pos), dtype=np.int64)
+    if num_edges < 2 or not len(pos):
+        return counts
+    P1 = pos[:, edges[:, 0]]
+    P2 = pos[:, edges[:, 1]]
+
+    rows = max(1, max_chunk_pairs // (num_edges * len(pos)))
+    for start in range(1, num_edges, rows):
+        stop = min(start + rows, num_edges)
+        i_idx, j_idx = np.nonzero(
+            np.arange(start, stop)[:, None] > np.arange(stop - 1)[None, :]
+        )
+        i_idx += start
+        crossing = _crossing(P1[:, i_idx], P2[:, i_idx], P1[:, j_idx], P2[:, j_idx])
+        counts += np.count_nonzero(crossing, axis=1)
+    return counts
+
+
+def _count_batched(edges, pos, max_chunk_pairs):
+    """Test every pair of edges, a block of rows at a time."""
+    num_edges = len(edges)
+    if num_edges < 2:
+        return 0
+    P1 = pos[edges[:, 0]]
+    P2 = pos[edges[:, 1]]
+
+    rows = max(1, max_chunk_pairs // num_edges)
+    ncrossings = 0
+    for start in range(1, num_edges, rows):
+        stop = min(start + rows, num_edges)
+        # pair each edge i in [start, stop) with every edge j < i
+        i_idx, j_idx = np.nonzero(
+            np.arange(start, stop)[:, None] > np.arange(stop - 1)[None, :]
+        )
+        i_idx += start
+        ncrossings += _count_pairs(P1[i_idx], P2[i_idx], P1[j_idx], P2[j_idx])
+    return ncrossings
+
+
+def _count_sweep(edges, pos, max_chunk_pairs):
+    """Sweep a vertical line left to right. Each edge is only tested against
+    the edges that are active (overlap in x) when it starts and that also
+    overlap it in y.
+    """
+    num_edges = len(edges)
+    if num_edges < 2:
+        return 0
+    P1 = pos[edges[:, 0]]
+    P2 = pos[edges[:, 1]]
+    lo = np.minimum(P1, P2)
+    hi = np.maximum(P1, P2)
+
+    # pad the boxes slightly so that rounding in the orientation test can
+    # never report a crossing for a pair the sweep did not consider.
+    pad = 1e-9 * max(1.0, float(np.abs(pos).max()))
+    lo = lo - pad
+    hi = hi + pad
+
+    order = np.argsort(lo[:, 0], kind="stable")
+    lo, hi = lo[order], hi[order]
+
+    # edges k in (i, end[i]) start before edge i leaves the sweep line
+    end = np.searchsorted(lo[:, 0], hi[:, 0], side="right")
+    counts = end - np.arange(1, num_edges + 1)
+    counts = np.maximum(counts, 0)
+
+    csum = np.cumsum(counts)
+    ncrossings = 0
+    start = 0
+    while start < num_edges:
+        # grow the block of sweep events until it has enough candidate pairs
+        done = csum[start - 1] if start else 0
+        stop = int(np.searchsorted(csum, done + max_chunk_pairs, side="right"))
+        stop = min(max(stop, start + 1), num_edges)
+
+        block_counts = counts[start:stop]
+        i_idx = np.repeat(np.arange(start, stop), block_counts)
+        offsets = np.arange(len(i_idx)) - np.repeat(
+            np.cumsum(block_counts) - block_counts, block_counts
+        )
+        j_idx = i_idx + 1 + offsets
+
+        # prune by y overlap
+        keep = (lo[j_idx, 1] <= hi[i_idx, 1]) & (lo[i_idx, 1] <= hi[j_idx, 1])
+        i_idx, j_idx = order[i_idx[keep]], order[j_idx[keep]]
+
+        # test in the same edge order as the batched engine (later edge first)
+        i_idx, j_idx = np.maximum(i_idx, j_idx), np.minimum(i_idx, j_idx)
+        ncrossings += _count_pairs(P1[i_idx], P2[i_idx], P1[j_idx], P2[j_idx])
+        start = stop
+    return ncrossings
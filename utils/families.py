@@ -0,0 +1,216 @@
+""" Deterministic crossing-free layouts for graph families that have one.
+
+Before searching random spring layouts for one with few crossings,
+SpringLayout checks whether the graph is one of these, and if so draws it
+directly:
+
+    tree                 radial tree (or layered, if the radial one crosses)
+    cycle                regular polygon
+    grid                 the grid itself
+    planar               Tutte's barycentric embedding with the largest face
+                         on a circle (or networkx's straight-line grid
+                         drawing, if that is degenerate)
+
+Graphs that cannot be drawn without crossings are left to the search, even
+when they have a well known symmetric drawing: those of complete graphs and
+complete bipartite graphs cross far more often than the layouts the search
+finds. (The complete and complete bipartite graphs that are planar are
+drawn as planar graphs.)
+
+Only connected graphs are recognised (see Layout for splitting a graph into
+its components); self-loops are ignored.
+"""
+import math
+
+import numpy as np
+
+from utils.crossings import count_crossings
+
+# Tutte embeddings are solved densely up to this many nodes
+TUTTE_MAX_NODES = 1000
+
+
+def family_layout(H):
+    """ The family of the networkx graph H and a layout of it (a dict from
+    node to position), or None if it is not a recognised family.
+    """
+    import networkx as nx
+
+    G = nx.Graph(H)
+    G.remove_edges_from(nx.selfloop_edges(G))
+    n, m = G.number_of_nodes(), G.number_of_edges()
+    if n < 2 or not nx.is_connected(G):
+        return None
+    degrees = np.array([d for _, d in G.degree()])
+
+    if m == n - 1:
+        return "tree", tree_layout(G)
+    if (degrees == 2).all():
+        return "cycle", cycle_layout(G)
+    layout = grid_layout(G)
+    if layout is not None:
+        return "grid", layout
+    if m <= 3 * n - 6 or n < 5:
+        is_planar, embedding = nx.check_planarity(G)
+        if is_planar:
+            return "planar", planar_layout(G, embedding)
+    return None
+
+
+def _crossing_free(G, layout):
+    nodes = sorted(G)
+    index = {node: i for i, node in enumerate(nodes)}
+    pos = np.array([layout[node] for node in nodes], dtype=np.float64)
+    if len(np.unique(pos.round(9), axis=0)) < len(pos):
+        return False
+    edges = np.array([(index[u], index[v]) for u, v in G.edges], dtype=np.int64).reshape(-1, 2)
+    return count_crossings(edges, pos) == 0
+
+
+def _circle(nodes):
+    angles = 2 * math.pi * np.arange(len(nodes)) / len(nodes)
+    return dict(zip(nodes, np.stack([np.cos(angles), np.sin(angles)], axis=1)))
+
+
+def tree_layout(G):
+    """ Radial layout of a tree: rooted at its centre, each node at the
+    distance of its depth, and each subtree in a wedge proportional to its
+    number of leaves. If a long edge cuts across a neighbouring wedge, the
+    tree is laid out in layers instead (same order, depth downwards), which
+    never crosses.
+    """
+    import networkx as nx
+
+    # the centre is the middle of a longest path (found by two searches)
+    start = min(G)
+    far = max(nx.single_source_shortest_path_length(G, start).items(), key=lambda item: (item[1], -item[0]))[0]
+    dist = nx.single_source_shortest_path_length(G, far)
+    other = max(dist.items(), key=lambda item: (item[1], -item[0]))[0]
+    path = nx.shortest_path(G, far, other)
+    root = path[len(path) // 2]
+
+    # children in node order, and the leaves below each node
+    order = [root]
+    parent = {root: None}
+    children = {}
+    for node in order:
+        children[node] = sorted(v for v in G[node] if v != parent[node])
+        for child in children[node]:
+            parent[child] = node
+            order.append(child)
+    leaves = {}
+    for node in reversed(order):
+        leaves[node] = sum(leaves[child] for child in children[node]) or 1
+
+    # interval [lo, lo + leaves) of leaf slots and depth of each node
+    lo = {root: 0}
+    depth = {root: 0}
+    for node in order:
+        start = lo[node]
+        for child in children[node]:
+            lo[child] = start
+            depth[child] = depth[node] + 1
+            start += leaves[child]
+
+    total = leaves[root]
+    mid = {node: lo[node] + leaves[node] / 2 for node in order}
+    angle = {node: 2 * math.pi * mid[node] / total for node in order}
+    radial = {node: depth[node] * np.array([math.cos(angle[node]), math.sin(angle[node])]) for node in order}
+    if _crossing_free(G, radial):
+        return radial
+    return {node: np.array([mid[node], -float(depth[node])]) for node in order}
+
+
+def cycle_layout(G):
+    """ The nodes of a cycle graph around a regular polygon, in cycle order. """
+    start = min(G)
+    order = [start]
+    prev, node = start, min(G[start])
+    while node != start:
+        order.append(node)
+        prev, node = node, next(v for v in G[node] if v != prev)
+    return _circle(order)
+
+
+def grid_layout(G):
+    """ Positions of a rectangular grid graph (of at least 2 x 3 nodes) on
+    the grid, or None if G is not one. The coordinates of each node are read
+    off its distances from two corners on the same side, and then every edge
+    is checked to join neighbouring grid points.
+    """
+    import networkx as nx
+
+    n, m = G.number_of_nodes(), G.number_of_edges()
+    corners = sorted(node for node, d in G.degree() if d == 2)
+    if len(corners) != 4 or any(d > 4 for _, d in G.degree()):
+        return None
+    dist_a = nx.single_source_shortest_path_length(G, corners[0])
+    b = min(corners[1:], key=lambda node: (dist_a[node], node))
+    width = dist_a[b]
+    if width == 0 or n % (width + 1):
+        return None
+    height = n // (width + 1) - 1
+    if height < 1 or m != width * (height + 1) + (width + 1) * height:
+        return None
+    dist_b = nx.single_source_shortest_path_length(G, b)
+
+    nodes = sorted(G)
+    da = np.array([dist_a[node] for node in nodes])
+    db = np.array([dist_b[node] for node in nodes])
+    x2, y2 = da - db + width, da + db - width
+    if (x2 % 2).any() or (y2 % 2).any():
+        return None
+    x, y = x2 // 2, y2 // 2
+    if x.min() < 0 or x.max() > width or y.min() < 0 or y.max() > height:
+        return None
+    if len(np.unique(x * (height + 1) + y)) != n:
+        return None
+    index = {node: i for i, node in enumerate(nodes)}
+    edges = np.array([(index[u], index[v]) for u, v in G.edges], dtype=np.int64)
+    if (np.abs(x[edges[:, 0]] - x[edges[:, 1]]) + np.abs(y[edges[:, 0]] - y[edges[:, 1]]) != 1).any():
+        return None
+    return dict(zip(nodes, np.stack([x, y], axis=1).astype(np.float64)))
+
+
+def planar_layout(G, embedding):
+    """ Straight-line layout of a planar graph without crossings: Tutte's
+    barycentric embedding, with the largest face of the embedding fixed on a
+    circle and every other node at the mean of its neighbours (one linear
+    solve). That is crossing free for 3-connected graphs; when it is not
+    (or the graph is large), the straight-line grid drawing networkx makes
+    from the embedding is used instead.
+    """
+    import networkx as nx
+
+    if G.number_of_nodes() <= TUTTE_MAX_NODES:
+        # the faces of the embedding, each found from its first half-edge
+        seen = set()
+        outer = []
+        for u, v in embedding.edges():
+            if (u, v) not in seen:
+                face = embedding.traverse_face(u, v, mark_half_edges=seen)
+                if len(face) > len(outer):
+                    outer = face
+
+        if len(set(outer)) == len(outer) >= 3:
+            layout = dict(_circle(outer))
+            inner = sorted(set(G) - set(outer))
+            if inner:
+                index = {node: i for i, node in enumerate(inner)}
+                lap = np.zeros((len(inner), len(inner)))
+                rhs = np.zeros((len(inner), 2))
+                for node in inner:
+                    i = index[node]
+                    for other in G[node]:
+                        lap[i, i] += 1
+                        if other in index:
+                            lap[i, index[other]] -= 1
+                        else:
+                            rhs[i] += layout[other]
+                layout.update(zip(inner, np.linalg.solve(lap, rhs)))
+            if _crossing_free(G, layout):
+                return layout
+
+    # on an integer grid, so that collinear edges stay exactly collinear
+    return {node: np.asarray(p, dtype=np.float64) for node, p in nx.combinatorial_embedding_to_pos(embedding).items()}
+
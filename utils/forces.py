@@ -0,0 +1,341 @@
+""" Vectorized Fruchterman-Reingold force-directed layout.
+
+Attraction runs along the edges only, so it is O(E) per iteration. Repulsion
+between all pairs of nodes is approximated with a hierarchy of regular grids
+(a quadtree flattened level by level, as in Barnes-Hut): at each level a node
+is pushed by the centre of mass of every cell that is close to its parent cell
+but not adjacent to its own cell, and at the finest level by the individual
+nodes in the adjacent cells. Every pair of nodes is accounted for exactly once,
+at the coarsest level at which their cells are separated, which makes the cost
+O(N log N) per iteration instead of O(N^2).
+
+spring_batch runs the dense simulation that nx.spring_layout uses for small
+graphs, for many random seeds at once.
+"""
+import numpy as np
+
+# minimum distance between two nodes, to keep the forces finite
+MIN_DISTANCE = 0.01
+
+# aim for about this many nodes per cell at the finest grid level
+NODES_PER_CELL = 2
+
+MAX_LEVELS = 10
+
+# adaptive steps (with tol): the step shrinks by this factor when the energy
+# rises and grows by its inverse after this many falls in a row
+ADAPTIVE_COOLING = 0.9
+ADAPTIVE_PATIENCE = 5
+
+# spring_batch simulates at most this many (layout, node, node) triples at once
+BATCH_ENTRIES = 2**22
+
+
+def force_layout(
+    edges, num_nodes, pos=None, iterations=100, seed=None, temperature=0.1, tol=None, fixed=None
+):
+    """Lay out a graph with num_nodes nodes and an (E, 2) array of edges.
+    Returns an (N, 2) array of positions.
+
+    pos gives initial positions (a warm start), at any scale; rows that are
+    NaN are placed at random, as is everything when pos is None.
+    temperature is the largest step a node can take in the first iteration,
+    as a fraction of the width of the layout. By default it decreases
+    linearly to zero over the iterations. If tol is given, the step is
+    instead adapted to the progress made (it grows while the energy, the sum
+    of squared forces, keeps falling and shrinks when it rises), and the
+    simulation stops as soon as the energy changes by less than a fraction
+    tol from one iteration to the next, with iterations as an upper bound.
+    fixed is an optional boolean mask of nodes that do not move.
+    """
+    rng = np.random.RandomState(seed)
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    edges = edges[edges[:, 0] != edges[:, 1]]
+
+    start = rng.rand(num_nodes, 2)
+    if pos is not None:
+        pos = np.array(pos, dtype=np.float64).reshape(num_nodes, 2)
+        missing = np.isnan(pos).any(axis=1)
+        if missing.all():
+            pos = start
+        else:
+            # rescale to the unit square and put new nodes anywhere in it
+            lo = pos[~missing].min(axis=0)
+            pos = (pos - lo) / max(np.ptp(pos[~missing], axis=0).max(), MIN_DISTANCE)
+            pos[missing] = start[missing]
+    else:
+        pos = start
+    if num_nodes < 2:
+        return pos
+
+    # optimal distance between nodes
+    k = np.sqrt(1.0 / num_nodes)
+    t = temperature * max(np.ptp(pos, axis=0).max(), MIN_DISTANCE)
+    dt = t / (iterations + 1)
+    energy = None
+    progress = 0
+    moving = None if fixed is None else np.flatnonzero(~np.asarray(fixed, dtype=bool))
+    for _ in range(iterations):
+        if moving is None:
+            disp = repulsion(pos, k) + attraction(pos, edges, k)
+        else:
+            # forces are only needed on the nodes that move
+            disp = np.zeros_like(pos)
+            disp[moving] = repulsion(pos, k, moving) + attraction(pos, edges, k)[moving]
+        length = np.maximum(np.linalg.norm(disp, axis=1), MIN_DISTANCE)
+        pos += disp * (np.minimum(length, t) / length)[:, None]
+        if tol is None:
+            t -= dt
+            continue
+
+        last, energy = energy, float((length**2).sum())
+        if last is None:
+            continue
+        if abs(energy - last) <= tol * last:
+            break
+        if energy < last:
+            progress += 1
+            if progress >= ADAPTIVE_PATIENCE:
+                progress = 0
+                t /= ADAPTIVE_COOLING
+        else:
+            progress = 0
+            t *= ADAPTIVE_COOLING
+    return pos
+
+
+def attraction(pos, edges, k):
+    """Spring force d^2 / k pulling the ends of each edge together."""
+    n = len(pos)
+    dx = pos[edges[:, 0], 0] - pos[edges[:, 1], 0]
+    dy = pos[edges[:, 0], 1] - pos[edges[:, 1], 1]
+    scale = np.maximum(np.hypot(dx, dy), MIN_DISTANCE) / k
+    disp = np.zeros_like(pos)
+    for axis, delta in enumerate((dx * scale, dy * scale)):
+        disp[:, axis] = np.bincount(edges[:, 1], delta, minlength=n) - np.bincount(
+            edges[:, 0], delta, minlength=n
+        )
+    return disp
+
+
+def _push(dx, dy, mass, k):
+    """Repulsive force k^2 / d on the first of two points (dx, dy) apart,
+    from a point of the given mass.
+    """
+    scale = mass * k * k / np.maximum(dx * dx + dy * dy, MIN_DISTANCE**2)
+    return dx * scale, dy * scale
+
+
+def repulsion(pos, k, nodes=None):
+    """Approximate repulsive force k^2 / d from all other nodes, on each node
+    or on the given array of nodes.
+    """
+    n = len(pos)
+    if nodes is None:
+        nodes = np.arange(n)
+    levels = int(np.clip(np.ceil(np.log(n / NODES_PER_CELL) / np.log(4)), 2, MAX_LEVELS))
+
+    # integer coordinates on the finest grid
+    lo = pos.min(axis=0)
+    width = max(np.ptp(pos, axis=0).max(), MIN_DISTANCE) * (1 + 1e-9)
+    size = 2**levels
+    cell = np.minimum(((pos - lo) / width * size).astype(np.int64), size - 1)
+
+    x, y = pos[:, 0].copy(), pos[:, 1].copy()
+    cx, cy = cell[:, 0].copy(), cell[:, 1].copy()
+    fx, fy = _near_field(x, y, cx, cy, size, k, nodes)
+    for level in range(2, levels + 1):
+        shift = levels - level
+        gx, gy = _far_field(x, y, cx >> shift, cy >> shift, 2**level, k, nodes)
+        fx += gx
+        fy += gy
+    return np.stack([fx, fy], axis=1)
+
+
+def _far_field(x, y, cx, cy, size, k, nodes):
+    """Force on nodes from the cells (of a size x size grid) that are
+    adjacent to the parent of each node's cell but not to the cell itself.
+    """
+    flat = cx * size + cy
+    mass = np.bincount(flat, minlength=size * size)
+    centre_x = np.bincount(flat, x, minlength=size * size) / np.maximum(mass, 1)
+    centre_y = np.bincount(flat, y, minlength=size * size) / np.maximum(mass, 1)
+    x, y, cx, cy = x[nodes], y[nodes], cx[nodes], cy[nodes]
+
+    # the children of the parent's neighbours span offsets -2..3 (even cells)
+    # or -3..2 (odd cells) from the node's own cell
+    fx = np.zeros_like(x)
+    fy = np.zeros_like(y)
+    base_x = -2 - (cx & 1)
+    base_y = -2 - (cy & 1)
+    for ox in range(6):
+        dx = base_x + ox
+        other_x = cx + dx
+        for oy in range(6):
+            dy = base_y + oy
+            other_y = cy + dy
+            valid = ((np.abs(dx) > 1) | (np.abs(dy) > 1)) & (other_x >= 0) & (other_x < size)
+            valid &= (other_y >= 0) & (other_y < size)
+            other = np.where(valid, other_x * size + other_y, 0)
+            weight = np.where(valid, mass[other], 0)
+            px, py = _push(x - centre_x[other], y - centre_y[other], weight, k)
+            fx += px
+            fy += py
+    return fx, fy
+
+
+def _near_field(x, y, cx, cy, size, k, nodes):
+    """Exact force on nodes from the nodes in the same or an adjacent cell."""
+    m = len(nodes)
+    flat = cx * size + cy
+    order = np.argsort(flat, kind="stable")
+    counts = np.bincount(flat, minlength=size * size)
+    first = np.cumsum(counts) - counts
+
+    fx = np.zeros(m)
+    fy = np.zeros(m)
+    targets = np.arange(m)
+    for dx in (-1, 0, 1):
+        other_x = cx[nodes] + dx
+        for dy in (-1, 0, 1):
+            other_y = cy[nodes] + dy
+            valid = (other_x >= 0) & (other_x < size) & (other_y >= 0) & (other_y < size)
+            other = np.where(valid, other_x * size + other_y, 0)
+            num = np.where(valid, counts[other], 0)
+
+            # all (target, node in the other cell) pairs
+            t = np.repeat(targets, num)
+            offset = np.arange(len(t)) - np.repeat(np.cumsum(num) - num, num)
+            j = order[np.repeat(first[other], num) + offset]
+            i = nodes[t]
+            keep = i != j
+            t, i, j = t[keep], i[keep], j[keep]
+            px, py = _push(x[i] - x[j], y[i] - y[j], 1, k)
+            fx += np.bincount(t, px, minlength=m)
+            fy += np.bincount(t, py, minlength=m)
+    return fx, fy
+
+
+def batch_size(num_nodes, max_entries=BATCH_ENTRIES):
+    """Number of layouts of a graph that spring_batch simulates at once."""
+    return max(1, max_entries // max(num_nodes * num_nodes, 1))
+
+
+def spring_batch(edges, num_nodes, seeds, iterations=50, threshold=1e-4):
+    """Run the Fruchterman-Reingold simulation of nx.spring_layout (the dense
+    version, used below 500 nodes) from the random start of each seed, all as
+    one (K, N, 2) array. The graph is given by an (E, 2) array of edges.
+
+    Returns a (K, N, 2) array of layouts, centred and scaled to fit in
+    [-1, 1] like nx.rescale_layout. Each layout starts where
+    nx.spring_layout(G, seed=seed) would and follows the same dynamics, but
+    is not identical to it, since the rounding differs and the simulation
+    is chaotic. Layouts that have converged stop moving while the others
+    carry on.
+    """
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    n = num_nodes
+    pos = np.stack([np.random.RandomState(seed).rand(n, 2) for seed in seeds])
+    k = np.sqrt(1.0 / n)
+
+    # each layout has its own temperature, as in nx
+    t = 0.1 * np.ptp(pos, axis=1).max(axis=1)
+    dt = t / (iterations + 1)
+    active = np.arange(len(pos))
+    for _ in range(iterations):
+        if not len(active):
+            break
+        p = pos[active]
+        x, y = p[:, :, 0], p[:, :, 1]
+
+        # repulsion k^2 / d between all pairs
+        dx = x[:, :, None] - x[:, None, :]
+        dy = y[:, :, None] - y[:, None, :]
+        push = dx * dx
+        push += dy * dy
+        np.maximum(push, 0.01**2, out=push)
+        np.divide(k * k, push, out=push)
+        disp_x = np.einsum("kij,kij->ki", dx, push)
+        disp_y = np.einsum("kij,kij->ki", dy, push)
+
+        # attraction d^2 / k along the edges
+        ex = x[:, edges[:, 0]] - x[:, edges[:, 1]]
+        ey = y[:, edges[:, 0]] - y[:, edges[:, 1]]
+        pull = np.maximum(np.sqrt(ex * ex + ey * ey), 0.01) / k
+        ex *= pull
+        ey *= pull
+        # scatter onto the nodes of every layout with one bincount
+        rows = np.arange(len(p))[:, None] * n
+        ends = [(rows + edges[:, 1]).ravel(), (rows + edges[:, 0]).ravel()]
+        for disp, e in ((disp_x, ex.ravel()), (disp_y, ey.ravel())):
+            disp += (
+                np.bincount(ends[0], e, minlength=len(p) * n)
+                - np.bincount(ends[1], e, minlength=len(p) * n)
+            ).reshape(len(p), n)
+
+        length = np.maximum(np.sqrt(disp_x * disp_x + disp_y * disp_y), 0.01)
+        step = t[active, None] / length
+        delta_pos = np.stack([disp_x * step, disp_y * step], axis=2)
+        pos[active] = p + delta_pos
+        t -= dt
+        moving = np.sqrt((delta_pos**2).sum(axis=(1, 2))) / n >= threshold
+        active = active[moving]
+
+    # rescale like nx.rescale_layout
+    pos -= pos.mean(axis=1, keepdims=True)
+    lim = np.abs(pos).max(axis=(1, 2), keepdims=True)
+    return pos / np.where(lim > 0, lim, 1)
+
+
+def batch_layouts(edges, num_nodes, count, seed=None, iterations=50, threshold=1e-4):
+    """Fruchterman-Reingold layouts of count different graphs with num_nodes
+    nodes each, simulated densely as one (K, N, 2) array, as spring_batch
+    does for the seeds of one graph. For many small graphs (such as the
+    components of a forest), where the fixed cost of each iteration of
+    force_layout dominates. edges is an (E, 3) array of (graph, i, j).
+
+    Returns a (K, N, 2) array of layouts, centred and scaled to fit in
+    [-1, 1].
+    """
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 3)
+    edges = edges[edges[:, 1] != edges[:, 2]]
+    n = num_nodes
+    pos = np.random.RandomState(seed).rand(count, n, 2)
+    k = np.sqrt(1.0 / n)
+    graph, u, v = edges.T
+    ends = [graph * n + v, graph * n + u]
+
+    t = 0.1 * np.ptp(pos, axis=1).max(axis=1)
+    dt = t / (iterations + 1)
+    for _ in range(iterations):
+        x, y = pos[:, :, 0], pos[:, :, 1]
+
+        # repulsion k^2 / d between all pairs of the same graph
+        dx = x[:, :, None] - x[:, None, :]
+        dy = y[:, :, None] - y[:, None, :]
+        push = np.maximum(dx * dx + dy * dy, MIN_DISTANCE**2)
+        np.divide(k * k, push, out=push)
+        disp_x = np.einsum("kij,kij->ki", dx, push)
+        disp_y = np.einsum("kij,kij->ki", dy, push)
+
+        # attraction d^2 / k along the edges
+        ex = x[graph, u] - x[graph, v]
+        ey = y[graph, u] - y[graph, v]
+        pull = np.maximum(np.sqrt(ex * ex + ey * ey), MIN_DISTANCE) / k
+        for disp, e in ((disp_x, ex * pull), (disp_y, ey * pull)):
+            disp += (
+                np.bincount(ends[0], e, minlength=count * n) - np.bincount(ends[1], e, minlength=count * n)
+            ).reshape(count, n)
+
+        length = np.maximum(np.sqrt(disp_x * disp_x + disp_y * disp_y), MIN_DISTANCE)
+        step = t[:, None] / length
+        delta_pos = np.stack([disp_x * step, disp_y * step], axis=2)
+        pos += delta_pos
+        t -= dt
+        if (np.sqrt((delta_pos**2).sum(axis=(1, 2))) / n < threshold).all():
+            break
+
+    pos -= pos.mean(axis=1, keepdims=True)
+    lim = np.abs(pos).max(axis=(1, 2), keepdims=True)
+    return pos / np.where(lim > 0, lim, 1)
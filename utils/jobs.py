@@ -0,0 +1,120 @@
+""" In-process job queue for long running renders.
+
+A job runs a function on a thread pool and records a list of progress events
+(layout trials, compile stage, ...) that clients can poll or stream while it
+runs, and the result once it is done.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Job:
+    """A submitted job: its status, progress events and result."""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = "queued"
+        self.events = []
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self._cond = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    def emit(self, event, **data):
+        """Record a progress event and wake up anyone streaming the events."""
+        with self._cond:
+            self.events.append(dict(event=event, time=time.time() - self.created, **data))
+            self._cond.notify_all()
+
+    def _finish(self, status, result=None, error=None):
+        with self._cond:
+            self.status = status
+            self.result = result
+            self.error = error
+            self.events.append(
+                dict(event=status, time=time.time() - self.created, error=error)
+            )
+            self._cond.notify_all()
+
+    def iter_events(self, timeout=None):
+        """Yield the job's events as they happen, until it finishes. If no new
+        event arrives within timeout seconds, yield None (a keep-alive).
+        """
+        idx = 0
+        while True:
+            with self._cond:
+                if idx == len(self.events) and not self.finished:
+                    self._cond.wait(timeout)
+                new = self.events[idx:]
+                finished = self.finished
+            idx += len(new)
+            if not new and not finished:
+                yield None
+            for event in new:
+                yield event
+            if finished and idx == len(self.events):
+                return
+
+    def summary(self):
+        """Status of the job, with the latest value of each progress field."""
+        with self._cond:
+            rdict = {"id": self.id, "status": self.status}
+            for event in self.events:
+                rdict.update({k: v for k, v in event.items() if k not in ("event", "time")})
+            rdict["error"] = self.error
+            rdict["elapsed"] = time.time() - self.created
+            return rdict
+
+
+class JobManager:
+    """Runs jobs on a local thread pool and keeps the last max_jobs of them."""
+
+    def __init__(self, workers=2, max_jobs=1000):
+        self.max_jobs = max_jobs
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        """Run fn(job, *args, **kwargs) in the background. Its return value
+        becomes the job result.
+        """
+        job = Job()
+        with self._lock:
+            self._jobs[job.id] = job
+            self._evict()
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def in_flight(self):
+        with self._lock:
+            return sum(not job.finished for job in self._jobs.values())
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = "running"
+        job.emit("stage", stage="start")
+        try:
+            result = fn(job, *args, **kwargs)
+        except Exception as e:
+            job._finish("failed", error=str(getattr(e, "description", e)))
+        else:
+            job._finish("done", result=result)
+
+    def _evict(self):
+        """Forget the oldest finished jobs once there are too many."""
+        for job_id in list(self._jobs):
+            if len(self._jobs) <= self.max_jobs:
+                break
+            if self._jobs[job_id].finished:
+                del self._jobs[job_id]
@@ -1,6 +1,19 @@
 import numpy as np
-import networkx as nx
+import copy
+import hashlib
+import logging
 import math
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from utils.adjacency import as_adjacency, connected_components, edge_arrays, loop_nodes, split_components, to_graph
+from utils.crossings import count_crossings, count_crossings_batch, layout_arrays
+from utils.families import family_layout
+from utils.forces import batch_layouts, batch_size, force_layout, spring_batch
+from utils.multilevel import COARSE_ITERATIONS, multilevel_layout
+from utils.packing import pack_components
+
+log = logging.getLogger(__name__)
 
 def rotation_matrix(angle):
     """ Rotation matrix in 2d.
@@ -9,34 +22,154 @@ def rotation_matrix(angle):
     sin = math.sin(angle)
     return np.array([[cos, -sin], [sin, cos]])
    
+def direction_angles(vectors):
+    """ Angles in degrees, in [0, 360), of an (M, 2) array of vectors,
+    counterclockwise from the x axis.
+    """
+    vectors = np.asarray(vectors, dtype=np.float64).reshape(-1, 2)
+    return np.degrees(np.arctan2(vectors[:, 1], vectors[:, 0])) % 360
+
+
+def largest_gap_angles(loops, pos, rows, cols):
+    """ Angles in degrees at which to draw the self-loops of the nodes loops:
+    the middle of the largest angular gap between the node's edges (so away
+    from the edge for a node with one neighbour), or 90 for a node without
+    other neighbours. rows and cols are the edges of the graph and pos the
+    (N, 2) node positions. All loops are placed at once, in O(N + E).
+    """
+    n = len(pos)
+    is_loop = np.zeros(n, dtype=bool)
+    is_loop[loops] = True
+
+    # neighbours of the loop nodes in either direction, sorted by node and
+    # then by angle, so that each node's neighbours are a contiguous run
+    src = np.concatenate([rows, cols]).astype(np.int64)
+    dst = np.concatenate([cols, rows]).astype(np.int64)
+    keep = is_loop[src] & (src != dst)
+    pairs = np.unique(src[keep] * n + dst[keep])
+    src, dst = pairs // n, pairs % n
+    vec = pos[dst] - pos[src]
+    angle = np.arctan2(vec[:, 1], vec[:, 0])
+    order = np.lexsort((angle, src))
+    src, angle = src[order], angle[order]
+    indptr = np.searchsorted(src, np.arange(n + 1))
+
+    # gap from each neighbour to the next one counterclockwise
+    idx = np.arange(len(src))
+    last = idx == indptr[src + 1] - 1
+    following = np.where(last, indptr[src], idx + 1)
+    gap = angle[following] - angle
+    gap[last] += 2 * math.pi
+
+    # the first largest gap of each node
+    best = np.lexsort((-gap, src))
+    best = best[np.diff(src[best], prepend=-1) != 0]
+    angles = np.full(n, 90.0)
+    angles[src[best]] = np.degrees(angle[best] + gap[best] / 2) % 360
+    return angles[loops]
+
+
+# with components=None, graphs with at least this many nodes are split into
+# their connected components (if they have more than one)
+COMPONENTS_MIN_NODES = 100
+
+# components with at least this many nodes are laid out on the process pool
+# (when there are workers), and those with fewer are laid out all at once by
+# the layouts that can (see Layout._batch_components)
+COMPONENT_POOL_MIN_NODES = 50
+
+
 class Layout:
-    """Base class for any layout object."""
+    """Base class for any layout object.
+
+    With components (True, or None for graphs of at least
+    COMPONENTS_MIN_NODES nodes) a disconnected graph is split into its
+    connected components, which are laid out on their own (and cached on
+    their own), scaled to a common edge length and then packed into shelves
+    (see utils.packing). Edges of different components can never cross, so
+    the min-crossing search only looks at crossings within a component, and
+    iterations are not spent pushing components apart.
+    """
 
-    def __init__(self, align_angle=0, seed=None, scale=1, loops_are_nodes=False):
+    def __init__(
+        self, align_angle=0, seed=None, scale=1, loops_are_nodes=False, cache=None, progress=None, components=None
+    ):
         self.align_angle = 2*math.pi*((align_angle-45)/360)
         self.seed = seed
         self.scale = scale
         self.loops_are_nodes = loops_are_nodes
+        self.cache = cache
+        self.progress = progress
+        self.components = components
+
+    def _report(self, event, **data):
+        """ Send a progress event to the progress callback, if there is one.
+        """
+        if self.progress is not None:
+            self.progress(event, **data)
+
+    def _cache_params(self):
+        """ The parameters that affect the geometry of the layout. Child
+        classes with extra geometry parameters should extend this.
+        """
+        return {
+            "method": type(self).__name__,
+            "align_angle": self.align_angle,
+            "seed": self.seed,
+            "scale": self.scale,
+            "loops_are_nodes": self.loops_are_nodes,
+            "components": self.components,
+        }
 
     def _get_layout(self, graph, num_nodes):
         """ The desired layout method. To be implemented by the child class.
         """
         raise NotImplementedError
 
+    def _normalize(self, layout, num_nodes):
+        """ Translate a layout to the centroid of its (non-self-loop) nodes
+        and scale it to fit in the unit circle.
+        """
+        centroid = sum([v for k, v in layout.items() if k < num_nodes]) / num_nodes
+        layout = {k: v - centroid for k, v in layout.items()}
+
+        sc = max([np.linalg.norm(v) for k, v in layout.items() if k < num_nodes])
+        layout = {k: v / sc for k, v in layout.items()}
+        return layout
+
     def get_layout(self, adj_mat):
         """Return the layout dictionary, which maps node number to
         position in the xy plane or a self loop to a xy position.
+        If a LayoutCache is set, the layout is looked up there first.
+        """
+        if self.cache is None:
+            return self._compute_layout(adj_mat)
+        key = self.cache.key(adj_mat, self._cache_params())
+        return self.cache.get_or_compute(key, lambda: self._compute_layout(adj_mat))
+
+    def _graph(self, adj_mat):
+        """ The networkx graph to lay out.
         """
-        H = nx.from_numpy_array(adj_mat)
+        H = to_graph(adj_mat)
 
         # if treating loops as nodes, add a node for each one.
         if self.loops_are_nodes:
-            for idx in np.nonzero(np.diag(adj_mat))[0]:
+            for idx in loop_nodes(adj_mat):
                 H.remove_edge(idx, idx)
                 H.add_edge(idx, len(adj_mat) + idx)
+        return H
 
-        # call base layout method
-        layout = self._get_layout(H, len(adj_mat))
+    def _compute_layout(self, adj_mat):
+        """ Compute the layout dictionary (see get_layout).
+        """
+        adj_mat = as_adjacency(adj_mat)
+        components = self._split(adj_mat)
+        if components is not None:
+            layout = self._packed_layout(adj_mat, components)
+        else:
+            # call base layout method
+            H = self._graph(adj_mat)
+            layout = self._get_layout(H, len(adj_mat))
 
         # rotate to principal axes (this rotates to 45deg)
         rot = self.pca_rotation(list(layout.values()))
@@ -45,86 +178,180 @@ class Layout:
         rot_align = rotation_matrix(self.align_angle) 
         trans = np.matmul(rot_align, rot)
         layout = {k: trans @ v for k, v in layout.items()}
+        return self._finish_layout(layout, adj_mat)
 
-        # if not treating loops as nodes, get their optimal angle
-        # based on the node layout.
-        if not self.loops_are_nodes:
-            for idx in np.nonzero(np.diag(adj_mat))[0]:
-                layout[len(adj_mat)+idx] = self._get_loop_pos(idx,layout,H)
-
-        # convert loop layout positions to relative angles
-        for k in layout.keys():
-            if k>= len(adj_mat):
-                layout[k] = self._compute_loop_angle(layout[k-len(adj_mat)],layout[k])
-
-        rdict = {
-            "nodes": {k: v for k, v in layout.items() if k < len(adj_mat)},
-            "loops": {k-len(adj_mat): v for k, v in layout.items() if k >= len(adj_mat)},
-        }
-        return rdict
-
-    def _get_loop_pos(self, idx, layout, H):
-        """ Get optimal loop position for a self loop, given a layout.
+    def _split(self, adj_mat):
+        """ The component of each node, if the graph is to be laid out by
+        components (see Layout), otherwise None.
         """
-
-        # sort adjacent nodes by position around the circle (starting from angle 0)
-        sort_fn = lambda v: (v[1] < 0, np.arccos(np.dot(v / np.linalg.norm(v), [1, 0])))
-        adjacent_vecs = sorted(
-            [layout[id_] - layout[idx] for id_ in H.neighbors(idx) if id_ != idx],
-            key=sort_fn,
-        )
-
-        # special case when there is only one incident edge
-        if len(adjacent_vecs) == 1:
-            return -adjacent_vecs[0] + layout[idx]
-
-        # easy case when there are two incident edges
-        if len(adjacent_vecs) == 2:
-            sum_ = adjacent_vecs[0] + adjacent_vecs[1]
-            return -sum_ / 2 + layout[idx]
-
-        # TODO: this could be bad if all edges are symetrically laid out
-        if len(adjacent_vecs):
-            pos = -sum(adjacent_vecs)/len(adjacent_vecs)
-        else:
-            pos = np.array([0,1])
+        if self.components is False:
+            return None
+        if self.components is None and len(adj_mat) < COMPONENTS_MIN_NODES:
+            return None
+        components = connected_components(adj_mat)
+        if len(components) == 0 or components.max() == 0:
+            return None
+        return components
+
+    def _for_component(self, time_left=None):
+        """ A copy of this layout for laying out one component (uncached, as
+        the components are cached here). time_left is what is left of the
+        time budget of the whole graph, if any.
         """
-        # get angles between adjacent nodes
-        angles = [np.arctan2(v[1], v[0]) for v in adjacent_vecs]
-        for i in range(len(angles)):
-            d = angles[i]
-            if d < 0:
-                angles[i] += 2 * math.pi
-            if d > 2 * math.pi:
-                angles[i] -= 2 * math.pi
-        angle_diffs = [a - b for a, b in zip([angles[-1]] + angles[:-1], angles)]
-
-        # get the biggest angle gap and rotate the starting vector
-        # by half that to get the position.
-        max_idx = np.argmax(angle_diffs)
-        rot = rotation_matrix(angle_diffs[max_idx]/2)
-        pos = rot @ adjacent_vecs[max_idx]
+        tool = copy.copy(self)
+        tool.components = False
+        tool.cache = None
+        return tool
+
+    def _batch_components(self, subs):
+        """ Unrotated layouts of many small components (adjacency matrices)
+        at once, as a list, or None if this layout does them one by one.
         """
+        return None
 
-        return pos + layout[idx]
+    def _component_key(self, adj_mat):
+        return self.cache.key(adj_mat, dict(self._cache_params(), component=True))
 
-    def _compute_loop_angle(self, node_pos, loop_pos):
-        """ Compute angle at which a loop is positioned relative to its node.
+    def _packed_layout(self, adj_mat, components):
+        """ Layout of a disconnected graph from the layouts of its connected
+        components (see Layout). Components with the same (renumbered)
+        adjacency matrix, such as repeated motifs, are laid out once.
         """
-        angle_between = lambda v1, v2: np.arccos(
-            np.dot(v1 / np.linalg.norm(v1), v2 / np.linalg.norm(v2))
-        )
-        angle_from_e1 = lambda v1: angle_between(v1, np.array([1, 0]))
+        n = len(adj_mat)
+        parts = split_components(adj_mat, components)
+        keys = [(len(nodes), sub.rows.tobytes(), sub.cols.tobytes()) for nodes, sub in parts]
+        start = time.monotonic()
+        budget = getattr(self, "time_budget", None)
+
+        def time_left():
+            return None if budget is None else max(budget - (time.monotonic() - start), 0)
+
+        # distinct components, largest first so that they get the time
+        # budget, and those not in the cache
+        distinct = dict(sorted(zip(keys, (sub for _, sub in parts)), key=lambda item: -item[0][0]))
+        raw, todo = {}, []
+        for key, sub in distinct.items():
+            cached = None if self.cache is None else self.cache.get(self._component_key(sub))
+            if cached is None:
+                todo.append(key)
+            else:
+                raw[key] = cached["nodes"]
+
+        # the small components together, if the layout can
+        small = [key for key in todo if key[0] < COMPONENT_POOL_MIN_NODES]
+        if len(small) > 1:
+            layouts = self._batch_components([distinct[key] for key in small])
+            if layouts is not None:
+                raw.update(zip(small, layouts))
+
+        # the large components at once on the pool, each searched serially
+        large = [key for key in todo if key[0] >= COMPONENT_POOL_MIN_NODES]
+        workers = getattr(self, "workers", 1)
+        if workers > 1 and len(large) > 1:
+            tool = self._for_component(time_left())
+            tool.workers = 1
+            tool.progress = None
+            pool = get_process_pool(workers)
+            futures = {key: pool.submit(_component_layout, tool, distinct[key]) for key in large}
+            raw.update((key, future.result()) for key, future in futures.items())
+        for key in todo:
+            if key not in raw:
+                raw[key] = _component_layout(self._for_component(time_left()), distinct[key])
+            if self.cache is not None:
+                self.cache.put(self._component_key(distinct[key]), {"nodes": raw[key], "loops": {}})
+
+        # each component upright and scaled to unit edge length, then packed
+        shaped = {key: _shape_component(raw[key], distinct[key]) for key in distinct}
+        packed = pack_components([shaped[key][1] for key in keys])
+
+        layout = {}
+        for (nodes, _), key, pos in zip(parts, keys, packed):
+            # loop node len(nodes) + i of a component is loop node n + nodes[i]
+            local = shaped[key][0]
+            is_node = local < len(nodes)
+            glob = np.where(
+                is_node, nodes[np.where(is_node, local, 0)], n + nodes[np.where(is_node, 0, local - len(nodes))]
+            )
+            layout.update(zip(glob.tolist(), pos))
+        return self._normalize(layout, n)
+
+    def _finish_layout(self, layout, adj_mat):
+        """ Place the self-loops and split the positions into the layout
+        dictionary (see get_layout).
+        """
+        n = len(adj_mat)
+        pos = np.zeros((n, 2))
+        keys = [k for k in layout if k < n]
+        pos[keys] = [layout[k] for k in keys]
+        loops = loop_nodes(adj_mat)
 
-        rel_pos = loop_pos - node_pos
-        if rel_pos[1] < 0:
-            angle = 2 * math.pi - angle_from_e1(rel_pos)
+        if self.loops_are_nodes:
+            # loops point at their loop node
+            ends = np.array([layout[n + idx] for idx in loops.tolist()]).reshape(-1, 2)
+            angles = direction_angles(ends - pos[loops])
         else:
-            angle = angle_from_e1(rel_pos)
+            # otherwise at the largest gap between the node's edges
+            angles = largest_gap_angles(loops, pos, *edge_arrays(adj_mat))
 
-        angle = 360 * (angle / (2 * math.pi))
-        return angle
+        rdict = {
+            "nodes": {k: v for k, v in layout.items() if k < n},
+            "loops": dict(zip(loops.tolist(), angles.tolist())),
+        }
+        return rdict
 
+    def relayout(self, adj_mat, previous):
+        """ Update a previous layout dictionary for an edited graph. Nodes
+        keep their previous positions, except new nodes and (if previous
+        has an "edges" entry, see dump_layout) the ends of edges added or
+        removed between existing nodes. New nodes are placed near their
+        neighbours, then the moving nodes are refined for a few iterations
+        while the rest stay fixed. The layout is not rotated
+        again, so the picture stays where it was.
+        """
+        adj_mat = as_adjacency(adj_mat)
+        H = self._graph(adj_mat)
+        nodes, edges = _edge_index(H)
+        known = {k: v for k, v in previous["nodes"].items() if k < len(adj_mat)}
+        if not known:
+            return self.get_layout(adj_mat)
+
+        pos = np.full((len(nodes), 2), np.nan)
+        index = {node: i for i, node in enumerate(nodes.tolist())}
+        for node, xy in known.items():
+            pos[index[node]] = xy
+        free = np.isnan(pos[:, 0])
+
+        # the ends of edges added or removed between old nodes also move (a
+        # self-loop added or removed does not move its node)
+        if previous.get("edges") is not None:
+            old = np.array(previous["edges"], dtype=np.int64).reshape(-1, 2)
+            old = set(map(tuple, np.sort(old[old[:, 0] != old[:, 1]], axis=1).tolist()))
+            new = nodes[edges]
+            new = set(map(tuple, np.sort(new[new[:, 0] != new[:, 1]], axis=1).tolist()))
+            for edge in old ^ new:
+                if all(node in known for node in edge):
+                    for node in edge:
+                        free[index[node]] = True
+
+        if free.any():
+            # work in the unit square, where the ideal edge length is known
+            placed = _place_near_neighbors(pos, edges, np.random.RandomState(self.seed))
+            lo = placed.min(axis=0)
+            width = max(np.ptp(placed, axis=0).max(), 1e-12)
+            refined = force_layout(
+                edges,
+                len(nodes),
+                pos=(placed - lo) / width,
+                iterations=RELAYOUT_ITERATIONS,
+                seed=self.seed,
+                temperature=RELAYOUT_TEMPERATURE * math.sqrt(1.0 / len(nodes)),
+                tol=1e-3,
+                fixed=~free,
+            )
+            pos[free] = refined[free] * width + lo
+
+        layout = dict(zip(nodes.tolist(), pos))
+        return self._finish_layout(layout, adj_mat)
 
     def pca_rotation(self,points):
         """ Get the rotation matrix that aligns a set of points according
@@ -139,78 +366,600 @@ class Layout:
         return rot_mat
 
 
+def _component_layout(tool, adj_mat):
+    """ Unrotated layout (see Layout._get_layout) of one connected component.
+    Module level so that it can be sent to a process pool.
+    """
+    if len(adj_mat) == 1:
+        # a lone node, and its loop node (if any) above it
+        H = tool._graph(adj_mat)
+        return {node: np.array([0.0, float(node)]) for node in H}
+    return tool._get_layout(tool._graph(adj_mat), len(adj_mat))
+
+
+def _force_batch(tool, subs, iterations):
+    """ Force-directed layouts of the small components subs, simulated
+    together in batches of components with the same number of nodes (see
+    utils.forces.batch_layouts).
+    """
+    graphs = [_edge_index(tool._graph(sub)) for sub in subs]
+    by_size = {}
+    for idx, (nodes, _) in enumerate(graphs):
+        by_size.setdefault(len(nodes), []).append(idx)
+
+    seed = 1 if tool.seed is None else tool.seed
+    layouts = [None] * len(subs)
+    for size, members in by_size.items():
+        step = batch_size(size)
+        for first in range(0, len(members), step):
+            part = members[first : first + step]
+            edges = np.concatenate(
+                [np.column_stack([np.full(len(graphs[idx][1]), j), graphs[idx][1]]) for j, idx in enumerate(part)]
+            ).reshape(-1, 3)
+            pos = batch_layouts(edges, size, len(part), seed=seed, iterations=iterations)
+            for j, idx in enumerate(part):
+                layouts[idx] = dict(zip(graphs[idx][0].tolist(), pos[j]))
+    return layouts
+
+
+def _shape_component(layout, adj_mat):
+    """ The nodes (including any loop nodes) of a component layout and their
+    positions, centred, turned so the principal axis is horizontal and
+    scaled so the median edge is of length 1.
+    """
+    n = len(adj_mat)
+    nodes = np.array(sorted(layout), dtype=np.int64)
+    pos = np.array([layout[k] for k in nodes.tolist()], dtype=np.float64).reshape(-1, 2)
+    real = nodes < n
+    pos = pos - pos[real].mean(axis=0)
+    if real.sum() > 1:
+        ev, eigv = np.linalg.eigh(np.cov(pos[real].T))
+        x, y = eigv[:, np.argmax(ev)]
+        pos = pos @ np.array([[x, -y], [y, x]])
+
+    rows, cols = edge_arrays(adj_mat)
+    keep = rows != cols
+    if keep.any():
+        index = np.searchsorted(nodes, np.stack([rows[keep], cols[keep]]))
+        length = np.median(np.linalg.norm(pos[index[0]] - pos[index[1]], axis=1))
+        if length > 1e-12:
+            pos = pos / length
+    return nodes, pos
+
+
+# iteration cap and largest first step (in ideal edge lengths) of the
+# refinement in Layout.relayout
+RELAYOUT_ITERATIONS = 30
+RELAYOUT_TEMPERATURE = 2
+
+
+def _place_near_neighbors(pos, edges, rng):
+    """ Fill in the NaN rows of pos: each missing node goes next to the mean
+    position of its placed neighbours, working outwards from the placed
+    nodes. Nodes with no path to a placed node go at random in the layout.
+    """
+    pos = pos.copy()
+    missing = np.isnan(pos[:, 0])
+    lo, hi = np.nanmin(pos, axis=0), np.nanmax(pos, axis=0)
+    # offset new nodes by a fraction of the typical spacing
+    spacing = max(np.ptp(pos[~missing], axis=0).max(), 1.0) / math.sqrt(len(pos))
+    both = np.concatenate([edges, edges[:, ::-1]])
+    while missing.any():
+        reach = both[~missing[both[:, 1]] & missing[both[:, 0]]]
+        if not len(reach):
+            pos[missing] = lo + rng.rand(missing.sum(), 2) * np.maximum(hi - lo, spacing)
+            break
+        count = np.bincount(reach[:, 0], minlength=len(pos))
+        sums = [np.bincount(reach[:, 0], pos[reach[:, 1], axis], minlength=len(pos)) for axis in range(2)]
+        new = np.flatnonzero(count)
+        pos[new] = np.stack(sums, axis=1)[new] / count[new, None]
+        pos[new] += (rng.rand(len(new), 2) - 0.5) * spacing
+        missing[new] = False
+    return pos
+
+
+# graphs with fewer nodes than this are searched with batched trials by
+# default (nx.spring_layout also switches algorithm here)
+BATCH_MAX_NODES = 500
+
+
+def _spring_trial(H, seed, iterations=200):
+    """ One trial of the min-crossing search. Module level so that it can be
+    sent to a process pool.
+    """
+    import networkx as nx
+
+    layout = nx.spring_layout(H, center=[0, 0], seed=seed, iterations=iterations)
+    edges, pos = layout_arrays(H, layout)
+    return layout, count_crossings(edges, pos)
+
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_process_pool(workers):
+    """ Shared process pool with the given number of workers. Pools are kept
+    alive between requests so that the fork cost is only paid once.
+    """
+    with _POOLS_LOCK:
+        if workers not in _POOLS:
+            _POOLS[workers] = ProcessPoolExecutor(max_workers=workers)
+        return _POOLS[workers]
+
+
+def crossing_lower_bound(H):
+    """ A cheap lower bound on the number of edge crossings of any straight
+    line layout of the graph: 0 if it is planar, otherwise the number of
+    edges beyond the 3N - 6 that a planar graph can have (each crossing can
+    be removed by deleting one edge), and at least 1.
+    """
+    import networkx as nx
+
+    G = nx.Graph(H)
+    G.remove_edges_from(nx.selfloop_edges(G))
+    n, m = G.number_of_nodes(), G.number_of_edges()
+    if n < 5 or (m <= 3 * n - 6 and nx.check_planarity(G)[0]):
+        return 0
+    return max(m - (3 * n - 6), 1)
+
+
+class SearchController:
+    """ Decides when the min-crossing search can stop. Trials are recorded
+    as they finish; the search is done when one reaches lower_bound
+    ("optimal"), when the time budget (in seconds) runs out ("time"), or
+    when patience trials in a row have not improved on the best ("plateau").
+    """
+
+    def __init__(self, time_budget=None, patience=None, lower_bound=0):
+        self.time_budget = time_budget
+        self.patience = patience
+        self.lower_bound = lower_bound
+        self.start = time.monotonic()
+        self.trials = 0
+        self.best = None
+        self.since_best = 0
+        self.reason = None
+
+    def record(self, crossings):
+        """ Record the crossing counts of finished trials, in seed order.
+        """
+        for c in crossings:
+            self.trials += 1
+            if self.best is None or c < self.best:
+                self.best = c
+                self.since_best = 0
+            else:
+                self.since_best += 1
+
+    def time_left(self):
+        if self.time_budget is None:
+            return None
+        return max(0, self.start + self.time_budget - time.monotonic())
+
+    def trials_left(self, cost):
+        """ Number of trials of cost seconds each that fit in the time left
+        (None without a time budget). When not even one does, the search is
+        done ("time"), so that it never overshoots its budget by a batch.
+        """
+        if self.time_budget is None:
+            return None
+        count = int(self.time_left() / max(cost, 1e-9))
+        if count < 1:
+            self.reason = "time"
+        return count
+
+    def done(self):
+        if self.best is not None and self.best <= self.lower_bound:
+            self.reason = "optimal"
+        elif self.time_budget is not None and self.time_left() == 0:
+            self.reason = "time"
+        elif self.patience is not None and self.since_best >= self.patience:
+            self.reason = "plateau"
+        return self.reason is not None
+
+
 class SpringLayout(Layout):
     """Spring layout method. This models the nodes as point charges and
     the edges as springs and runs a physics simulator.
+
+    When no seed is given, several seeds are tried and the layout with the
+    fewest edge crossings is kept. The trials can be spread over a process
+    pool (workers > 1) and bounded by a wall-clock budget in seconds. The
+    trial seeds are drawn from base_seed, so a given base_seed always
+    gives the same result (unless the time budget runs out).
+
+    With batched=True, the trials are instead simulated together as one
+    array (see utils.forces.spring_batch) on the calling process, which is
+    several times faster than separate runs on small graphs. The default
+    (None) does this for graphs of fewer than BATCH_MAX_NODES nodes.
+
+    At most max_trials seeds are tried. The search also stops once a layout
+    reaches the lower bound on the number of crossings (see
+    crossing_lower_bound), or after patience trials in a row that do not
+    improve on the best so far (if patience is set).
+
+    With fast_paths, trees, cycles, grids and other planar graphs are instead
+    drawn directly, with no crossings and no search (see utils.families).
     """
 
-    def _iterate_layout(self, H, max_iter = 50):
+    def __init__(
+        self,
+        workers=1,
+        time_budget=None,
+        base_seed=None,
+        batched=None,
+        max_trials=50,
+        patience=None,
+        fast_paths=True,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.workers = workers
+        self.time_budget = time_budget
+        self.base_seed = base_seed
+        self.batched = batched
+        self.max_trials = max_trials
+        self.patience = patience
+        self.fast_paths = fast_paths
+
+    def _cache_params(self):
+        params = super()._cache_params()
+        params["base_seed"] = self.base_seed
+        params["batched"] = self.batched
+        params["max_trials"] = self.max_trials
+        params["patience"] = self.patience
+        params["fast_paths"] = self.fast_paths
+        return params
+
+    def _for_component(self, time_left=None):
+        tool = super()._for_component(time_left)
+        if self.time_budget is not None:
+            tool.time_budget = time_left
+        return tool
+
+    def _iterate_layout(self, H):
         """ Iterate repeatedly perform the layout until there are no or minimal
-        edge crossings.
+        edge crossings (see SearchController for when the search stops).
         """
         if self.seed is not None:
+            import networkx as nx
+
             return nx.spring_layout(H, center=[0, 0], seed=self.seed, iterations=500)
+
+        if self.fast_paths:
+            found = family_layout(H)
+            if found is not None:
+                family, layout = found
+                crossings = self._num_crossings(H, layout)
+                log.debug("Laid out as a %s graph (%d crossings)", family, crossings)
+                self._report("search", trials=0, crossings=crossings, stopped=family)
+                return layout
+
+        rng = np.random.RandomState(self.base_seed)
+        seeds = [int(seed) for seed in rng.randint(2**32, size=self.max_trials)]
+        search = SearchController(
+            time_budget=self.time_budget,
+            patience=self.patience,
+            lower_bound=crossing_lower_bound(H),
+        )
+        batched = self.batched
+        if batched is None:
+            batched = len(H) < BATCH_MAX_NODES
+        if batched:
+            layouts = self._batched_trials(H, seeds, search)
+        elif self.workers > 1:
+            layouts = self._parallel_trials(H, seeds, search)
         else:
-            layouts = []
-            seed = np.random.randint(2**32)
-            layout = nx.spring_layout(H, center=[0, 0], seed=seed, iterations=200)
-            num_crossings = self._num_crossings(H,layout)
-            n_iter = 0
-            while n_iter < max_iter:
-                seed = np.random.randint(2**32)
-                layout = nx.spring_layout(H, center=[0, 0], seed=seed, iterations=200)
-                num_crossings = self._num_crossings(H,layout)
-                if num_crossings == 0:
-                    return layout
-                n_iter += 1
-                layouts.append((layout,num_crossings))
-           
-            layouts = sorted(layouts,key=lambda x:x[1])
-            print("Min crossings found: {}".format(layouts[0][1]),flush=True)
-            return layouts[0][0]
-
-    def _num_crossings(self, H, layout):
+            layouts = self._serial_trials(H, seeds, search)
+
+        # stable sort, so ties go to the earliest seed
+        layouts = sorted(layouts, key=lambda x: x[1])
+        stopped = search.reason or "trials"
+        log.debug(
+            "Min crossings found: %d (%d trials, lower bound %d, stopped: %s)",
+            layouts[0][1], len(layouts), search.lower_bound, stopped,
+        )
+        self._report("search", trials=len(layouts), crossings=layouts[0][1], stopped=stopped)
+        return layouts[0][0]
+
+    def _trial_report(self, search, crossings):
+        self._report(
+            "trial",
+            trials=search.trials,
+            crossings=crossings,
+            best_crossings=search.best,
+            lower_bound=search.lower_bound,
+        )
+
+    def _serial_trials(self, H, seeds, search):
+        """ Run the seed trials one after another, until the search is done.
+        """
+        layouts = []
+        for seed in seeds:
+            layout, num_crossings = _spring_trial(H, seed)
+            layouts.append((layout, num_crossings))
+            search.record([num_crossings])
+            self._trial_report(search, num_crossings)
+            if search.done():
+                break
+        return layouts
+
+    def _batched_trials(self, H, seeds, search):
+        """ Simulate the seed trials in batches and score each batch's
+        crossings at once, until the search is done after a batch.
+
+        With a time budget, the first batch is a single trial, which measures
+        the cost of one; each later batch is only as large as fits in the
+        time left at the cost per trial of the batch before. (A layout does
+        not depend on the batch it is simulated in.)
+        """
+        nodes = list(H)
+        index = {node: i for i, node in enumerate(nodes)}
+        edges = np.array([(index[u], index[v]) for u, v in H.edges], dtype=np.int64).reshape(-1, 2)
+
+        layouts = []
+        step = batch_size(len(nodes))
+        if search.patience is not None:
+            # small enough batches to notice a plateau
+            step = min(step, max(search.patience, 1))
+        first = 0
+        cost = None
+        while first < len(seeds):
+            size = step
+            if search.time_budget is not None:
+                size = 1 if cost is None else min(step, search.trials_left(cost))
+                if size < 1:
+                    break
+            batch = seeds[first : first + size]
+            start = time.monotonic()
+            pos = spring_batch(edges, len(nodes), batch, iterations=200)
+            crossings = count_crossings_batch(edges, pos).tolist()
+            cost = (time.monotonic() - start) / len(batch)
+            first += len(batch)
+            layouts.extend((dict(zip(nodes, p)), c) for p, c in zip(pos, crossings))
+            search.record(crossings)
+            self._trial_report(search, min(crossings))
+            if search.done():
+                break
+        return layouts
+
+    def _parallel_trials(self, H, seeds, search):
+        """ Run the seed trials on a process pool. Once a layout reaching the
+        lower bound is found, the trials for later seeds are cancelled and
+        only the earlier ones (which could also reach it) are waited on.
+        When the search is otherwise done, all pending trials are cancelled.
+
+        Finished trials are recorded in seed order (the finished prefix of
+        the seeds), so that, as in _serial_trials, where the search stops
+        does not depend on the order in which the workers finish.
+        """
+        pool = get_process_pool(self.workers)
+        futures = {pool.submit(_spring_trial, H, seed): idx for idx, seed in enumerate(seeds)}
+        results = {}
+        recorded = 0
+        pending = set(futures)
+        first_optimal = len(seeds)
+        while pending:
+            # the budget only applies once there is something to return
+            timeout = None
+            if results:
+                timeout = search.time_left()
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                idx = futures[future]
+                results[idx] = future.result()
+                if results[idx][1] <= search.lower_bound:
+                    first_optimal = min(first_optimal, idx)
+            while recorded in results and not search.done():
+                search.record([results[recorded][1]])
+                self._trial_report(search, results[recorded][1])
+                recorded += 1
+
+            # drop trials that can no longer win
+            for future in list(pending):
+                if futures[future] > first_optimal:
+                    future.cancel()
+                    pending.discard(future)
+
+            if results and search.done() and search.reason != "optimal":
+                break
+            if not done and results:
+                # out of time
+                break
+
+        for future in pending:
+            future.cancel()
+        if search.reason in ("optimal", "plateau"):
+            # later seeds that happened to finish first are not part of the search
+            return [results[idx] for idx in range(recorded)]
+        return [results[idx] for idx in sorted(results)]
+
+    def _num_crossings(self, H, layout, method="auto"):
         """ Return number of edge crossings in a given layout.
         """
-        ncrossings = 0
-        edge_set = list(H.edges)
-        for i in range(len(edge_set)):
-            for j in range(len(edge_set)):
-                if i>j:
-                    edge1 = edge_set[i]
-                    edge2 = edge_set[j]
+        edges, pos = layout_arrays(H, layout)
+        return count_crossings(edges, pos, method=method)
 
-                    p1,p2 = layout[edge1[0]], layout[edge1[1]]
-                    q1,q2 = layout[edge2[0]], layout[edge2[1]]
+    def _get_layout(self, H, num_nodes):
+        """ Get layout and translate to centroid.
+        """
+        layout = self._iterate_layout(H)
+        return self._normalize(layout, num_nodes)
 
-                    unique_pts = np.unique(np.array([p1,p2,q1,q2]),axis=0)
-                    if len(unique_pts) < 4:
-                        continue
-                    if self._intersect(p1,p2,q1,q2):
-                        ncrossings+=1
-        return ncrossings
 
-    def _ccw(self,A,B,C):
-        """ Credit to Bryce Boe for this code.
-        """
-        return (C[1]-A[1]) * (B[0]-A[0]) > (B[1]-A[1]) * (C[0]-A[0])
+class ForceLayout(Layout):
+    """Force-directed (Fruchterman-Reingold) layout computed with numpy, with
+    the repulsion between nodes approximated on a hierarchy of grids (see
+    utils.forces). Much faster than SpringLayout on large graphs.
+
+    initial optionally maps nodes to starting positions (for example the
+    "nodes" of an earlier layout), to refine a layout instead of starting
+    from random positions. A lower temperature then keeps the result closer
+    to the starting positions.
+    """
+
+    def __init__(self, iterations=50, temperature=0.1, initial=None, **kwargs):
+        super().__init__(**kwargs)
+        self.iterations = iterations
+        self.temperature = temperature
+        self.initial = initial
+        if initial is not None:
+            # the starting positions are of the whole graph
+            self.components = False
+
+    def _cache_params(self):
+        params = super()._cache_params()
+        params["iterations"] = self.iterations
+        params["temperature"] = self.temperature
+        params["initial"] = None
+        if self.initial is not None:
+            initial = sorted((int(k), [float(x) for x in v]) for k, v in self.initial.items())
+            params["initial"] = hashlib.sha256(repr(initial).encode("utf-8")).hexdigest()
+        return params
+
+    def _batch_components(self, subs):
+        return _force_batch(self, subs, self.iterations)
 
-    def _intersect(self,A,B,C,D):
-        """ Credit to Bryce Boe for this code.
+    def _get_layout(self, H, num_nodes):
+        """ Get layout and translate to centroid.
         """
-        return self._ccw(A,C,D) != self._ccw(B,C,D) and self._ccw(A,B,C) != self._ccw(A,B,D)
+        nodes, edges = _edge_index(H)
+        pos = None
+        if self.initial is not None:
+            pos = np.full((len(nodes), 2), np.nan)
+            for i, node in enumerate(nodes.tolist()):
+                if node in self.initial:
+                    pos[i] = self.initial[node]
+
+        seed = 1 if self.seed is None else self.seed
+        pos = force_layout(
+            edges,
+            len(nodes),
+            pos=pos,
+            iterations=self.iterations,
+            seed=seed,
+            temperature=self.temperature,
+        )
+        layout = dict(zip(nodes.tolist(), pos))
+        return self._normalize(layout, num_nodes)
+
+
+class MultilevelLayout(Layout):
+    """Multilevel force-directed layout for large graphs: the graph is
+    coarsened by matching adjacent nodes, the coarsest graph is laid out and
+    the result is refined level by level (see utils.multilevel). Each level
+    runs until its energy changes by less than a fraction tol per iteration.
+    """
+
+    def __init__(self, tol=1e-3, **kwargs):
+        super().__init__(**kwargs)
+        self.tol = tol
+
+    def _cache_params(self):
+        params = super()._cache_params()
+        params["tol"] = self.tol
+        return params
+
+    def _batch_components(self, subs):
+        # small graphs are laid out on the coarsest level alone
+        return _force_batch(self, subs, COARSE_ITERATIONS)
 
     def _get_layout(self, H, num_nodes):
         """ Get layout and translate to centroid.
         """
-        layout = self._iterate_layout(H)
+        nodes, edges = _edge_index(H)
+        seed = 1 if self.seed is None else self.seed
+        pos = multilevel_layout(edges, len(nodes), seed=seed, tol=self.tol)
+        layout = dict(zip(nodes.tolist(), pos))
+        return self._normalize(layout, num_nodes)
 
-        # translate to centroid of non-self-loop nodes
-        centroid = sum([v for k, v in layout.items() if k < num_nodes]) / num_nodes
-        layout = {k: v - centroid for k, v in layout.items()}
 
-        # scale so it fits in unit circle
-        sc = max([np.linalg.norm(v) for k, v in layout.items() if k < num_nodes])
-        layout = {k: v / sc for k, v in layout.items()}
+def _edge_index(H):
+    """ The (sorted) nodes of a graph with integer nodes, and its edges as an
+    (E, 2) array of positions in that node array.
+    """
+    nodes = np.array(sorted(H.nodes), dtype=np.int64)
+    edges = np.array(list(H.edges), dtype=np.int64).reshape(-1, 2)
+    return nodes, np.searchsorted(nodes, edges)
 
-        return layout
+
+def dump_layout(layout, adj_mat=None):
+    """ Convert a layout dictionary to plain (json serializable) types. If
+    adj_mat is given, its edges are included, so that Layout.relayout can
+    tell which edges were changed.
+    """
+    data = {
+        "nodes": {int(k): [float(x) for x in v] for k, v in layout["nodes"].items()},
+        "loops": {int(k): float(v) for k, v in layout["loops"].items()},
+    }
+    if adj_mat is not None:
+        rows, cols = edge_arrays(adj_mat)
+        data["edges"] = np.stack([rows, cols], axis=1).tolist()
+    return data
+
+
+def load_layout(data):
+    """ Inverse of dump_layout (also accepts the string keys of json).
+    """
+    layout = {
+        "nodes": {int(k): np.array(v, dtype=np.float64) for k, v in data["nodes"].items()},
+        "loops": {int(k): float(v) for k, v in data.get("loops", {}).items()},
+    }
+    if data.get("edges") is not None:
+        layout["edges"] = data["edges"]
+    return layout
+
+
+# layout classes by the name used in the API
+LAYOUT_METHODS = {
+    "spring": SpringLayout,
+    "force": ForceLayout,
+    "multilevel": MultilevelLayout,
+}
+
+
+def _pool_layout(tool, adj_mat):
+    """ Compute a layout on a process pool (module level so it can be sent).
+    """
+    return tool.get_layout(adj_mat)
+
+
+def layout_many(adj_mats, method="spring", workers=1, cache=None, **layout_kwargs):
+    """ Layouts of many graphs with the same layout settings, in order.
+    Layouts found in cache are reused, identical graphs are only laid out
+    once, and the rest are computed on the shared process pool when workers
+    > 1 (each graph then runs its own min-crossing search serially) and
+    stored in the cache. The progress callback, if any, is only called for
+    layouts computed in this process.
+    """
+    progress = layout_kwargs.pop("progress", None)
+    tools = [LAYOUT_METHODS[method](**layout_kwargs) for _ in adj_mats]
+    layouts = [None] * len(adj_mats)
+
+    # graphs still to lay out, by cache key (or position, without a cache)
+    todo = {}
+    for idx, (tool, adj_mat) in enumerate(zip(tools, adj_mats)):
+        key = idx
+        if cache is not None:
+            key = cache.key(adj_mat, tool._cache_params())
+            layouts[idx] = cache.get(key)
+        if layouts[idx] is None:
+            todo.setdefault(key, []).append(idx)
+
+    if workers > 1 and len(todo) > 1:
+        pool = get_process_pool(workers)
+        futures = {key: pool.submit(_pool_layout, tools[idx[0]], adj_mats[idx[0]]) for key, idx in todo.items()}
+        computed = {key: future.result() for key, future in futures.items()}
+    else:
+        computed = {}
+        for key, idx in todo.items():
+            tools[idx[0]].progress = progress
+            computed[key] = tools[idx[0]].get_layout(adj_mats[idx[0]])
+
+    for key, idx in todo.items():
+        if cache is not None:
+            cache.put(key, computed[key])
+        for i in idx:
+            layouts[i] = computed[key]
+    return layouts
@@ -0,0 +1,212 @@
+""" Request metrics in the Prometheus text format.
+
+Only what the API needs is implemented: counters, gauges (set directly or read
+from a callback when scraped) and histograms, each with optional labels, in a
+registry that renders them all for a /metrics endpoint.
+
+Timings of the stages of a request (parse, layout, ...) are recorded with
+stage(), which adds to the stage histogram and also to the timings of the
+current thread, for a Server-Timing header.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# histogram buckets (upper bounds) in seconds
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class Metric:
+    """A named metric with a value per combination of label values. If
+    callback is given, the values are instead read from it when the metric
+    is rendered: it returns a dict from label values (tuples) to values, or
+    a number for a metric without labels.
+    """
+
+    kind = ""
+
+    def __init__(self, name, help, labels=(), callback=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self.callback = callback
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes the labels {self.labelnames}, got {tuple(labels)}.")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def samples(self):
+        """(suffix, label values, extra labels, value) of every sample."""
+        if self.callback is not None:
+            values = self.callback()
+            if not isinstance(values, dict):
+                values = {(): values}
+            return [("", key, (), value) for key, value in values.items()]
+        with self._lock:
+            return [("", key, (), value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(
+                f"{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}"
+            )
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=TIME_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        samples = []
+        for key, counts, total in values:
+            for bound, count in zip(self.buckets, counts):
+                samples.append(("_bucket", key, (("le", _format_value(bound)),), count))
+            samples.append(("_sum", key, (), total))
+            samples.append(("_count", key, (), counts[-1]))
+        return samples
+
+
+class Registry:
+    """The metrics exposed on one endpoint."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=(), callback=None):
+        return self.register(Counter(name, help, labels, callback=callback))
+
+    def gauge(self, name, help, labels=(), callback=None):
+        return self.register(Gauge(name, help, labels, callback=callback))
+
+    def histogram(self, name, help, labels=(), buckets=TIME_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets=buckets))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram(
+    "tikz_stage_seconds", "Time spent in each stage of rendering a graph.", labels=("stage",)
+)
+
+# timings of the stages run by the current thread, for Server-Timing
+_timings = threading.local()
+
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as the given stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        if getattr(_timings, "stages", None) is not None:
+            _timings.stages.append((name, elapsed))
+
+
+def timed_iter(chunks, name):
+    """Yield from the iterator chunks, timing the time spent producing the
+    chunks (not consuming them) as the given stage once it is exhausted.
+    """
+    chunks = iter(chunks)
+    elapsed = 0.0
+    while True:
+        start = time.perf_counter()
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            break
+        finally:
+            elapsed += time.perf_counter() - start
+        yield chunk
+    STAGE_SECONDS.observe(elapsed, stage=name)
+
+
+def start_timings():
+    """Start collecting the stage timings of the current thread."""
+    _timings.stages = []
+
+
+def pop_timings():
+    """Stop collecting and return the (stage, seconds) pairs of the current
+    thread since start_timings.
+    """
+    stages = getattr(_timings, "stages", None) or []
+    _timings.stages = None
+    return stages
+
+
+def server_timing(timings):
+    """Server-Timing header value for a list of (stage, seconds)."""
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings)
@@ -0,0 +1,119 @@
+""" Multilevel force-directed layout for large graphs.
+
+The graph is coarsened repeatedly, by merging matched pairs of adjacent nodes
+(and leaves into their neighbours), until it is small. The coarsest graph is
+laid out from random positions; every finer level then starts from the layout
+of the level above, with each node placed (slightly jittered) where its merged
+node was, and is only refined. The global shape is found on the small graphs,
+so the large ones need few iterations, and each level stops as soon as its
+energy has settled.
+"""
+import numpy as np
+
+from utils.forces import force_layout
+
+# stop coarsening at this many nodes
+COARSEST_NODES = 50
+
+# or when a level keeps more than this fraction of the nodes
+MIN_SHRINK = 0.9
+
+# rounds of matching per level
+MATCHING_ROUNDS = 3
+
+# iteration cap of the coarsest level
+COARSE_ITERATIONS = 300
+
+# the finer levels get at most REFINE_WORK / N iterations, within these bounds
+REFINE_WORK = 100000
+MIN_REFINE_ITERATIONS = 5
+MAX_REFINE_ITERATIONS = 50
+
+# largest first step on the finer levels, in ideal edge lengths
+REFINE_TEMPERATURE = 2
+
+
+def undirected_edges(edges):
+    """The distinct edges (i, j) with i < j, ignoring direction and loops."""
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    edges = np.sort(edges[edges[:, 0] != edges[:, 1]], axis=1)
+    return np.unique(edges, axis=0)
+
+
+def coarsen(edges, num_nodes, rng):
+    """Merge nodes of a graph with undirected edges (i < j). Returns the
+    number of merged nodes and an array mapping each node to its merged node.
+
+    Each round, every unmatched node picks the unmatched neighbour with the
+    lowest random priority and pairs that pick each other are matched.
+    Unmatched leaves are then merged into their neighbour.
+    """
+    u = np.concatenate([edges[:, 0], edges[:, 1]])
+    v = np.concatenate([edges[:, 1], edges[:, 0]])
+    partner = np.arange(num_nodes)
+    matched = np.zeros(num_nodes, dtype=bool)
+    for _ in range(MATCHING_ROUNDS):
+        free = ~matched[u] & ~matched[v]
+        a, b = u[free], v[free]
+        if not len(a):
+            break
+        priority = rng.rand(num_nodes)
+        order = np.lexsort((priority[b], a))
+        a, b = a[order], b[order]
+        first = np.concatenate([[True], a[1:] != a[:-1]])
+        choice = np.full(num_nodes, -1)
+        choice[a[first]] = b[first]
+
+        picked = a[first]
+        mutual = picked[choice[choice[picked]] == picked]
+        partner[mutual] = choice[mutual]
+        matched[mutual] = True
+
+    rep = np.minimum(np.arange(num_nodes), partner)
+    degree = np.bincount(u, minlength=num_nodes)
+    neighbour = np.zeros(num_nodes, dtype=np.int64)
+    neighbour[u] = v
+    leaves = np.flatnonzero(~matched & (degree == 1))
+    rep[leaves] = rep[neighbour[leaves]]
+
+    _, mapping = np.unique(rep, return_inverse=True)
+    return int(mapping.max()) + 1 if num_nodes else 0, mapping
+
+
+def _unit(pos):
+    """Translate and scale positions into the unit square."""
+    pos = pos - pos.min(axis=0)
+    return pos / max(np.ptp(pos, axis=0).max(), 1e-12)
+
+
+def multilevel_layout(edges, num_nodes, seed=None, tol=1e-3):
+    """Lay out a graph with num_nodes nodes and an (E, 2) array of edges by
+    coarsening and refining (see the module docstring). tol is the relative
+    energy change at which each level stops. Returns an (N, 2) array.
+    """
+    rng = np.random.RandomState(seed)
+    levels = []
+    edges = undirected_edges(edges)
+    n = num_nodes
+    while n > COARSEST_NODES:
+        num_coarse, mapping = coarsen(edges, n, rng)
+        if num_coarse > MIN_SHRINK * n:
+            break
+        levels.append((edges, n, mapping))
+        edges = undirected_edges(mapping[edges])
+        n = num_coarse
+
+    pos = force_layout(edges, n, iterations=COARSE_ITERATIONS, seed=seed, tol=tol)
+    for edges, n, mapping in reversed(levels):
+        # jitter by a fraction of the ideal edge length, so merged nodes split
+        pos = _unit(pos)[mapping] + (rng.rand(n, 2) - 0.5) * 0.1 * np.sqrt(1.0 / n)
+        pos = force_layout(
+            edges,
+            n,
+            pos=pos,
+            iterations=int(np.clip(REFINE_WORK / n, MIN_REFINE_ITERATIONS, MAX_REFINE_ITERATIONS)),
+            seed=seed,
+            temperature=REFINE_TEMPERATURE * np.sqrt(1.0 / n),
+            tol=tol,
+        )
+    return pos
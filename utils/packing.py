@@ -0,0 +1,52 @@
+""" Packing of the layouts of the connected components of a graph.
+
+Each component is laid out on its own and then treated as a rectangle (its
+bounding box plus a margin). The rectangles are packed into shelves (rows),
+tallest first, filling each shelf left to right up to a width chosen to make
+the whole packing roughly square (next fit decreasing height). This is
+O(C log C) for C components and wastes little space when most components are
+of similar height, as with forests and graphs made of many small motifs.
+"""
+import math
+
+import numpy as np
+
+# space left between components, in the units of the layouts
+PACKING_GAP = 1.0
+
+
+def shelf_pack(sizes, gap=PACKING_GAP, aspect=1.0):
+    """ Lower left corners at which to place rectangles of the given (C, 2)
+    widths and heights, so that none overlap (with gap between them) and
+    the packing has about the given width to height ratio.
+    """
+    sizes = np.asarray(sizes, dtype=np.float64).reshape(-1, 2) + gap
+    if not len(sizes):
+        return np.zeros((0, 2))
+    area = sizes.prod(axis=1).sum()
+    shelf_width = max(math.sqrt(area * aspect), sizes[:, 0].max())
+
+    order = np.argsort(-sizes[:, 1], kind="stable")
+    corners = np.zeros_like(sizes)
+    x = y = shelf_height = 0.0
+    for idx in order.tolist():
+        width, height = sizes[idx]
+        if x > 0 and x + width > shelf_width:
+            # start a new shelf above the last one
+            y += shelf_height
+            x = shelf_height = 0.0
+        corners[idx] = (x, y)
+        x += width
+        shelf_height = max(shelf_height, height)
+    return corners
+
+
+def pack_components(positions, gap=PACKING_GAP, aspect=1.0):
+    """ Translate the (N_c, 2) position arrays of the components so that
+    their bounding boxes are shelf packed (see shelf_pack). Returns the
+    translated arrays.
+    """
+    lo = np.array([pos.min(axis=0) for pos in positions]).reshape(-1, 2)
+    hi = np.array([pos.max(axis=0) for pos in positions]).reshape(-1, 2)
+    corners = shelf_pack(hi - lo, gap=gap, aspect=aspect)
+    return [pos - lo[idx] + corners[idx] for idx, pos in enumerate(positions)]
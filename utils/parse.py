@@ -1,43 +1,248 @@
 import numpy as np
-import csv
-from io import StringIO
+import gzip
+from html import escape
+from utils.adjacency import BitAdjacency, EdgeLabels, SparseAdjacency, as_adjacency, is_sparse
 
-SUPPORTED_FORMATS = ['csv','mathematica','python']
+SUPPORTED_FORMATS = ['csv','mathematica','python','edgelist']
 
-def read_adj_mat_txt(txt,fmt='csv',directed=True):
-    """ Read adjacency matrix from a given text format.
+GZIP_MAGIC = b"\x1f\x8b"
+
+# byte classes used by the tokenizer
+_WHITESPACE = np.zeros(256, dtype=bool)
+_WHITESPACE[list(b" \t\r\n")] = True
+_DELIMITERS = _WHITESPACE.copy()
+_DELIMITERS[list(b",[]{}\"'")] = True
+
+class MatrixFormatError(ValueError):
+    """ Raised for malformed matrix text, with the line and column (both
+    starting at 1) where the problem was found.
+    """
+    def __init__(self, msg, line=None, column=None):
+        if line is not None:
+            msg = f"{msg} (line {line}, column {column})"
+        super().__init__(msg)
+        self.line = line
+        self.column = column
+
+def decode_upload(data):
+    """ Return the bytes of an uploaded matrix (str or bytes), decompressing
+    it if it is gzipped.
+    """
+    if isinstance(data, str):
+        return data.encode("utf-8")
+    data = bytes(data)
+    if data[:2] == GZIP_MAGIC:
+        data = gzip.decompress(data)
+    return data
+
+def read_adj_mat_txt(txt,fmt='csv',directed=True,with_labels=False):
+    """ Read adjacency matrix from a given text format. txt may be a string
+    or bytes, and bytes may be gzip compressed.
+
+    With with_labels, return the matrix and the edge labels: the entries of
+    a weighted matrix (any entry other than 0 or 1), or the third column of
+    an edge list, as EdgeLabels (None if there are none).
     """
     assert fmt in SUPPORTED_FORMATS, f"Unrecognized matrix format {fmt}."
+    data = decode_upload(txt)
+
+    if fmt == 'edgelist':
+        data, labels = read_edge_list_txt(data.decode("utf-8"), with_labels=True)
+    else:
+        buf = np.frombuffer(data, dtype=np.uint8)
+        if fmt == 'csv':
+            data = _tokenize_csv(buf)
+        else:
+            data = _tokenize_nested(buf)
+        labels = matrix_labels(data) if with_labels else None
 
-    if fmt == 'csv':
-        f = StringIO(txt)
-        data = np.array(list(csv.reader(f, delimiter=',')),dtype=np.int64)
-        data = process_matrix(data,directed=directed)
-        return data 
-
-    if fmt == 'mathematica':
-        txt = txt.replace("{",'[').replace("}","]")
-
-    list_txt = txt[1:-1].split(',')
-    list_txt = [i
-        .replace(']','')
-        .replace('[','')
-        .replace('"','')
-        .strip() for i in list_txt
-    ]
-
-    data = np.array(list_txt,dtype=np.float64)
-    size = int(np.sqrt(len(data)))
-    data = np.reshape(data,(size,len(data)//size))
-    
     data = process_matrix(data,directed=directed)
+    if with_labels:
+        return data, labels
     return data
 
+def matrix_labels(mat):
+    """ EdgeLabels with the entries of a weighted matrix, or None if it only
+    has 0/1 entries.
+    """
+    if is_sparse(mat) or ((mat == 0) | (mat == 1)).all():
+        return None
+    return EdgeLabels.from_matrix(mat)
+
+def _position(buf, pos):
+    """ Line and column (from 1) of byte pos in buf.
+    """
+    newlines = np.flatnonzero(buf[:pos] == ord("\n"))
+    line = len(newlines) + 1
+    column = pos - (newlines[-1] if len(newlines) else -1)
+    return line, int(column)
+
+def _error(msg, buf, pos):
+    return MatrixFormatError(msg, *_position(buf, min(pos, max(len(buf) - 1, 0))))
+
+def _tokenize_csv(buf):
+    """ Parse comma separated rows, one per (non-blank) line.
+    """
+    buf = np.concatenate([buf, np.frombuffer(b"\n", dtype=np.uint8)])
+    is_newline = buf == ord("\n")
+
+    # a line is a row if it has anything other than whitespace
+    newlines = np.flatnonzero(is_newline)
+    content_before = np.searchsorted(np.flatnonzero(~_WHITESPACE[buf]), newlines)
+    has_content = np.diff(content_before, prepend=0) > 0
+    row_end = np.zeros(len(buf), dtype=bool)
+    row_end[newlines[has_content]] = True
+
+    separators = (buf == ord(",")) | row_end
+    return _parse_fields(buf, separators, row_end)
+
+def _tokenize_nested(buf):
+    """ Parse a python ([[...],[...]]) or mathematica ({{...},{...}}) nested
+    list. A flat list of N^2 entries is also accepted.
+    """
+    opens = (buf == ord("[")) | (buf == ord("{"))
+    closes = (buf == ord("]")) | (buf == ord("}"))
+    depth = np.cumsum(opens.astype(np.int64) - closes)
+
+    if not len(buf) or not opens.any():
+        raise MatrixFormatError("Expected a bracketed list.")
+    if depth.min() < 0:
+        raise _error("Unmatched closing bracket", buf, int(np.argmax(depth < 0)))
+    if depth[-1] != 0:
+        raise _error("Unclosed bracket", buf, len(buf) - 1)
+    max_depth = int(depth.max())
+    if max_depth > 2:
+        raise _error("Matrix is nested too deeply", buf, int(np.argmax(depth > 2)))
+
+    # entries may only appear inside rows
+    entries = ~_DELIMITERS[buf]
+    outside = entries & (depth < max_depth)
+    if outside.any():
+        raise _error("Entry outside of a row", buf, int(np.argmax(outside)))
+
+    row_end = closes & (depth == max_depth - 1)
+    separators = ((buf == ord(",")) & (depth == max_depth)) | row_end
+    data = _parse_fields(buf, separators, row_end)
+
+    if max_depth == 1:
+        # flat list of size^2 entries
+        size = int(np.sqrt(data.size))
+        if size * size != data.size:
+            raise MatrixFormatError(f"A flat list must have a square number of entries, got {data.size}.")
+        data = data.reshape(size, size)
+    return data
+
+def _parse_fields(buf, separators, row_end):
+    """ Convert the entries between separators to an array with one row per
+    row_end. Every field must hold exactly one number and every row must
+    have the same length.
+    """
+    # each field must contain exactly one token
+    is_token = ~_DELIMITERS[buf]
+    starts = np.flatnonzero(is_token & ~np.concatenate([[False], is_token[:-1]]))
+    field_of_sep = np.cumsum(separators, dtype=np.int32)
+    num_fields = int(field_of_sep[-1])
+    sep_pos = np.flatnonzero(separators)
+
+    token_field = field_of_sep[starts]
+    counts = np.bincount(token_field, minlength=num_fields)
+    if len(counts) > num_fields:
+        raise _error("Entry after the end of the matrix", buf, int(starts[np.argmax(token_field >= num_fields)]))
+    bad = np.flatnonzero(counts != 1)
+    if len(bad):
+        field = int(bad[0])
+        if counts[field] == 0:
+            raise _error("Empty entry", buf, int(sep_pos[field]))
+        raise _error("Missing separator between entries", buf, int(starts[np.flatnonzero(token_field == field)[1]]))
+
+    # every row must have the same number of fields
+    ends_row = row_end[sep_pos]
+    row_lengths = np.bincount(np.cumsum(ends_row) - ends_row)
+    if not len(row_lengths):
+        raise MatrixFormatError("Matrix is empty.")
+    if (row_lengths != row_lengths[0]).any():
+        row = int(np.argmax(row_lengths != row_lengths[0]))
+        raise _error(
+            f"Row {row + 1} has {row_lengths[row]} entries but row 1 has {row_lengths[0]}",
+            buf,
+            int(sep_pos[row_lengths[:row].sum()]),
+        )
+
+    values = _parse_numbers(buf, starts, is_token)
+    return values.reshape(len(row_lengths), -1)
+
+def _parse_numbers(buf, starts, is_token):
+    """ Bulk convert the tokens of buf (starting at starts) to numbers.
+    """
+    # fast path for the usual 0/1 matrices: every token is a single digit
+    # (buf always ends in a delimiter, so starts + 1 is in range)
+    if len(starts) and not is_token[starts + 1].any():
+        digits = buf[starts] - np.uint8(ord("0"))
+        if (digits <= 9).all():
+            return digits
+
+    clean = np.where(_DELIMITERS[buf], np.uint8(ord(" ")), buf).tobytes()
+    if not len(starts):
+        return np.zeros(0)
+    try:
+        values = np.fromstring(clean, sep=" ")
+    except ValueError:
+        values = None
+    if values is not None and len(values) == len(starts):
+        return values
+
+    # find the first bad token by bisecting on prefixes of the text
+    lo, hi = 0, len(starts)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        end = starts[mid + 1] if mid + 1 < len(starts) else len(clean)
+        try:
+            ok = len(np.fromstring(clean[:end], sep=" ")) == mid + 1
+        except ValueError:
+            ok = False
+        if ok:
+            lo = mid + 1
+        else:
+            hi = mid
+    raise _error("Entry is not a number", buf, int(starts[min(lo, len(starts) - 1)]))
+
+def read_edge_list_txt(txt,with_labels=False):
+    """ Read a sparse adjacency matrix from an edge list: one "i j" or "i,j"
+    edge per line, optionally followed by a label (or weight) for the edge.
+    A line with a single index declares a (possibly isolated) node. Blank
+    lines and lines starting with # are ignored. With with_labels, also
+    return the labels as EdgeLabels (None if there are none).
+    """
+    edges = []
+    labels = []
+    num_nodes = 0
+    for line in txt.splitlines():
+        line = line.split('#')[0].replace(',',' ').split()
+        if not line:
+            continue
+        idx = [int(i) for i in line[:2]]
+        num_nodes = max(num_nodes, max(idx) + 1)
+        if len(idx) == 2:
+            edges.append(idx)
+            if len(line) > 2:
+                labels.append((idx[0], idx[1], " ".join(line[2:])))
+    adj_mat = SparseAdjacency.from_edges(edges, num_nodes=num_nodes)
+    if not with_labels:
+        return adj_mat
+    return adj_mat, EdgeLabels.from_edges(labels, num_nodes) if labels else None
+
 def process_matrix(mat,directed=True):
     """ Apply post-processing steps to matrix (binarize, assert symmetric, have at least two nodes,etc)
+    Sparse matrices (scipy.sparse or SparseAdjacency) are kept sparse; dense
+    ones are binarized into a BitAdjacency.
     """
-    mat = (mat != 0).astype(np.int_)
+    if is_sparse(mat):
+        mat = as_adjacency(mat)
+        assert len(mat) > 1, "Graph must have at least two nodes"
+        return mat
+
     assert mat.shape[0] == mat.shape[1],"Adjacency matrix must be square."
+    mat = BitAdjacency.from_dense(mat)
     """ Decided to take this check out
     if not directed:
         assert ((mat.T - mat) == np.zeros_like(mat)).all(),"Non-directed graphs must have a symmetric matrix."
@@ -66,7 +271,7 @@ def svg_to_html(svg_b64,tikz=None):
     return s
 
 def tikz_to_html(tikz):
-    s = tikz.replace("\n","<br>")
+    s = escape(tikz).replace("\n","<br>")
     pad= 10
     html = f'<p style="border: 1px solid black;font-family:Courier New; font-size:12; padding-top: {pad}; padding-bottom:{pad}; padding-left: {pad}; padding-right: {pad}"> {s} </p>'
     html += '<h5><i>Tip: if your graph is too small after you paste into your document, adjust the "Scale" parameter under Line Style.</i></h5>'
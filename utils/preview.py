@@ -0,0 +1,368 @@
+""" Draw a graph as SVG directly, without LaTeX, for quick previews.
+
+The drawing follows what TikZ makes of the code written by TikzGrapher, from
+the same layout and styles: node shapes and sizes (with their scale and outer
+sep), straight edges, edges bent left by 30 degrees, self-loops with their in
+and out angles and distance, and arrow tips at the end of the edge or at the
+arrow mark location along it. Fonts and arrow tip shapes are approximated, so
+the result is close to, but not exactly, the compiled document.
+
+All edges are handled as arrays of cubic Bezier curves (straight lines are
+curves with their control points on the line), so the geometry is computed
+with a few numpy operations however many edges there are.
+"""
+import re
+
+import numpy as np
+
+from utils.adjacency import classify_edges, neighbor_counts
+
+# TeX points per centimetre (TikZ coordinates are in cm, the SVG is in pt)
+PT_PER_CM = 72.27 / 2.54
+
+# inner sep of a TikZ node, and the size of a digit at 10pt
+INNER_SEP = 3.33
+DIGIT_WIDTH = 5.0
+DIGIT_HEIGHT = 6.44
+
+# TikZ "looseness=1": control points at this fraction of the distance
+LOOSENESS = 0.3915
+
+BEND_ANGLE = 30
+
+# points sampled along each edge to place arrow marks by arc length
+ARC_SAMPLES = 32
+
+# xcolor's named colours, which do not all agree with the svg ones
+COLORS = {
+    "black": (0, 0, 0),
+    "white": (1, 1, 1),
+    "red": (1, 0, 0),
+    "green": (0, 1, 0),
+    "blue": (0, 0, 1),
+    "cyan": (0, 1, 1),
+    "magenta": (1, 0, 1),
+    "yellow": (1, 1, 0),
+    "gray": (0.5, 0.5, 0.5),
+    "darkgray": (0.25, 0.25, 0.25),
+    "lightgray": (0.75, 0.75, 0.75),
+    "brown": (0.75, 0.5, 0.25),
+    "lime": (0.75, 1, 0),
+    "olive": (0.5, 0.5, 0),
+    "orange": (1, 0.5, 0),
+    "pink": (1, 0.75, 0.75),
+    "purple": (0.75, 0, 0.25),
+    "teal": (0, 0.5, 0.5),
+    "violet": (0.5, 0, 0.5),
+}
+
+# colours passed on to the svg viewer as they are: other names, and hex
+SVG_COLOR = re.compile(r"[A-Za-z]+|#[0-9A-Fa-f]{3}|#[0-9A-Fa-f]{6}")
+
+# colour of anything that is neither
+FALLBACK_COLOR = "#000000"
+
+
+def svg_color(color):
+    """SVG colour of an xcolor expression: a name, or a mix such as red!30
+    (30% red, 70% white) or red!30!blue.
+    """
+    parts = str(color).replace(" ", "").split("!")
+    if parts[0] not in COLORS:
+        # not something xcolor-like; let the svg viewer try, unless it could
+        # break out of the attribute it is written to
+        return color if SVG_COLOR.fullmatch(str(color)) else FALLBACK_COLOR
+    rgb = np.array(COLORS[parts[0]], dtype=float)
+    for i in range(1, len(parts), 2):
+        other = COLORS.get(parts[i + 1], (1, 1, 1)) if i + 1 < len(parts) else (1, 1, 1)
+        try:
+            frac = float(parts[i]) / 100
+        except ValueError:
+            return FALLBACK_COLOR
+        if not 0 <= frac <= 1:
+            return FALLBACK_COLOR
+        rgb = frac * rgb + (1 - frac) * np.array(other)
+    return "#" + "".join(f"{int(round(c * 255)):02x}" for c in rgb)
+
+
+def _fmt(x):
+    return f"{x:.3f}".rstrip("0").rstrip(".")
+
+
+def _unit(angle):
+    """Unit vectors at the given angles (in degrees)."""
+    angle = np.radians(angle)
+    return np.stack([np.cos(angle), np.sin(angle)], axis=-1)
+
+
+class NodeShapes:
+    """Size of each node as drawn by TikZ, in pt, for border computations."""
+
+    def __init__(self, nodestyle, labels):
+        scale = nodestyle.scale
+        if nodestyle.outer_sep is None:
+            outer_sep = min(0.2, 0.1 / scale)
+        else:
+            outer_sep = nodestyle.outer_sep
+        chars = np.array([len(str(label)) for label in labels], dtype=float)
+        half_width = scale * (chars * DIGIT_WIDTH / 2 + INNER_SEP)
+        half_height = scale * (np.where(chars > 0, DIGIT_HEIGHT / 2, 0) + INNER_SEP)
+        self.circle = nodestyle.shape == "circle"
+        if self.circle:
+            half_width = half_height = np.hypot(half_width, half_height)
+        self.half_width = half_width
+        self.half_height = half_height
+        self.outer_sep = scale * outer_sep * PT_PER_CM
+
+    def border(self, nodes, pos, direction):
+        """Point on the (outer) border of each node in the given direction."""
+        hw = self.half_width[nodes]
+        hh = self.half_height[nodes]
+        if self.circle:
+            dist = hw
+        else:
+            dx = np.maximum(np.abs(direction[:, 0]), 1e-12)
+            dy = np.maximum(np.abs(direction[:, 1]), 1e-12)
+            dist = np.minimum(hw / dx, hh / dy)
+        return pos[nodes] + direction * (dist + self.outer_sep)[:, None]
+
+
+def _curves(shapes, pos, src, dst, out_angle=None, in_angle=None, distance=None):
+    """Cubic Bezier curves (E, 4, 2) from node src to node dst. Without
+    angles, the edges are straight; otherwise they leave src at out_angle and
+    enter dst from in_angle (degrees), with control points at the given
+    distance (by default the TikZ looseness times the distance between the
+    ends).
+    """
+    if out_angle is None:
+        delta = pos[dst] - pos[src]
+        direction = delta / np.maximum(np.linalg.norm(delta, axis=1), 1e-12)[:, None]
+        start = shapes.border(src, pos, direction)
+        end = shapes.border(dst, pos, -direction)
+        return np.stack([start, (2 * start + end) / 3, (start + 2 * end) / 3, end], axis=1)
+
+    out_dir = _unit(out_angle)
+    in_dir = _unit(in_angle)
+    start = shapes.border(src, pos, out_dir)
+    end = shapes.border(dst, pos, in_dir)
+    if distance is None:
+        distance = LOOSENESS * np.linalg.norm(end - start, axis=1)
+    distance = np.broadcast_to(distance, (len(src),))[:, None]
+    return np.stack([start, start + distance * out_dir, end + distance * in_dir, end], axis=1)
+
+
+def _bezier(curves, t):
+    """Points and tangents of the curves at the parameters t (E, T)."""
+    p0, p1, p2, p3 = (curves[:, i, None, :] for i in range(4))
+    t = t[..., None]
+    s = 1 - t
+    point = s**3 * p0 + 3 * s * s * t * p1 + 3 * s * t * t * p2 + t**3 * p3
+    tangent = 3 * s * s * (p1 - p0) + 6 * s * t * (p2 - p1) + 3 * t * t * (p3 - p2)
+    return point, tangent
+
+
+def _mark_positions(curves, location):
+    """Point and unit direction at a fraction location of the length of
+    each curve.
+    """
+    t = np.linspace(0, 1, ARC_SAMPLES + 1)
+    points, _ = _bezier(curves, np.broadcast_to(t, (len(curves), len(t))))
+    length = np.concatenate(
+        [np.zeros((len(curves), 1)), np.cumsum(np.linalg.norm(np.diff(points, axis=1), axis=2), axis=1)],
+        axis=1,
+    )
+    target = location * length[:, -1:]
+    idx = np.clip((length < target).sum(axis=1), 1, ARC_SAMPLES)
+    rows = np.arange(len(curves))
+    lo, hi = length[rows, idx - 1], length[rows, idx]
+    frac = (target[:, 0] - lo) / np.maximum(hi - lo, 1e-12)
+    point, tangent = _bezier(curves, (t[idx - 1] + frac * (t[idx] - t[idx - 1]))[:, None])
+    tangent = tangent[:, 0]
+    return point[:, 0], tangent / np.maximum(np.linalg.norm(tangent, axis=1), 1e-12)[:, None]
+
+
+def _arrow_tips(points, directions, linestyle, centered=False):
+    """SVG for arrow tips facing directions, with their points at points or,
+    if centered (as for markings), their middles.
+    """
+    lw = linestyle.line_width
+    tip = linestyle.arrow_tip
+    if tip == ">":
+        length, width, filled, inset = 2.2 + 2.5 * lw, 0.8, False, 0
+    elif tip == "stealth":
+        length, width, filled, inset = 3 + 4.5 * lw, 0.8, True, 0.3
+    else:
+        length, width, filled, inset = 3 + 4.5 * lw, 0.75, True, 0
+    if centered:
+        points = points + directions * length / 2
+
+    back = points - directions * length
+    normal = np.stack([-directions[:, 1], directions[:, 0]], axis=1) * (length * width / 2)
+    left, right = back + normal, back - normal
+    color = svg_color(linestyle.color)
+    if filled:
+        notch = points - directions * length * (1 - inset)
+        paths = (
+            f"M{_fmt(l[0])},{_fmt(-l[1])}L{_fmt(p[0])},{_fmt(-p[1])}L{_fmt(r[0])},{_fmt(-r[1])}"
+            f"L{_fmt(n[0])},{_fmt(-n[1])}Z"
+            for l, p, r, n in zip(left, points, right, notch)
+        )
+        return f'<path fill="{color}" stroke="none" d="{"".join(paths)}"/>\n'
+    paths = (
+        f"M{_fmt(l[0])},{_fmt(-l[1])}L{_fmt(p[0])},{_fmt(-p[1])}L{_fmt(r[0])},{_fmt(-r[1])}"
+        for l, p, r in zip(left, points, right)
+    )
+    return (
+        f'<path fill="none" stroke="{color}" stroke-width="{_fmt(lw)}" '
+        f'stroke-linecap="round" stroke-linejoin="round" d="{"".join(paths)}"/>\n'
+    )
+
+
+def _edge_curves(layout, adj_matrix, shapes, pos, linestyle):
+    """The curves of all the edges, as TikzGrapher draws them, with the
+    self-loops last, the (source, target) of each curve and the number of
+    self-loops.
+    """
+    asym_idx, sym_idx = classify_edges(adj_matrix)
+    curves = [_curves(shapes, pos, np.asarray(asym_idx[0]), np.asarray(asym_idx[1]))]
+    sources, targets = [np.asarray(asym_idx[0])], [np.asarray(asym_idx[1])]
+
+    src, dst = np.asarray(sym_idx[0]), np.asarray(sym_idx[1])
+    loop = src == dst
+    src, dst, loops = src[~loop], dst[~loop], src[loop]
+    if linestyle.directed:
+        # both directions, bent left
+        src, dst = np.concatenate([src, dst]), np.concatenate([dst, src])
+        delta = pos[dst] - pos[src]
+        angle = np.degrees(np.arctan2(delta[:, 1], delta[:, 0]))
+        curves.append(_curves(shapes, pos, src, dst, angle + BEND_ANGLE, angle + 180 - BEND_ANGLE))
+    else:
+        curves.append(_curves(shapes, pos, src, dst))
+    sources += [src, loops]
+    targets += [dst, loops]
+
+    if len(loops):
+        # as in LineStyle.render_selfloop
+        angle = np.array([layout["loops"][node] for node in loops.tolist()], dtype=float)
+        width = np.minimum(40, 360 / np.maximum(neighbor_counts(adj_matrix)[loops], 1))
+        distance = linestyle.selfloop_size * 9 / 10 * PT_PER_CM
+        curves.append(_curves(shapes, pos, loops, loops, angle - width, angle + width, distance))
+    edges = np.stack([np.concatenate(sources), np.concatenate(targets)], axis=1).astype(np.int64)
+    return np.concatenate([c.reshape(-1, 4, 2) for c in curves]), edges, len(loops)
+
+
+def _escape(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _edge_label_texts(curves, edges, edge_labels, directed, font_size):
+    """Text elements of the edge labels, at the middle of each curve above
+    it, along it (TikZ's above, sloped).
+    """
+    text = edge_labels.lookup(edges[:, 0], edges[:, 1])
+    if not directed:
+        # an undirected line is labelled from either direction
+        reverse = edge_labels.lookup(edges[:, 1], edges[:, 0])
+        text = [a or b for a, b in zip(text, reverse)]
+    keep = np.flatnonzero([bool(t) for t in text])
+    if not len(keep):
+        return ""
+
+    points, directions = _mark_positions(curves[keep], 0.5)
+    # keep the text upright
+    directions = np.where(directions[:, :1] < 0, -directions, directions)
+    normals = np.stack([-directions[:, 1], directions[:, 0]], axis=1)
+    points = points + normals * float(font_size) * 0.6
+    angles = 0.0 - np.degrees(np.arctan2(directions[:, 1], directions[:, 0]))
+    return "".join(
+        f'<text x="{_fmt(x)}" y="{_fmt(-y)}" transform="rotate({_fmt(a)} {_fmt(x)} {_fmt(-y)})" '
+        f'font-family="serif" font-size="{font_size}" text-anchor="middle" dominant-baseline="central">'
+        f"{_escape(text[i])}</text>\n"
+        for i, (x, y), a in zip(keep.tolist(), points, angles)
+    )
+
+
+def render_svg(layout, adj_matrix, nodestyle, linestyle, labels=None, edge_labels=None, padding=4):
+    """SVG (str) of a graph from its layout (see Layout.get_layout), styled
+    like TikzGrapher would with nodestyle and linestyle. edge_labels is an
+    EdgeLabels or None.
+    """
+    n = len(adj_matrix)
+    if labels is None:
+        labels = [""] * n
+    elif labels == "numbered":
+        labels = [str(i) for i in range(n)]
+    labels = [str(label) for label in labels]
+
+    pos = np.array([layout["nodes"][k] for k in range(n)], dtype=float).reshape(n, 2) * PT_PER_CM
+    shapes = NodeShapes(nodestyle, labels)
+    curves, edges, num_loops = _edge_curves(layout, adj_matrix, shapes, pos, linestyle)
+
+    # bounding box of the nodes and edges (the control points bound the curves)
+    lo = np.minimum(
+        (pos - np.stack([shapes.half_width, shapes.half_height], axis=1)).min(axis=0, initial=np.inf),
+        curves.reshape(-1, 2).min(axis=0, initial=np.inf),
+    ) - padding
+    hi = np.maximum(
+        (pos + np.stack([shapes.half_width, shapes.half_height], axis=1)).max(axis=0, initial=-np.inf),
+        curves.reshape(-1, 2).max(axis=0, initial=-np.inf),
+    ) + padding
+    width, height = hi - lo
+
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n',
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{_fmt(width)}pt" height="{_fmt(height)}pt" '
+        f'viewBox="{_fmt(lo[0])} {_fmt(-hi[1])} {_fmt(width)} {_fmt(height)}">\n',
+    ]
+
+    # edges (y is flipped: TikZ points up, svg down)
+    line_color = svg_color(linestyle.color)
+    d = "".join(
+        f"M{_fmt(c[0, 0])},{_fmt(-c[0, 1])}C{_fmt(c[1, 0])},{_fmt(-c[1, 1])} "
+        f"{_fmt(c[2, 0])},{_fmt(-c[2, 1])} {_fmt(c[3, 0])},{_fmt(-c[3, 1])}"
+        for c in curves
+    )
+    parts.append(f'<path fill="none" stroke="{line_color}" stroke-width="{_fmt(linestyle.line_width)}" d="{d}"/>\n')
+
+    # arrow tips, at the end or at the mark location (self-loops have none)
+    arrows = curves[: len(curves) - num_loops]
+    if linestyle.directed and len(arrows):
+        if linestyle.arrow_mark_location == 1:
+            tangent = arrows[:, 3] - arrows[:, 2]
+            directions = tangent / np.maximum(np.linalg.norm(tangent, axis=1), 1e-12)[:, None]
+            parts.append(_arrow_tips(arrows[:, 3], directions, linestyle))
+        else:
+            points, directions = _mark_positions(arrows, linestyle.arrow_mark_location)
+            parts.append(_arrow_tips(points, directions, linestyle, centered=True))
+
+    # edge labels, scaled by the line width as in LineStyle
+    if edge_labels is not None and len(edge_labels):
+        parts.append(
+            _edge_label_texts(curves, edges, edge_labels, linestyle.directed, _fmt(10 * linestyle.line_width))
+        )
+
+    # nodes, with their labels
+    fill = svg_color(nodestyle.fill_color)
+    stroke = svg_color(nodestyle.line_color)
+    stroke_width = _fmt(0.4 * nodestyle.scale)
+    font_size = _fmt(10 * nodestyle.scale)
+    for (x, y), hw, hh, label in zip(pos, shapes.half_width, shapes.half_height, labels):
+        if shapes.circle:
+            parts.append(
+                f'<circle cx="{_fmt(x)}" cy="{_fmt(-y)}" r="{_fmt(hw)}" fill="{fill}" '
+                f'stroke="{stroke}" stroke-width="{stroke_width}"/>\n'
+            )
+        else:
+            parts.append(
+                f'<rect x="{_fmt(x - hw)}" y="{_fmt(-y - hh)}" width="{_fmt(2 * hw)}" height="{_fmt(2 * hh)}" '
+                f'fill="{fill}" stroke="{stroke}" stroke-width="{stroke_width}"/>\n'
+            )
+        if label:
+            label = _escape(label)
+            parts.append(
+                f'<text x="{_fmt(x)}" y="{_fmt(-y)}" font-family="serif" font-size="{font_size}" '
+                f'text-anchor="middle" dominant-baseline="central">{label}</text>\n'
+            )
+
+    parts.append("</svg>\n")
+    return "".join(parts)
@@ -0,0 +1,293 @@
+""" Compile LaTeX documents to SVG with a pool of pre-warmed TeX workers.
+
+Starting pdflatex and loading the standalone class and TikZ dominates the cost
+of compiling a small graph. Each worker therefore keeps a pdflatex process
+running that has already read the preamble and is waiting on its terminal
+(stdin) for the rest of the document. When a job arrives, the body of the
+document is written to stdin and the process finishes the run; a fresh process
+is then warmed up for the next job while the worker is idle.
+
+Every process runs in its own scratch directory (on tmpfs when available),
+which is removed when the process is done with, so concurrent jobs never share
+files and nothing is left behind when a compile fails.
+"""
+import atexit
+import glob
+import hashlib
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import Future
+
+from utils.metrics import stage
+
+# the first line of every document produced by TikzGrapher.to_doc
+DOC_PREAMBLE = "\\documentclass[tikz]{standalone}"
+
+JOBNAME = "job"
+
+
+def scratch_root():
+    """Directory in which job scratch directories are made: $TIKZ_SCRATCH_DIR
+    if set, otherwise /dev/shm (tmpfs) if usable, otherwise the system default.
+    """
+    root = os.environ.get("TIKZ_SCRATCH_DIR")
+    if root:
+        return root
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return None
+
+
+class RenderError(Exception):
+    """Raised when a document fails to compile."""
+
+
+def _log_tail(workdir, lines=20):
+    """Last lines of the pdflatex log, for error messages."""
+    try:
+        with open(os.path.join(workdir, JOBNAME + ".log"), "r", errors="replace") as fp:
+            return "".join(fp.readlines()[-lines:])
+    except OSError:
+        return ""
+
+
+class TexProcess:
+    """A pdflatex process that has (optionally) read the preamble and waits
+    for the rest of a document on stdin. Each process compiles one document,
+    in a scratch directory of its own that is removed by close().
+    """
+
+    def __init__(self, preamble=DOC_PREAMBLE):
+        self.preamble = preamble
+        self.workdir = tempfile.mkdtemp(prefix="tikz_graph_", dir=scratch_root())
+        try:
+            self.proc = subprocess.Popen(
+                ["pdflatex", "-interaction=scrollmode", f"-jobname={JOBNAME}"],
+                cwd=self.workdir,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        except OSError:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+            raise
+        if preamble is not None:
+            self._write(preamble + "\n")
+
+    def _write(self, txt):
+        try:
+            self.proc.stdin.write(txt.encode("utf-8"))
+            self.proc.stdin.flush()
+        except BrokenPipeError:
+            pass
+
+    def accepts(self, doc):
+        """Whether this process can compile doc (its preamble matches)."""
+        if self.proc.poll() is not None:
+            return False
+        if self.preamble is None:
+            return True
+        return doc.startswith(self.preamble + "\n")
+
+    def compile(self, doc, timeout):
+        """Compile doc and return the path of the pdf."""
+        body = doc if self.preamble is None else doc[len(self.preamble) + 1 :]
+        # the timeout covers writing the body too, in case pdflatex stalls
+        # before reading all of it; closing stdin (which communicate does)
+        # ends the run even if the document has no \end{document}
+        try:
+            self.proc.communicate((body + "\n").encode("utf-8"), timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.kill()
+            raise RenderError(f"pdflatex timed out after {timeout}s.")
+        returncode = self.proc.returncode
+
+        pdf = os.path.join(self.workdir, JOBNAME + ".pdf")
+        if returncode != 0 or not os.path.exists(pdf):
+            raise RenderError(
+                f"pdflatex failed with exit code {returncode}:\n{_log_tail(self.workdir)}"
+            )
+        return pdf
+
+    def kill(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+            self.proc.wait()
+
+    def close(self):
+        """Kill the process (if still running) and remove its directory."""
+        self.kill()
+        if self.proc.stdin is not None and not self.proc.stdin.closed:
+            try:
+                self.proc.stdin.close()
+            except BrokenPipeError:
+                pass
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def pdf_to_svg(pdf, svg, timeout, all_pages=False):
+    """Convert a pdf to svg with pdf2svg. With all_pages, svg is a pattern
+    such as "page-%d.svg" and every page is written to its own file.
+    """
+    # remove svg files left by an earlier conversion, so that they cannot pass
+    # the check below (or the page count in TexWorkerPool._compile) as output
+    stale = glob.glob(glob.escape(svg).replace("%d", "[0-9]*")) if all_pages else [svg]
+    for path in stale:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    try:
+        proc = subprocess.run(
+            ["pdf2svg", pdf, svg] + (["all"] if all_pages else []),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            timeout=timeout,
+        )
+    except subprocess.TimeoutExpired:
+        raise RenderError(f"pdf2svg timed out after {timeout}s.")
+    if proc.returncode != 0 or not os.path.exists(svg % 1 if all_pages else svg):
+        raise RenderError(
+            f"pdf2svg failed with exit code {proc.returncode}: {proc.stderr.decode(errors='replace')}"
+        )
+
+
+class TexWorkerPool:
+    """Bounded pool of TeX workers that take compile jobs from a queue.
+
+    Each of the size worker threads keeps one warm pdflatex process. Jobs
+    (LaTeX documents) are compiled to SVG, with timeout seconds allowed for
+    each of pdflatex and pdf2svg; a multi-page document can be compiled in
+    one run and split into an SVG per page. Identical documents submitted
+    while one is already queued or compiling share its result instead of
+    compiling again. The threads are started on the first submitted job.
+    """
+
+    def __init__(self, size=2, timeout=30, preamble=DOC_PREAMBLE):
+        self.size = size
+        self.timeout = timeout
+        self.preamble = preamble
+        self._jobs = queue.Queue()
+        self._threads = []
+        self._inflight = {}
+        self._lock = threading.Lock()
+        atexit.register(self.shutdown)
+
+    def submit(self, doc, pages=None):
+        """Queue a document for compilation. Returns a Future of the svg
+        bytes, or with pages (the number of pages of the document) of a list
+        of the svg bytes of each page.
+        """
+        key = hashlib.sha256(doc.encode("utf-8")).hexdigest() + f":{pages}"
+        with self._lock:
+            self._start()
+            future = self._inflight.get(key)
+            if future is not None:
+                return future
+            future = Future()
+            self._inflight[key] = future
+        future.add_done_callback(lambda f: self._done(key, f))
+        self._jobs.put((doc, pages, future))
+        return future
+
+    def render(self, doc):
+        """Compile a document to svg bytes, blocking until done."""
+        return self.submit(doc).result()
+
+    def render_pages(self, doc, pages):
+        """Compile a document of the given number of pages (such as one made
+        by graph.pages_doc) in a single run, and return the svg bytes of each
+        page, blocking until done.
+        """
+        return self.submit(doc, pages=pages).result()
+
+    def in_flight(self):
+        """Number of distinct documents queued or compiling."""
+        with self._lock:
+            return len(self._inflight)
+
+    def shutdown(self):
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._jobs.put(None)
+        for thread in threads:
+            thread.join()
+
+    def _done(self, key, future):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def _start(self):
+        while len(self._threads) < self.size:
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _spawn(self, preamble):
+        try:
+            return TexProcess(preamble=preamble)
+        except OSError:
+            # pdflatex missing; the job will report the error
+            return None
+
+    def _work(self):
+        tex = self._spawn(self.preamble)
+        try:
+            while True:
+                job = self._jobs.get()
+                if job is None:
+                    break
+                doc, pages, future = job
+                if not future.set_running_or_notify_cancel():
+                    continue
+
+                # fall back to a cold process if the warm one can't take it
+                if tex is None or not tex.accepts(doc):
+                    if tex is not None:
+                        tex.close()
+                    tex = self._spawn(None)
+
+                try:
+                    if tex is None:
+                        raise RenderError("pdflatex could not be started.")
+                    future.set_result(self._compile(tex, doc, pages))
+                except Exception as e:
+                    future.set_exception(e)
+                finally:
+                    if tex is not None:
+                        tex.close()
+                    tex = None
+
+                # warm up the next process while idle
+                tex = self._spawn(self.preamble)
+        finally:
+            if tex is not None:
+                tex.close()
+
+    def _compile(self, tex, doc, pages=None):
+        with stage("pdflatex"):
+            pdf = tex.compile(doc, self.timeout)
+        if pages is None:
+            svg = os.path.join(tex.workdir, JOBNAME + ".svg")
+            with stage("pdf2svg"):
+                pdf_to_svg(pdf, svg, self.timeout)
+            with open(svg, "rb") as fp:
+                return fp.read()
+
+        pattern = os.path.join(tex.workdir, JOBNAME + "-%d.svg")
+        with stage("pdf2svg"):
+            pdf_to_svg(pdf, pattern, self.timeout, all_pages=True)
+        svgs = []
+        for page in range(1, pages + 1):
+            try:
+                with open(pattern % page, "rb") as fp:
+                    svgs.append(fp.read())
+            except OSError:
+                raise RenderError(f"Expected {pages} pages, the document has {page - 1}.")
+        return svgs
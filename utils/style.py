@@ -30,13 +30,19 @@ class NodeStyle:
 
     def scope(self, nodestr, outer_sep=None):
         """The scope wrapper for all nodes in the drawing."""
+        return self.scope_begin() + nodestr + self.scope_end()
+
+    def scope_begin(self):
+        """Opening of the scope wrapper."""
         if self.outer_sep is None:
             outer_sep = min(0.2, 0.1 / self.scale)
         else:
             outer_sep = self.outer_sep
-        rval = f"\\begin{{scope}}[every node/.style={{ shape={self.shape},draw={self.line_color},fill={self.fill_color},scale={self.scale},outer sep={outer_sep}cm }}]\n"
-        rval += nodestr + "\n\\end{scope}\n\n"
-        return rval
+        return f"\\begin{{scope}}[every node/.style={{ shape={self.shape},draw={self.line_color},fill={self.fill_color},scale={self.scale},outer sep={outer_sep}cm }}]\n"
+
+    def scope_end(self):
+        """Closing of the scope wrapper."""
+        return "\n\\end{scope}\n\n"
 
     def header(self):
         """Any required settings/macros outside of tikzpicture environment."""
@@ -63,9 +69,13 @@ class LineStyle:
         self.line_width = line_width
         self.selfloop_size = selfloop_size
         self.arrow_tip = arrow_tip
+        self._compile()
 
-    def render_line(self, node1, node2, bend=None, label=None):
-        """Tikz code for a line between two named nodes."""
+    def _compile(self):
+        """Precompute the parts of each line that only depend on the style,
+        so they are not reformatted for every edge. Call again after changing
+        the style attributes.
+        """
         if not self.directed:
             arrow_style = ""
         elif self.arrow_mark_location == 1:
@@ -73,6 +83,13 @@ class LineStyle:
         else:
             arrow_style = "[ar]"
 
+        self._draw = f"\\draw [line width={self.line_width}, {self.color}]"
+        self._line_prefix = f"{self._draw} {arrow_style} ("
+        self._label_prefix = f"node [scale={self.line_width},above,sloped] {{ "
+        self._loop_distance = self.selfloop_size * 9
+
+    def render_line(self, node1, node2, bend=None, label=None):
+        """Tikz code for a line between two named nodes."""
         bend_str = ""
         if bend is not None:
             if bend == "left":
@@ -84,29 +101,37 @@ class LineStyle:
 
         labelstr = ""
         if label is not None:
-            labelstr = f"node [scale={self.line_width},above,sloped] {{ {label} }}"
+            labelstr = f"{self._label_prefix}{label} }}"
 
-        linestr = f"\\draw [line width={self.line_width}, {self.color}] {arrow_style} ({node1}) to {bend_str} {labelstr} ({node2});\n"
+        linestr = f"{self._line_prefix}{node1}) to {bend_str} {labelstr} ({node2});\n"
         return linestr
 
     def render_selfloop(self, node, angle, num_neighbors=2, label=None):
         """Tikz code for a self loop on a named node."""
-        distance = self.selfloop_size * 9
+        distance = self._loop_distance
         angle_width = min(40, 360 / num_neighbors)
         in_ = angle + angle_width
         out_ = angle - angle_width
 
         labelstr = ""
         if label is not None:
-            labelstr = f"node [scale={self.line_width},above,sloped] {{ {label} }}"
+            labelstr = f"{self._label_prefix}{label} }}"
 
-        line_str = f"\\draw [line width={self.line_width}, {self.color}] ({node}) edge[out={out_},in={in_},distance={distance}mm] {labelstr} ({node});\n"
+        line_str = f"{self._draw} ({node}) edge[out={out_},in={in_},distance={distance}mm] {labelstr} ({node});\n"
         return line_str
 
     def scope(self, nodestr):
         """The scope wrapper for all lines in the drawing."""
         # rval = "\\begin{scope}\n "+nodestr+"\n\\end{scope}\n"
-        return nodestr
+        return self.scope_begin() + nodestr + self.scope_end()
+
+    def scope_begin(self):
+        """Opening of the scope wrapper."""
+        return ""
+
+    def scope_end(self):
+        """Closing of the scope wrapper."""
+        return ""
 
     def header(self):
         """Any required settings/macros outside of tikzpicture environment."""